@@ -0,0 +1,7 @@
+"""
+asyncio counterparts of the components, built on ``redis.asyncio``.
+
+The classes have the same names and parameters as the synchronous ones, e.g.
+``redis_streams.aio.consumer.Consumer``, but the methods talking to Redis are
+coroutines.
+"""
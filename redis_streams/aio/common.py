@@ -0,0 +1,83 @@
+import logging
+import typing
+from typing import Dict, List, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from typing_extensions import Any
+
+from redis_streams import PACKAGE
+
+
+class BaseRedisClass:
+    def __init__(self, redis_conn: Redis, stream: str, consumer_group: str):
+        """
+        The constructor can't talk to Redis, the consumer group is created by
+        the first call which needs it or by awaiting :meth:`prepare_redis`
+        """
+        self.redis_conn = redis_conn
+        self.stream = stream
+        self.consumer_group = consumer_group
+        self.logger = logging.getLogger(f"{PACKAGE}_{self.__class__.__name__}")
+        self._prepared = False
+
+    async def _create_consumer_group(self) -> None:
+        """
+        XGROUP CREATE mystream mygroup 0-0 MKSTREAM
+        see redis_streams.common.BaseRedisClass._create_consumer_group
+        """
+        try:
+            await self.redis_conn.xgroup_create(
+                name=self.stream, groupname=self.consumer_group, id="0-0", mkstream=True
+            )
+            self.logger.debug(f"{self.consumer_group} consumer group has been created")
+        except ResponseError as exc:
+            if "BUSYGROUP" in str(exc):
+                self.logger.debug(
+                    f"{self.consumer_group} consumer group already exists"
+                )
+            else:
+                raise
+
+    async def prepare_redis(self) -> None:
+        await self._create_consumer_group()
+        self._prepared = True
+
+    async def _ensure_prepared(self) -> None:
+        if not self._prepared:
+            await self.prepare_redis()
+
+
+class ConsumerAndMonitor(BaseRedisClass):
+    @typing.no_type_check
+    async def get_pending_items_of_consumer(
+        self, item_count: int, consumer_id: str, group: Optional[str] = None
+    ) -> List[Dict[Any, Any]]:
+        """
+        See redis_streams.common.ConsumerAndMonitor.get_pending_items_of_consumer
+        :param group: defaults to the consumer group of the instance
+        """
+        await self._ensure_prepared()
+        return await self.redis_conn.xpending_range(
+            name=self.stream,
+            groupname=group or self.consumer_group,
+            min="-",
+            max="+",
+            count=item_count,
+            consumername=consumer_id,
+        )
+
+    async def remove_consumer(
+        self, consumer_to_delete: str, group: Optional[str] = None
+    ) -> int:
+        """
+        Removes the consumer from the consumer group,  returns the number of lost
+        messages as int
+        :param group: defaults to the consumer group of the instance
+        """
+        _resp = await self.redis_conn.xgroup_delconsumer(
+            name=self.stream,
+            groupname=group or self.consumer_group,
+            consumername=consumer_to_delete,
+        )
+        return _resp  # type: ignore[return-value]
@@ -0,0 +1,147 @@
+import os
+from datetime import UTC, datetime
+from typing import Iterable, List, Optional, Union
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from redis_streams.aio.common import ConsumerAndMonitor
+from redis_streams.consumer import ConsumerBase, MsgId, RedisMsg
+
+
+class Consumer(ConsumerAndMonitor, ConsumerBase):
+    def __init__(
+        self,
+        redis_conn: Redis,
+        stream: str,
+        consumer_group: str,
+        consumer_id: Optional[Union[str, int]] = None,
+        batch_size: int = 2,
+        max_wait_time_ms: int = 10000,
+        poll_time_ms: int = 1000,
+        cleanup_on_exit=True,
+    ):
+        """
+        asyncio counterpart of redis_streams.consumer.Consumer with the same
+        batching and maximum wait time semantics. Many consumers can share one
+        event loop, each of them should have its own consumer_id (the default is
+        unique per instance) and the connection pool of redis_conn should allow
+        a connection for each blocking consumer. Without decode_responses the
+        messages are RawRedisMsg instances, like in case of the synchronous one.
+        :param batch_size: number of items to collect before returning
+        :param  poll_time_ms: poll time of one iteration
+        :param max_wait_time_ms: Approximate maximum time to wait for the batch to be
+                                  complete. Call returns if time pass even if the batch
+                                  is not full. 0 means: no return
+        """
+        super().__init__(
+            redis_conn=redis_conn, stream=stream, consumer_group=consumer_group
+        )
+        if consumer_id is None:
+            consumer_id = f"{os.getpid()}{id(self)}"
+        self.assigned_messages = 0
+        self.consumer_id = consumer_id
+        self.batch_size = batch_size
+        self.poll_time_ms = poll_time_ms
+        self.max_wait_time_ms = max_wait_time_ms
+        self.hard_stop_time = datetime.now(UTC)
+        self.cleanup_on_exit = cleanup_on_exit
+        self._set_connection_options()
+        self._set_hard_stop_time()
+
+    async def get_items(self) -> List[RedisMsg]:
+        await self._ensure_prepared()
+        self._set_hard_stop_time()
+        self.assigned_messages = await self._get_no_of_messages_already_assigned()
+        while self._wait_for_more_messages():
+            _requested_messages = max(1, self.batch_size - self.assigned_messages)
+            self.logger.debug("Requested messages: %s", _requested_messages)
+            self.assigned_messages += await self._get_new_items_to_consumer(
+                requested_messages=_requested_messages
+            )
+        return await self._get_messages_from_stream(
+            latest_or_new=MsgId.already_delivered.value
+        )
+
+    async def _get_new_items_to_consumer(self, requested_messages):
+        items = await self._get_messages_from_stream(
+            latest_or_new=MsgId.never_delivered.value,
+            requested_messages=requested_messages,
+        )
+        self.logger.debug(f"Received {len(items)} new items from stream")
+        return len(items)
+
+    async def _get_no_of_messages_already_assigned(self):
+        messages = await self.get_pending_items_of_consumer(
+            item_count=self.batch_size, consumer_id=self.consumer_id
+        )
+        return len(messages)
+
+    async def _get_messages_from_stream(
+        self,
+        latest_or_new: str = MsgId.never_delivered.value,
+        requested_messages=None,
+        wait_time=None,
+    ) -> List[RedisMsg]:
+        """
+        XREADGROUP GROUP group consumer COUNT n BLOCK ms STREAMS stream id
+        latest_or_new: see MsgId
+        """
+        if requested_messages is None:
+            requested_messages = self.batch_size
+        try:
+            items = await self.redis_conn.xreadgroup(
+                groupname=self.consumer_group,
+                consumername=self.consumer_id,  # type: ignore[arg-type]
+                count=requested_messages,
+                streams={self.stream: latest_or_new},
+                block=wait_time if wait_time else self.poll_time_ms,
+                noack=False,
+            )
+            self.logger.debug(f"Got {items}")
+            return self._transform_redis_resp_to_objects(items)
+        except ResponseError:
+            self.logger.warning(
+                f"Failed to get messages from {self.stream} from "
+                f"{self.consumer_group} as {self.consumer_id}",
+                exc_info=True,
+            )
+            return []
+
+    async def remove_item_from_consumer_group(self, item_id: str):
+        """
+        Acknowledge a message so it is removed from the consumer group's
+        pending entries list (PEL). It does **not** delete the message from the
+        stream.
+
+        :param item_id: id to acknowledge
+        """
+        await self.redis_conn.xack(self.stream, self.consumer_group, item_id)
+
+    async def ack_many(self, item_ids: Iterable[str], delete: bool = False) -> int:
+        """
+        Acknowledge several messages with a single XACK, optionally deleting
+        them in the same pipeline, see redis_streams.consumer.Consumer.ack_many
+
+        :return: number of acknowledged messages
+        """
+        item_ids = list(item_ids)
+        if not item_ids:
+            return 0
+        if delete:
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.xack(self.stream, self.consumer_group, *item_ids)
+            pipe.xdel(self.stream, *item_ids)
+            acknowledged, _ = await pipe.execute()
+        else:
+            acknowledged = await self.redis_conn.xack(
+                self.stream, self.consumer_group, *item_ids
+            )
+        return acknowledged
+
+    async def ack_batch(
+        self, messages: Iterable[RedisMsg], delete: bool = False
+    ) -> int:
+        return await self.ack_many(
+            [message.msgid for message in messages], delete=delete
+        )
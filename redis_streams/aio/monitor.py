@@ -0,0 +1,133 @@
+from typing import Any, Dict, Optional
+
+from redis.asyncio import Redis
+
+from redis_streams.aio.common import ConsumerAndMonitor
+from redis_streams.monitor import MonitorBase
+
+
+class Monitor(ConsumerAndMonitor, MonitorBase):
+    def __init__(
+        self,
+        redis_conn: Redis,
+        stream: str,
+        consumer_group: str,
+        batch_size: int = 2,
+        min_wait_time_ms: int = 1000,
+        idle_time_ms_warning_threshold: int = 30000,
+    ):
+        """
+        asyncio counterpart of redis_streams.monitor.Monitor, see the parameters
+        there. The messages of an unhealthy consumer are spread across the healthy
+        consumers of its own group the same way, but in one XPENDING page. Paging
+        by claim_page_size, reclaim_stale_messages and the dead-letter policy are
+        only available in the synchronous Monitor
+        """
+        super().__init__(
+            redis_conn=redis_conn, stream=stream, consumer_group=consumer_group
+        )
+        self.batch_size = batch_size
+        self.min_wait_time_ms = min_wait_time_ms
+        self.idle_time_ms_warning_threshold = idle_time_ms_warning_threshold
+        self._reset_consumers()
+
+    async def cleanup_unhealthy_consumer(
+        self, pending_count: int, consumer_to_delete: str, group: Optional[str] = None
+    ) -> None:
+        """
+        1. query the pending items of consumer
+        2. assign items to the healthy consumers of its group
+        3. remove consumer
+
+        See redis_streams.monitor.Monitor.cleanup_unhealthy_consumer
+        :param group: consumer group of the consumer, defaults to the one of the
+                      monitor
+        """
+        group = group or self.consumer_group
+        candidates = self._candidates(group)
+        if not candidates:
+            self.logger.warning(
+                f"No healthy consumer in {group} to take over the messages of "
+                f"{consumer_to_delete}, keep it"
+            )
+            return
+        # 1
+        messages_to_cleanup = [
+            message.get("message_id")
+            for message in await self.get_pending_items_of_consumer(
+                item_count=pending_count, consumer_id=consumer_to_delete, group=group
+            )
+        ]
+        shares = self._distribute(messages_to_cleanup, candidates)
+        if shares:
+            # 2
+            pipe = self.redis_conn.pipeline(transaction=False)
+            for consumer_id, items in shares.items():
+                pipe.xclaim(
+                    name=self.stream,
+                    groupname=group,
+                    consumername=consumer_id,
+                    message_ids=items,
+                    min_idle_time=self.min_wait_time_ms,
+                    justid=True,
+                )
+            moved: Dict[str, int] = {}
+            for (consumer_id, items), claimed in zip(
+                shares.items(), await pipe.execute()
+            ):
+                # too fresh messages are not claimed
+                candidates[consumer_id].pending_items -= len(items) - len(claimed)
+                moved[consumer_id] = len(claimed)
+            self.logger.debug(
+                f"Moved {sum(moved.values())} items from "
+                f"{consumer_to_delete} to {moved}"
+            )
+        # 3
+        resp = await self.remove_consumer(
+            consumer_to_delete=consumer_to_delete, group=group
+        )
+        if resp > 0:
+            self.logger.error(f"{resp} messages lost")
+
+    async def assign_items_to_active_consumer(
+        self, items: list, group: str, consumer_to_assign: str
+    ) -> Any:
+        return await self.redis_conn.xclaim(
+            name=self.stream,
+            groupname=group,
+            consumername=consumer_to_assign,
+            message_ids=items,
+            min_idle_time=self.min_wait_time_ms,
+        )
+
+    async def collect_monitoring_data(self, auto_cleanup=True) -> None:
+        await self._ensure_prepared()
+        self._reset_consumers()
+        for group in await self.redis_conn.xinfo_groups(self.stream):
+            if group["consumers"] > 0:
+                for consumer in await self.redis_conn.xinfo_consumers(
+                    name=self.stream, groupname=group["name"]
+                ):
+                    self._add_consumer(group["name"], consumer)
+        self._select_consumer_to_assign()
+        if auto_cleanup:
+            if any(
+                self.healthy_consumers.get(group) for group in self.unhealthy_consumers
+            ):
+                await self.cleanup()
+            elif not len(self.unhealthy_consumers):
+                self.logger.debug("No cleanup, as no unhealthy consumers")
+            else:
+                self.logger.debug("No cleanup, as no healthy consumer to assign")
+        else:
+            self.logger.debug("Auto cleanup disabled")
+
+    async def cleanup(self):
+        self.logger.debug("Cleaning up unhealthy consumers")
+        for group in self.unhealthy_consumers.keys():
+            for consumer_id, pending_items in self.unhealthy_consumers[group].items():
+                await self.cleanup_unhealthy_consumer(
+                    consumer_to_delete=consumer_id,
+                    pending_count=pending_items,
+                    group=group,
+                )
@@ -0,0 +1,121 @@
+"""
+asyncio Redis-stream producer, see :mod:`redis_streams.producer`.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional, Union
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from redis_streams import PACKAGE
+from redis_streams.codecs import Codec, get_codec
+from redis_streams.compression import CompressionStats, Compressor, get_compressor
+from redis_streams.producer import MsgData, PartialPublishError, ProducerBase
+from redis_streams.producer import Producer as SyncProducer
+
+
+class Producer(ProducerBase):
+    """
+    Publishes messages to a Redis Stream.
+
+    :param redis_conn: A ``redis.asyncio.Redis`` connection instance.
+    :param stream: Name of the target stream.
+    :param maxlen: If set, the stream will be trimmed to approximately this
+        length after each ``add`` call (uses Redis ``MAXLEN ~`` trimming).
+    :param codec: Payload codec, see :class:`redis_streams.producer.Producer`.
+    :param compression: Payload compression, see
+        :class:`redis_streams.producer.Producer`.
+    :param compression_threshold: Minimum payload size to compress in bytes.
+    """
+
+    def __init__(
+        self,
+        redis_conn: Redis,
+        stream: str,
+        maxlen: Optional[int] = None,
+        codec: Optional[Union[str, Codec]] = None,
+        compression: Optional[Union[str, Compressor]] = None,
+        compression_threshold: int = 1024,
+    ):
+        if compression is not None and codec is None:
+            raise ValueError("Compression requires a codec")
+        self.redis_conn = redis_conn
+        self.stream = stream
+        self.maxlen = maxlen
+        self.codec = get_codec(codec) if codec is not None else None
+        self.compressor = (
+            get_compressor(compression) if compression is not None else None
+        )
+        self.compression_threshold = compression_threshold
+        self.compression_stats = CompressionStats()
+        self.logger = logging.getLogger(PACKAGE)
+
+    async def add(self, data: MsgData) -> str:
+        """
+        Publish a single message to the stream.
+
+        :param data: Field/value mapping to insert.
+        :returns: The message ID assigned by Redis.
+        """
+        msg_id: str = await self._xadd(self.redis_conn, self._encode(data))
+        self.logger.debug("Published message %s to %s", msg_id, self.stream)
+        return msg_id
+
+    async def _send_chunk(self, chunk: List[MsgData]) -> List[Union[str, Exception]]:
+        encoded = self._encode_each(chunk)
+        valid = [fields for fields in encoded if not isinstance(fields, Exception)]
+        responses: List[Union[str, Exception]]
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for fields in valid:
+            self._xadd(pipe, fields)
+        try:
+            responses = await pipe.execute(raise_on_error=False) if valid else []
+        except RedisError as exc:
+            responses = [exc] * len(valid)
+        sent = iter(responses)
+        return [
+            fields if isinstance(fields, Exception) else next(sent)
+            for fields in encoded
+        ]
+
+    async def add_many(
+        self, messages: Iterable[MsgData], chunk_size: int = 500
+    ) -> List[Optional[str]]:
+        """
+        Publish many messages with pipelined XADD commands, one round trip per
+        ``chunk_size`` messages, see :meth:`redis_streams.producer.Producer.add_many`
+
+        :raises PartialPublishError: if any message failed to be published
+        """
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be at least 1")
+        msg_ids: List[Optional[str]] = []
+        failures: Dict[int, Exception] = {}
+        for chunk in SyncProducer._chunks(messages, chunk_size):
+            for resp in await self._send_chunk(chunk):
+                if isinstance(resp, Exception):
+                    failures[len(msg_ids)] = resp
+                    msg_ids.append(None)
+                else:
+                    msg_ids.append(resp)
+        self.logger.debug("Published %s messages to %s", len(msg_ids), self.stream)
+        if failures:
+            self.logger.warning(
+                "Failed to publish %s of %s messages to %s",
+                len(failures),
+                len(msg_ids),
+                self.stream,
+            )
+            raise PartialPublishError(msg_ids=msg_ids, failures=failures)
+        return msg_ids
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"redis_conn={self.redis_conn},"
+            f"stream={self.stream},"
+            f"maxlen={self.maxlen},"
+            f"codec={self.codec},"
+            f"compression={self.compressor})"
+        )
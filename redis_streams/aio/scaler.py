@@ -0,0 +1,96 @@
+from typing import Tuple
+
+from redis.asyncio import Redis
+
+from redis_streams.aio.common import BaseRedisClass
+from redis_streams.scaler import Scaler as SyncScaler
+from redis_streams.snapshot import (
+    lag_from_info,
+    lag_from_scan,
+    lag_scan_args,
+    snapshot_from_info,
+)
+
+
+class Scaler(BaseRedisClass):
+    def __init__(
+        self,
+        redis_conn: Redis,
+        stream: str,
+        consumer_group: str,
+        max_lag_scan: int = 1000,
+    ):
+        """
+        asyncio counterpart of redis_streams.scaler.Scaler, see the parameters
+        there
+        """
+        super().__init__(
+            redis_conn=redis_conn, stream=stream, consumer_group=consumer_group
+        )
+        self.stream_lenght = 0
+        self.stream_pending = 0
+        self.lenght_pending_rate = 0
+        self.consumers_of_group = 0
+        self.max_lag_scan = max_lag_scan
+
+    async def collect_metrics(self) -> Tuple[int, int]:
+        """
+        See redis_streams.scaler.Scaler.collect_metrics, the lag is computed the
+        same way, see redis_streams.snapshot.group_lags
+        :return: stream length, pending items
+        """
+        await self._ensure_prepared()
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.xinfo_stream(name=self.stream)
+        pipe.xinfo_groups(name=self.stream)
+        info, groups = await pipe.execute(raise_on_error=False)
+        snapshot = snapshot_from_info(self.stream, info, groups)
+        group = snapshot.groups.get(self.consumer_group)
+        if group:
+            self.stream_pending = group.get("pending", 0)
+            self.consumers_of_group = group.get("consumers", 0)
+        lag = lag_from_info(snapshot, self.consumer_group)
+        if lag is None:
+            entries = await self.redis_conn.xrange(
+                **lag_scan_args(snapshot, self.consumer_group, self.max_lag_scan)
+            )
+            lag = lag_from_scan(
+                snapshot, self.consumer_group, entries, self.max_lag_scan
+            )
+        self.stream_lenght = lag
+        return self.stream_lenght, self.stream_pending
+
+    async def _calculate_rate(self):
+        if not all([self.stream_pending, self.stream_lenght]):
+            await self.collect_metrics()
+        self.lenght_pending_rate = SyncScaler._rate(
+            self.stream_lenght, self.stream_pending
+        )
+
+    def _calculate_scale(self, scale_in_rate: int, scale_out_rate: int) -> str:
+        return SyncScaler._scale(
+            self.lenght_pending_rate,
+            self.stream_lenght,
+            self.consumers_of_group,
+            scale_in_rate=scale_in_rate,
+            scale_out_rate=scale_out_rate,
+        )
+
+    async def get_scale_decision(
+        self,
+        scale_out_rate: int = 50,
+        scale_in_rate: int = 10,
+    ) -> Tuple[int, str]:
+        """
+        Rates are counted by stream length / number of pending items
+        :param scale_out_rate: threshold rate of scale out in percent
+        :param scale_in_rate:  threshold rate of scale inpercent
+        :return: rate, suggestion
+        """
+        SyncScaler._validate_scaling_params(
+            scale_in_rate=scale_in_rate, scale_out_rate=scale_out_rate
+        )
+        await self._calculate_rate()
+        return self.lenght_pending_rate, self._calculate_scale(
+            scale_in_rate=scale_in_rate, scale_out_rate=scale_out_rate
+        )
@@ -0,0 +1,135 @@
+"""
+Columnar representation of a batch of stream messages.
+"""
+
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+
+class MessageBatch:
+    """
+    Holds the ids and every field of a batch as columns, so handlers can work on a
+    whole field at once instead of collecting it from per-message dicts. A column
+    has a value for each message, ``None`` where the message doesn't have the
+    field.
+
+    :param ids: Message IDs in stream order.
+    :param columns: Field name -> values, each as long as ``ids``.
+    :param stream: Name of the source stream.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        columns: Dict[str, List[Any]],
+        stream: Optional[str] = None,
+    ):
+        self.ids = ids
+        self.columns = columns
+        self.stream = stream
+
+    @classmethod
+    def from_entries(
+        cls,
+        entries: Iterable[Tuple[Any, Optional[Dict[Any, Any]]]],
+        stream: Optional[str] = None,
+        encoding: str = "utf-8",
+    ) -> "MessageBatch":
+        """
+        Build the batch from the ``(id, fields)`` entries of an XREADGROUP or
+        XRANGE response. Bytes ids and field names are decoded, the values are
+        kept as they are.
+        """
+        ids: List[str] = []
+        columns: Dict[str, List[Any]] = {}
+        for index, (msgid, fields) in enumerate(entries):
+            ids.append(msgid.decode(encoding) if isinstance(msgid, bytes) else msgid)
+            for key, value in (fields or {}).items():
+                if isinstance(key, bytes):
+                    key = key.decode(encoding)
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [None] * index
+                column.append(value)
+            for column in columns.values():
+                if len(column) <= index:
+                    column.append(None)
+        return cls(ids=ids, columns=columns, stream=stream)
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Any]) -> "MessageBatch":
+        """
+        Build the batch from RedisMsg or RawRedisMsg objects, the values of the
+        latter are kept as bytes like in case of from_entries
+        """
+        messages = list(messages)
+        return cls.from_entries(
+            (
+                (
+                    message.msgid,
+                    message.raw if hasattr(message, "raw") else message.content,
+                )
+                for message in messages
+            ),
+            stream=messages[0].stream if messages else None,
+            encoding=getattr(messages[0], "encoding", "utf-8") if messages else "utf-8",
+        )
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.columns)
+
+    def column(
+        self, field: str, typecode: Optional[str] = None, default: Any = None
+    ) -> Any:
+        """
+        Values of a field.
+
+        :param field: Name of the field.
+        :param typecode: If given, the values are converted to a typed
+            ``array.array``, e.g. ``"d"`` for float, ``"q"`` for int.
+        :param default: Used where a message doesn't have the field.
+        :returns: list of the values or array if typecode is given
+        """
+        values = self.columns.get(field, [None] * len(self.ids))
+        if default is not None:
+            values = [default if value is None else value for value in values]
+        if typecode is None:
+            return values
+        convert = float if typecode in ("f", "d") else int
+        return array(typecode, (convert(value) for value in values))
+
+    def to_numpy(self, field: str, dtype: Any = float, default: Any = None) -> Any:
+        """
+        Values of a field as NumPy array, requires numpy to be installed
+        """
+        if numpy is None:
+            raise ImportError("numpy is required for MessageBatch.to_numpy")
+        return numpy.asarray(self.column(field, default=default)).astype(dtype)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Yield the messages as (id, fields) pairs
+        """
+        for index, msgid in enumerate(self.ids):
+            yield msgid, {
+                field: column[index]
+                for field, column in self.columns.items()
+                if column[index] is not None
+            }
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"stream={self.stream},"
+            f"messages={len(self.ids)},"
+            f"fields={self.fields})"
+        )
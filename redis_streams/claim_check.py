@@ -0,0 +1,137 @@
+"""
+Claim check: large payloads are stored outside of the stream.
+
+A Producer with a blob store writes the codec payloads reaching the offload
+threshold to the store and puts only their key in the ``_claim_check`` field of
+the stream entry, so reading, trimming and replicating the stream stays cheap. A
+Consumer with the same store fetches the payloads of a batch with a single
+request and deletes them once the messages are acknowledged.
+"""
+
+import os
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from redis import Redis
+
+REFERENCE_FIELD = "_claim_check"
+
+
+class BlobStore(ABC):
+    """
+    Base class of the stores of the offloaded payloads
+    """
+
+    def new_key(self) -> str:
+        return uuid.uuid4().hex
+
+    @abstractmethod
+    def put_many(self, blobs: Dict[str, bytes]) -> None:
+        pass
+
+    @abstractmethod
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        """
+        :return: the payloads in the order of the keys, None if it is missing
+        """
+
+    @abstractmethod
+    def delete_many(self, keys: List[str]) -> None:
+        pass
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}()"
+
+
+class RedisBlobStore(BlobStore):
+    """
+    Stores the payloads as Redis strings with expiry. The connection must not
+    have decode_responses set, as the payloads are binary.
+
+    :param redis_conn: connection of the store, can differ from the stream's
+    :param prefix: prefix of the keys
+    :param ttl_s: expiry of the payloads, should exceed the time a message can
+                  spend in the stream. None means no expiry, the payloads are
+                  removed only by the consumers
+    """
+
+    def __init__(
+        self,
+        redis_conn: Redis,
+        prefix: str = "redis_streams:blob:",
+        ttl_s: Optional[int] = 7 * 24 * 3600,
+    ):
+        self.redis_conn = redis_conn
+        self.prefix = prefix
+        self.ttl_s = ttl_s
+
+    def put_many(self, blobs: Dict[str, bytes]) -> None:
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for key, blob in blobs.items():
+            pipe.set(f"{self.prefix}{key}", blob, ex=self.ttl_s)
+        pipe.execute()
+
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return self.redis_conn.mget(  # type: ignore[return-value]
+            [f"{self.prefix}{key}" for key in keys]
+        )
+
+    def delete_many(self, keys: List[str]) -> None:
+        self.redis_conn.delete(*[f"{self.prefix}{key}" for key in keys])
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"redis_conn={self.redis_conn},"
+            f"prefix={self.prefix},"
+            f"ttl_s={self.ttl_s})"
+        )
+
+
+class DirectoryBlobStore(BlobStore):
+    """
+    Stores the payloads as files of a directory, e.g. on a volume shared by the
+    producers and consumers. Nothing expires, payloads of messages which are
+    never acknowledged have to be cleaned up separately.
+
+    :param path: the directory, created if it doesn't exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        # the keys are read from the stream, don't let them point elsewhere
+        if not key.isalnum():
+            raise ValueError(f"Invalid blob key: {key}")
+        return os.path.join(self.path, key)
+
+    def put_many(self, blobs: Dict[str, bytes]) -> None:
+        for key, blob in blobs.items():
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".")
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(blob)
+            os.replace(tmp_path, self._file(key))
+
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        blobs: List[Optional[bytes]] = []
+        for key in keys:
+            try:
+                with open(self._file(key), "rb") as blob_file:
+                    blobs.append(blob_file.read())
+            except FileNotFoundError:
+                blobs.append(None)
+        return blobs
+
+    def delete_many(self, keys: List[str]) -> None:
+        for key in keys:
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(path={self.path})"
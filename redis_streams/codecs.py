@@ -0,0 +1,179 @@
+"""
+Serialization codecs for message payloads.
+
+A Producer with a codec stores the encoded object in the ``_payload`` field and
+the name of the codec in the ``_codec`` field of the stream entry. The consumer
+side decodes the payload on access with the codec named in the message, see
+``RedisMsg.payload``. Custom codecs have to be registered with
+:func:`register_codec` in the consuming process as well.
+
+Binary codecs (pickle, msgpack) and compression need a connection without
+``decode_responses``, JSON works with both.
+"""
+
+import json
+import pickle  # nosec B403 - only for trusted producers, see PickleCodec
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Mapping, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+from redis_streams.claim_check import REFERENCE_FIELD
+from redis_streams.compression import (
+    COMPRESSION_FIELD,
+    CompressionStats,
+    Compressor,
+    compress_payload,
+    get_compressor,
+)
+
+CODEC_FIELD = "_codec"
+PAYLOAD_FIELD = "_payload"
+
+
+class Codec(ABC):
+    """
+    Base class of the codecs, ``name`` is stored in the messages to select the
+    codec when decoding
+    """
+
+    name = ""
+
+    @abstractmethod
+    def encode(self, obj: Any) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:
+        pass
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(name={self.name})"
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class PickleCodec(Codec):
+    """
+    Any picklable object, use it only if the producers are trusted as unpickling
+    can execute arbitrary code
+    """
+
+    name = "pickle"
+
+    def encode(self, obj: Any) -> bytes:
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data: bytes) -> Any:
+        return pickle.loads(data)  # nosec B301
+
+
+class MsgpackCodec(Codec):
+    """
+    Requires msgpack to be installed
+    """
+
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is required for MsgpackCodec")
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+_codecs: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    """
+    Make a codec available by its name for encoding and decoding
+    """
+    if not codec.name:
+        raise ValueError("Codec must have a name")
+    _codecs[codec.name] = codec
+
+
+def get_codec(codec: Union[str, Codec]) -> Codec:
+    """
+    :param codec: codec or name of a registered codec
+    """
+    if isinstance(codec, Codec):
+        return codec
+    try:
+        return _codecs[codec]
+    except KeyError:
+        raise ValueError(f"Unknown codec: {codec}") from None
+
+
+register_codec(JsonCodec())
+register_codec(PickleCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
+
+
+def encode_fields(
+    obj: Any,
+    codec: Codec,
+    compressor: Optional[Compressor] = None,
+    compression_threshold: int = 0,
+    compression_stats: Optional[CompressionStats] = None,
+) -> Dict[str, Union[str, bytes]]:
+    """
+    Stream entry fields of an object, the payload is compressed if a compressor
+    is given and the payload reaches the threshold, see redis_streams.compression
+    """
+    payload = codec.encode(obj)
+    fields: Dict[str, Union[str, bytes]] = {CODEC_FIELD: codec.name}
+    if compressor is not None:
+        compressed = compress_payload(
+            payload, compressor, compression_threshold, compression_stats
+        )
+        if compressed is not None:
+            payload = compressed
+            fields[COMPRESSION_FIELD] = compressor.name
+    fields[PAYLOAD_FIELD] = payload
+    return fields
+
+
+def decode_fields(fields: Mapping[Any, Any]) -> Any:
+    """
+    Decode the object of stream entry fields written by encode_fields, the field
+    names and values can be str or bytes
+    """
+    codec_name = fields.get(CODEC_FIELD, fields.get(CODEC_FIELD.encode()))
+    if codec_name is None:
+        raise ValueError("The message has no codec field")
+    if isinstance(codec_name, bytes):
+        codec_name = codec_name.decode()
+    payload = fields.get(PAYLOAD_FIELD, fields.get(PAYLOAD_FIELD.encode()))
+    if payload is None and (
+        REFERENCE_FIELD in fields or REFERENCE_FIELD.encode() in fields
+    ):
+        raise ValueError(
+            "The payload is offloaded and not resolved, the consumer needs the "
+            "blob store of the producer"
+        )
+    if isinstance(payload, str):
+        payload = payload.encode()
+    compression = fields.get(COMPRESSION_FIELD, fields.get(COMPRESSION_FIELD.encode()))
+    if compression is not None:
+        if isinstance(compression, bytes):
+            compression = compression.decode()
+        payload = get_compressor(compression).decompress(payload)
+    return get_codec(codec_name).decode(payload)
@@ -1,6 +1,6 @@
 import logging
 import typing
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from redis import Redis
 from redis.exceptions import ResponseError
@@ -72,14 +72,17 @@ class ConsumerAndMonitor(BaseRedisClass):
             consumername=consumer_id,
         )
 
-    def remove_consumer(self, consumer_to_delete: str) -> int:
+    def remove_consumer(
+        self, consumer_to_delete: str, group: Optional[str] = None
+    ) -> int:
         """
         Removes the consumer from the consumer group,  returns the number of lost
         messages as int
+        :param group: defaults to the consumer group of the instance
         """
         _resp = self.redis_conn.xgroup_delconsumer(
             name=self.stream,
-            groupname=self.consumer_group,
+            groupname=group or self.consumer_group,
             consumername=consumer_to_delete,
         )
         return _resp  # type: ignore[return-value]
@@ -0,0 +1,167 @@
+"""
+Compression of message payloads.
+
+A Producer with a codec and compression compresses the ``_payload`` field of
+the messages reaching the size threshold and names the compressor in the
+``_compression`` field. The consumer side decompresses it transparently, see
+``RedisMsg.payload``. Custom compressors have to be registered with
+:func:`register_compressor` in the consuming process as well.
+"""
+
+import lzma
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Union
+
+COMPRESSION_FIELD = "_compression"
+
+
+class Compressor(ABC):
+    """
+    Base class of the compressors, ``name`` is stored in the messages to select
+    the compressor when decompressing
+    """
+
+    name = ""
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        pass
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(name={self.name})"
+
+
+class ZlibCompressor(Compressor):
+    name = "zlib"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCompressor(Compressor):
+    """
+    Better ratio than zlib for the price of much more CPU time
+    """
+
+    name = "lzma"
+
+    def __init__(self, preset: int = 6):
+        self.preset = preset
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.preset)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+
+_compressors: Dict[str, Compressor] = {}
+
+
+def register_compressor(compressor: Compressor) -> None:
+    """
+    Make a compressor available by its name for compressing and decompressing
+    """
+    if not compressor.name:
+        raise ValueError("Compressor must have a name")
+    _compressors[compressor.name] = compressor
+
+
+def get_compressor(compressor: Union[str, Compressor]) -> Compressor:
+    """
+    :param compressor: compressor or name of a registered compressor
+    """
+    if isinstance(compressor, Compressor):
+        return compressor
+    try:
+        return _compressors[compressor]
+    except KeyError:
+        raise ValueError(f"Unknown compressor: {compressor}") from None
+
+
+register_compressor(ZlibCompressor())
+register_compressor(LzmaCompressor())
+
+
+class CompressionStats:
+    """
+    Counters of a producer to tune the compression threshold. Payloads below the
+    threshold are not counted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.payloads = 0
+        self.compressed_payloads = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compression_time = 0.0
+
+    def record(self, size: int, compressed_size: int, elapsed: float) -> None:
+        with self._lock:
+            self.payloads += 1
+            self.bytes_in += size
+            self.compression_time += elapsed
+            if compressed_size < size:
+                self.compressed_payloads += 1
+                self.bytes_out += compressed_size
+            else:
+                # stored uncompressed
+                self.bytes_out += size
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_in - self.bytes_out
+
+    @property
+    def ratio(self) -> float:
+        """
+        Stored / original size of the payloads above the threshold
+        """
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    def as_dict(self) -> Dict[str, Union[int, float]]:
+        return {
+            "payloads": self.payloads,
+            "compressed_payloads": self.compressed_payloads,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_saved,
+            "ratio": self.ratio,
+            "compression_time": self.compression_time,
+        }
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.as_dict()})"
+
+
+def compress_payload(
+    payload: bytes,
+    compressor: Compressor,
+    threshold: int,
+    stats: Optional[CompressionStats] = None,
+) -> Optional[bytes]:
+    """
+    :return: the compressed payload, None if it is below the threshold or the
+             compression doesn't make it smaller
+    """
+    if len(payload) < threshold:
+        return None
+    start = time.perf_counter()
+    compressed = compressor.compress(payload)
+    if stats is not None:
+        stats.record(len(payload), len(compressed), time.perf_counter() - start)
+    return compressed if len(compressed) < len(payload) else None
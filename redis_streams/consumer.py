@@ -1,20 +1,40 @@
+import logging
 import os
+import queue
 import threading
+import time
 import warnings
 from datetime import UTC, datetime, timedelta
 from enum import Enum
-from typing import List, Union
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from redis import Redis
-from redis.exceptions import ResponseError
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import RedisError, ResponseError
 
+from redis_streams.batch import MessageBatch
+from redis_streams.claim_check import REFERENCE_FIELD, BlobStore
+from redis_streams.codecs import PAYLOAD_FIELD, decode_fields
 from redis_streams.common import ConsumerAndMonitor
+from redis_streams.dead_letter import DeadLetterPolicy, move_to_dead_letter
+from redis_streams.retry import RetryScheduler
 
 
 class RedisMsg:
-    def __init__(self, msgid, content):
+    __slots__ = ("msgid", "content", "stream")
+
+    def __init__(self, msgid, content, stream=None):
         self.msgid = msgid
         self.content = content
+        self.stream = stream
+
+    @property
+    def payload(self):
+        """
+        Object published by a Producer with codec, decoded on access by the codec
+        named in the message, see redis_streams.codecs
+        """
+        return decode_fields(self.content)
 
     def __str__(self):
         return f"id: {self.msgid}, content: {self.content}"
@@ -23,6 +43,93 @@ class RedisMsg:
         return f"RedisMsg(msgid={self.msgid}, content={self.content})"
 
 
+class RawRedisMsg:
+    """
+    Message read by a connection without decode_responses. The id is decoded,
+    the fields are kept as bytes and decoded only on access: content decodes and
+    caches all of them, get() decodes a single field, get_bytes() and
+    get_view() give the raw value without copying. Values which are not valid in
+    the encoding, e.g. pickled or compressed payloads, are kept as bytes.
+    """
+
+    __slots__ = ("msgid", "raw", "stream", "encoding", "_content")
+
+    def __init__(self, msgid, raw, stream=None, encoding="utf-8"):
+        self.msgid = msgid.decode() if isinstance(msgid, bytes) else msgid
+        self.raw = raw
+        self.stream = stream
+        self.encoding = encoding
+        self._content = None
+
+    def _decode(self, value: bytes):
+        try:
+            return value.decode(self.encoding)
+        except UnicodeDecodeError:
+            return value
+
+    @property
+    def content(self):
+        if self._content is None and self.raw is not None:
+            self._content = {
+                key.decode(self.encoding): self._decode(value)
+                for key, value in self.raw.items()
+            }
+        return self._content
+
+    def get_bytes(self, field: str, default=None):
+        return self.raw.get(field.encode(self.encoding), default)
+
+    def get(self, field: str, default=None):
+        value = self.get_bytes(field)
+        if value is None:
+            return default
+        return self._decode(value)
+
+    def get_view(self, field: str):
+        value = self.get_bytes(field)
+        return None if value is None else memoryview(value)
+
+    @property
+    def payload(self):
+        """
+        Object published by a Producer with codec, see RedisMsg.payload
+        """
+        return decode_fields(self.raw)
+
+    def __str__(self):
+        return f"id: {self.msgid}, content: {self.raw}"
+
+    def __repr__(self):
+        return f"RawRedisMsg(msgid={self.msgid}, raw={self.raw})"
+
+
+# pending entries of the consumer (up to the batch size) and the ids of the
+# messages idle for long claimed from the other consumers for the free slots of
+# the batch, in a single round trip
+PENDING_AND_CLAIM_SCRIPT = """
+local pending = redis.call(
+    'XPENDING', KEYS[1], ARGV[1], '-', '+', tonumber(ARGV[3]), ARGV[2])
+local claimed = {}
+local free = tonumber(ARGV[3]) - #pending
+if free > 0 then
+    local own = {}
+    for _, entry in ipairs(pending) do
+        own[entry[1]] = true
+    end
+    local ids = redis.call(
+        'XAUTOCLAIM', KEYS[1], ARGV[1], ARGV[2], ARGV[4], '0-0',
+        'COUNT', free, 'JUSTID')[2]
+    -- the idle messages of this consumer are counted as pending already
+    for _, id in ipairs(ids) do
+        if not own[id] then
+            table.insert(claimed, id)
+        end
+    end
+end
+return {pending, claimed}
+"""
+
+
 class MsgId(Enum):
     """
     '>' next undelivered messages in the group
@@ -33,7 +140,279 @@ class MsgId(Enum):
     already_delivered = "0"
 
 
-class Consumer(ConsumerAndMonitor):
+class AckCoalescer:
+    def __init__(
+        self, consumer: "Consumer", flush_size: int = 100, flush_interval_ms: int = 100
+    ):
+        """
+        Collects the acknowledgements of a consumer and sends them as a single XACK
+        from a background thread once flush_size ids are collected or
+        flush_interval_ms passed since the last flush.
+        :param consumer: the consumer which acknowledges the messages
+        :param flush_size: number of ids which triggers a flush
+        :param flush_interval_ms: maximum time an acknowledgement is delayed
+        """
+        self.consumer = consumer
+        self.flush_size = flush_size
+        self.flush_interval_ms = flush_interval_ms
+        self._item_ids: List[str] = []
+        self._cond = threading.Condition()
+        # held for the whole flush so flush() returns once in-flight XACKs are done
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=self.__class__.__name__, daemon=True
+        )
+        self._thread.start()
+
+    def add(self, item_id: str) -> None:
+        with self._cond:
+            self._item_ids.append(item_id)
+            if len(self._item_ids) >= self.flush_size:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """
+        Acknowledge the collected ids. On failure the ids are kept for the next
+        flush and the exception is raised
+        :return: number of acknowledged messages
+        """
+        with self._flush_lock:
+            with self._cond:
+                item_ids, self._item_ids = self._item_ids, []
+            if not item_ids:
+                return 0
+            try:
+                return self.consumer._ack(item_ids)
+            except RedisError:
+                with self._cond:
+                    self._item_ids[:0] = item_ids
+                raise
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._closed and len(self._item_ids) < self.flush_size:
+                    self._cond.wait(timeout=self.flush_interval_ms / 1000)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except RedisError:
+                self.consumer.logger.warning(
+                    "Failed to flush acknowledgements", exc_info=True
+                )
+
+    def close(self) -> int:
+        """
+        Stop the background thread and flush the remaining acknowledgements
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        return self.flush()
+
+
+class AdaptiveBatching:
+    def __init__(
+        self,
+        target_latency_ms: int = 1000,
+        min_batch_size: int = 1,
+        max_batch_size: int = 1000,
+        min_wait_time_ms: int = 10,
+        max_wait_time_ms: int = 10000,
+        smoothing: float = 0.3,
+    ):
+        """
+        Adjusts the batch size and wait time of a consumer to the load. The arrival
+        rate of new messages and the processing time per message (time between
+        get_items calls / messages returned) are measured and smoothed by
+        exponentially weighted moving average. A message waits for the batch to
+        fill then for the batch to be processed, so the batch size is the largest
+        where batch_size / arrival rate + batch_size * processing time fits in the
+        target latency. The wait time is what remains from the target after the
+        processing of the batch. Hot stream gives big batches, quiet stream small
+        and fast ones.
+        :param target_latency_ms: expected end-to-end latency of a message
+        :param min_batch_size: lower bound of the batch size
+        :param max_batch_size: upper bound of the batch size
+        :param min_wait_time_ms: lower bound of max_wait_time_ms of the consumer
+        :param max_wait_time_ms: upper bound of max_wait_time_ms of the consumer
+        :param smoothing: weight of the latest observation, within 0 and 1
+        """
+        if not 1 <= min_batch_size <= max_batch_size:
+            raise ValueError("Batch size bounds must be 1 <= min <= max")
+        if not 0 <= min_wait_time_ms <= max_wait_time_ms:
+            raise ValueError("Wait time bounds must be 0 <= min <= max")
+        if not 0 < smoothing <= 1:
+            raise ValueError("Smoothing must be within 0 and 1")
+        self.target_latency_ms = target_latency_ms
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_wait_time_ms = min_wait_time_ms
+        self.max_wait_time_ms = max_wait_time_ms
+        self.smoothing = smoothing
+        # messages / second and seconds / message
+        self.arrival_rate: Optional[float] = None
+        self.processing_time: Optional[float] = None
+        self._poll_time_ms: Optional[int] = None
+        self._batch_started = 0.0
+        self._received_before = 0
+        self._returned_at: Optional[float] = None
+        self._returned_count = 0
+
+    def _smooth(self, current: Optional[float], observed: float) -> float:
+        if current is None:
+            return observed
+        return self.smoothing * observed + (1 - self.smoothing) * current
+
+    def calculate(self) -> Tuple[int, int]:
+        """
+        :return: batch size and wait time in milliseconds for the measured load
+        """
+        target = self.target_latency_ms / 1000
+        processing_time = self.processing_time or 0.0
+        if self.arrival_rate:
+            batch_size = int(target / (1 / self.arrival_rate + processing_time))
+        else:
+            batch_size = self.min_batch_size
+        batch_size = min(max(batch_size, self.min_batch_size), self.max_batch_size)
+        wait_time_ms = int((target - batch_size * processing_time) * 1000)
+        wait_time_ms = min(
+            max(wait_time_ms, self.min_wait_time_ms), self.max_wait_time_ms
+        )
+        return batch_size, wait_time_ms
+
+    def before_batch(self, consumer: "Consumer") -> None:
+        now = time.monotonic()
+        if self._poll_time_ms is None:
+            self._poll_time_ms = consumer.poll_time_ms
+        if self._returned_at is not None and self._returned_count:
+            self.processing_time = self._smooth(
+                self.processing_time,
+                (now - self._returned_at) / self._returned_count,
+            )
+        if self.arrival_rate is not None:
+            consumer.batch_size, consumer.max_wait_time_ms = self.calculate()
+            # the last blocking read should not run much over the wait time
+            consumer.poll_time_ms = max(
+                1, min(self._poll_time_ms, consumer.max_wait_time_ms)
+            )
+        self._batch_started = now
+        self._received_before = consumer.new_messages_received
+
+    def after_batch(self, consumer: "Consumer", items: List[RedisMsg]) -> None:
+        now = time.monotonic()
+        received = consumer.new_messages_received - self._received_before
+        elapsed = max(now - self._batch_started, 0.001)
+        self.arrival_rate = self._smooth(self.arrival_rate, received / elapsed)
+        self._returned_at = now
+        self._returned_count = len(items)
+        consumer.logger.debug(
+            f"Arrival rate: {self.arrival_rate:.2f}/s, processing time: "
+            f"{self.processing_time}s/message"
+        )
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"target_latency_ms={self.target_latency_ms},"
+            f"min_batch_size={self.min_batch_size},"
+            f"max_batch_size={self.max_batch_size},"
+            f"min_wait_time_ms={self.min_wait_time_ms},"
+            f"max_wait_time_ms={self.max_wait_time_ms},"
+            f"smoothing={self.smoothing})"
+        )
+
+
+class ConsumerBase:
+    """
+    Batch deadline and conversion of the XREADGROUP responses, shared by
+    redis_streams.aio.consumer
+    """
+
+    redis_conn: Any
+    stream: str
+    consumer_group: str
+    consumer_id: Union[str, int]
+    batch_size: int
+    max_wait_time_ms: int
+    poll_time_ms: int
+    assigned_messages: int
+    hard_stop_time: datetime
+    raw_messages: bool
+    encoding: str
+    logger: logging.Logger
+
+    def _set_connection_options(self) -> None:
+        connection_kwargs = self.redis_conn.get_connection_kwargs()
+        # without decode_responses the messages are decoded lazily, see RawRedisMsg
+        self.raw_messages = not connection_kwargs.get("decode_responses", False)
+        self.encoding = connection_kwargs.get("encoding", "utf-8")
+
+    def _wait_for_more_messages(self):
+        _now = datetime.now(UTC)
+        date_constraint = _now <= self.hard_stop_time
+        message_number_constraint = self.assigned_messages < self.batch_size
+        self.logger.debug(
+            f"Is time to wait for additional messages: {date_constraint} "
+            f"({_now} / {self.hard_stop_time}) "
+            f"Is batch ready: {not message_number_constraint} "
+            f"({self.assigned_messages} / {self.batch_size})"
+        )
+        return all([date_constraint, message_number_constraint])
+
+    def _set_hard_stop_time(self):
+        self.hard_stop_time = datetime.now(UTC) + timedelta(
+            microseconds=self.max_wait_time_ms * 1000
+        )
+
+    def _unwrap_redis_resp(self, items):
+        if isinstance(items, list) and len(items):
+            try:
+                if items[0][0] in (self.stream, self.stream.encode(self.encoding)):
+                    items = items[0][1]
+            except IndexError:
+                self.logger.warning(
+                    "Failed to process messages. Did you set  "
+                    "of the Redis connection",
+                    exc_info=True,
+                )
+        return items
+
+    def _transform_redis_resp_to_objects(self, items):
+        msgs = []
+        items = self._unwrap_redis_resp(items)
+        if self.raw_messages:
+            for item in items:
+                msgs.append(
+                    RawRedisMsg(
+                        msgid=item[0],
+                        raw=item[1],
+                        stream=self.stream,
+                        encoding=self.encoding,
+                    )
+                )
+            return msgs
+        for item in items:
+            msgs.append(RedisMsg(msgid=item[0], content=item[1], stream=self.stream))
+        return msgs
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"redis_conn={self.redis_conn},"
+            f"stream={self.stream},"
+            f"consumer_group={self.consumer_group},"
+            f"consumer_id={self.consumer_id},"
+            f"batch_size={self.batch_size},"
+            f"max_wait_time_ms={self.max_wait_time_ms},"
+            f"poll_time_ms={self.poll_time_ms})"
+        )
+
+
+class Consumer(ConsumerAndMonitor, ConsumerBase):
     def __init__(
         self,
         redis_conn: Redis,
@@ -44,6 +423,15 @@ class Consumer(ConsumerAndMonitor):
         max_wait_time_ms: int = 10000,
         poll_time_ms: int = 1000,
         cleanup_on_exit=True,
+        track_pending_locally: bool = False,
+        ack_flush_size: int = 0,
+        ack_flush_interval_ms: int = 100,
+        adaptive_batching: Optional["AdaptiveBatching"] = None,
+        blob_store: Optional[BlobStore] = None,
+        delete_blobs_on_ack: bool = True,
+        dead_letter: Optional[DeadLetterPolicy] = None,
+        retry_scheduler: Optional[RetryScheduler] = None,
+        claim_idle_time_ms: Optional[int] = None,
     ):
         """
         The consumer registers in the consumer group and start fetching for available
@@ -59,10 +447,46 @@ class Consumer(ConsumerAndMonitor):
         :param max_wait_time_ms: Approximate maximum time to wait for the batch to be
                                   complete. Call returns if time pass even if the batch
                                   is not full. 0 means: no return
+        :param track_pending_locally: keep the messages received and not yet
+                    acknowledged in memory instead of re-reading the pending entries
+                    list (PEL) of the consumer for every batch. The PEL is read only
+                    at the first call, after a connection error or after
+                    resync_pending() so a batch costs one blocking read.
+        :param ack_flush_size: if set, remove_item_from_consumer_group only queues the
+                    acknowledgement and the queued ones are sent as a single XACK
+                    once this many are collected, see AckCoalescer. The queue is
+                    flushed before each get_items call and by close()
+        :param ack_flush_interval_ms: maximum time an acknowledgement is queued
+        :param adaptive_batching: adjust batch_size, max_wait_time_ms and
+                    poll_time_ms before each get_items call, see AdaptiveBatching
+        :param blob_store: store of the payloads offloaded by the producer. The
+                    payloads of a batch are fetched with a single request and
+                    added to the messages, see redis_streams.claim_check
+        :param delete_blobs_on_ack: delete the offloaded payloads of the
+                    acknowledged messages. Disable it if other consumer groups
+                    read the stream as well and rely on the expiry of the store
+        :param dead_letter: move the messages of this consumer delivered more
+                    times than the policy allows to its dead-letter stream
+                    instead of returning them again, see redis_streams.dead_letter.
+                    With track_pending_locally the returns of a message not
+                    acknowledged are counted as deliveries by the consumer
+        :param retry_scheduler: scheduler of the messages passed to retry_later,
+                    its pump has to run, see redis_streams.retry
+        :param claim_idle_time_ms: if set, each get_items call first claims the
+                    messages of the group pending for longer than this with
+                    XAUTOCLAIM, at most as many as the batch has room for. The
+                    messages of a crashed consumer are taken over at the next
+                    poll, without waiting for the Monitor. The claim is sent with
+                    the check of the pending messages of this consumer as one Lua
+                    script. Needs Redis 6.2, ignored on older servers.
+                    It must be longer than the worst-case processing time of a
+                    batch, otherwise the other consumers steal the messages still
+                    being processed and they are processed twice
         """
         super().__init__(
             redis_conn=redis_conn, stream=stream, consumer_group=consumer_group
         )
+        self._set_connection_options()
         self.assigned_messages = 0
         self.consumer_id = consumer_id
         self.batch_size = batch_size
@@ -70,27 +494,64 @@ class Consumer(ConsumerAndMonitor):
         self.max_wait_time_ms = max_wait_time_ms
         self.hard_stop_time = datetime.now(UTC)
         self.cleanup_on_exit = cleanup_on_exit
+        self.track_pending_locally = track_pending_locally
+        self._pending: Dict[str, RedisMsg] = {}
+        # message id -> delivery count of the next return of a tracked message,
+        # the returns of the tracked messages are not counted by Redis
+        self._deliveries: Dict[str, int] = {}
+        self._pending_synced = False
+        self.new_messages_received = 0
+        self.adaptive_batching = adaptive_batching
+        self.blob_store = blob_store
+        self.delete_blobs_on_ack = delete_blobs_on_ack
+        # message id -> key of the offloaded payload, deleted on acknowledgement
+        self._claim_checks: Dict[str, str] = {}
+        self.dead_letter = dead_letter
+        self.dead_lettered_messages = 0
+        self.retry_scheduler = retry_scheduler
+        self.claim_idle_time_ms = claim_idle_time_ms
+        self.claimed_messages = 0
+        self._xautoclaim_supported = True
+        self._pending_and_claim = None
+        if claim_idle_time_ms is not None:
+            self._pending_and_claim = redis_conn.register_script(
+                PENDING_AND_CLAIM_SCRIPT
+            )
+        self.ack_coalescer: Optional[AckCoalescer] = None
+        if ack_flush_size > 0:
+            self.ack_coalescer = AckCoalescer(
+                consumer=self,
+                flush_size=ack_flush_size,
+                flush_interval_ms=ack_flush_interval_ms,
+            )
         self._set_hard_stop_time()
 
-    def _wait_for_more_messages(self):
-        _now = datetime.now(UTC)
-        date_constraint = _now <= self.hard_stop_time
-        message_number_constraint = self.assigned_messages < self.batch_size
-        self.logger.debug(
-            f"Is time to wait for additional messages: {date_constraint} "
-            f"({_now} / {self.hard_stop_time}) "
-            f"Is batch ready: {not message_number_constraint} "
-            f"({self.assigned_messages} / {self.batch_size})"
-        )
-        return all([date_constraint, message_number_constraint])
+    def get_items(self) -> List[RedisMsg]:
+        return self._collect_batch(as_batch=False)
 
-    def _set_hard_stop_time(self):
-        self.hard_stop_time = datetime.now(UTC) + timedelta(
-            microseconds=self.max_wait_time_ms * 1000
-        )
+    def get_batch(self) -> MessageBatch:
+        """
+        Same as get_items but returns the batch in columnar form, see MessageBatch
+        """
+        return self._collect_batch(as_batch=True)
 
-    def get_items(self) -> List[RedisMsg]:
+    def _collect_batch(self, as_batch: bool):
+        if self.ack_coalescer:
+            self.ack_coalescer.flush()
+        if self.adaptive_batching:
+            self.adaptive_batching.before_batch(self)
         self._set_hard_stop_time()
+        if self.track_pending_locally:
+            items = self._get_items_tracked_locally()
+            if as_batch:
+                items = MessageBatch.from_messages(items)
+        else:
+            items = self._get_items(as_batch=as_batch)
+        if self.adaptive_batching:
+            self.adaptive_batching.after_batch(self, items)
+        return items
+
+    def _get_items(self, as_batch: bool = False):
         self.assigned_messages = self._get_no_of_messages_already_assigned()
         while self._wait_for_more_messages():
             _requested_messages = max(1, self.batch_size - self.assigned_messages)
@@ -99,31 +560,274 @@ class Consumer(ConsumerAndMonitor):
                 requested_messages=_requested_messages
             )
         return self._get_messages_from_stream(
+            latest_or_new=MsgId.already_delivered.value, as_batch=as_batch
+        )
+
+    def iter_items(self, auto_ack: bool = False) -> Iterator[RedisMsg]:
+        """
+        Yield the messages one by one as soon as they arrive instead of collecting
+        a batch first. The messages already pending for this consumer come first,
+        then the new ones, up to batch_size messages are read at once. The
+        iteration never ends, break out of the loop to stop.
+        Messages which are not acknowledged are not yielded again by this
+        iteration, only by the next get_items / iter_items call or after they were
+        claimed by the Monitor.
+        :param auto_ack: acknowledge a message when the next one is requested, so
+                    the one the caller failed on or broke out at is not acknowledged
+        """
+        last_id = MsgId.already_delivered.value
+        while True:
+            items = self._get_messages_from_stream(latest_or_new=last_id)
+            if not items:
+                break
+            last_id = items[-1].msgid
+            yield from self._yield_and_ack(items, auto_ack=auto_ack)
+        while True:
+            items = self._get_messages_from_stream(
+                latest_or_new=MsgId.never_delivered.value
+            )
+            yield from self._yield_and_ack(items, auto_ack=auto_ack)
+
+    def _yield_and_ack(
+        self, items: List[RedisMsg], auto_ack: bool
+    ) -> Iterator[RedisMsg]:
+        for msg in items:
+            yield msg
+            if auto_ack:
+                self.remove_item_from_consumer_group(item_id=msg.msgid)
+
+    def __iter__(self) -> Iterator[RedisMsg]:
+        return self.iter_items()
+
+    def _get_items_tracked_locally(self) -> List[RedisMsg]:
+        if not self._pending_synced:
+            self._sync_pending()
+        if self.claim_idle_time_ms is not None:
+            for msg in self._claim_idle_messages(self.batch_size - len(self._pending)):
+                self._pending[msg.msgid] = msg
+        if self.dead_letter:
+            self._move_poison_pending(list(self._pending))
+        self.assigned_messages = len(self._pending)
+        while self._wait_for_more_messages():
+            _requested_messages = max(1, self.batch_size - self.assigned_messages)
+            for msg in self._get_messages_from_stream(
+                latest_or_new=MsgId.never_delivered.value,
+                requested_messages=_requested_messages,
+            ):
+                self._pending[msg.msgid] = msg
+            self.assigned_messages = len(self._pending)
+        self._count_deliveries(self._pending)
+        return list(self._pending.values())
+
+    def _sync_pending(self):
+        items = self._get_messages_from_stream(
             latest_or_new=MsgId.already_delivered.value
         )
+        self._deliveries.update(self._read_deliveries(items))
+        for msg in items:
+            self._pending.setdefault(msg.msgid, msg)
+        # a full page means there can be more in the PEL, read it again next time
+        self._pending_synced = len(items) < self.batch_size
+        self.logger.debug(f"Pending messages of this consumer: {len(self._pending)}")
+
+    def resync_pending(self):
+        """
+        Read the pending entries list of the consumer at the next get_items call,
+        needed if messages were claimed by or from this consumer. Only relevant
+        with track_pending_locally
+        """
+        self._pending = {}
+        self._deliveries = {}
+        self._pending_synced = False
+
+    def _forget_pending(self, item_ids: List[str]):
+        for item_id in item_ids:
+            self._pending.pop(item_id, None)
+            self._deliveries.pop(item_id, None)
+
+    def _read_deliveries(self, msgs: List[RedisMsg]) -> Dict[str, int]:
+        """
+        Delivery counts of the messages read from the pending entries list of this
+        consumer, one XPENDING of their range. Only read with a dead-letter policy
+        """
+        if not self.dead_letter or not msgs:
+            return {}
+        entries: List[Dict[str, Any]] = self.redis_conn.xpending_range(
+            name=self.stream,
+            groupname=self.consumer_group,
+            min=msgs[0].msgid,
+            max=msgs[-1].msgid,
+            count=len(msgs),
+            consumername=self.consumer_id,  # type: ignore[arg-type]
+        )
+        deliveries: Dict[str, int] = {}
+        for entry in entries:
+            msg_id = entry["message_id"]
+            if isinstance(msg_id, bytes):
+                msg_id = msg_id.decode()
+            deliveries[msg_id] = entry["times_delivered"]
+        return deliveries
+
+    def _count_deliveries(self, item_ids: Iterable[str]) -> None:
+        """
+        Count the return of the tracked messages, a message not acknowledged is
+        returned again without reading it from the pending entries list
+        """
+        for item_id in item_ids:
+            self._deliveries[item_id] = self._deliveries.get(item_id, 1) + 1
+
+    def _move_poison_pending(self, item_ids: List[str]) -> int:
+        """
+        Move the tracked messages which would be delivered more times than the
+        dead-letter policy allows by the next return
+        :return: number of moved messages
+        """
+        return self._move_poison_messages(
+            [
+                {
+                    "message_id": item_id,
+                    "consumer": self.consumer_id,
+                    "times_delivered": self._deliveries.get(item_id, 1),
+                }
+                for item_id in item_ids
+            ]
+        )
 
     def _get_new_items_to_consumer(self, requested_messages):
         items = self._get_messages_from_stream(
             latest_or_new=MsgId.never_delivered.value,
             requested_messages=requested_messages,
+            resolve_claim_checks=False,
         )
         self.logger.debug(f"Received {len(items)} new items from stream")
         return len(items)
 
     def _get_no_of_messages_already_assigned(self):
-        messages = self.get_pending_items_of_consumer(
-            item_count=self.batch_size, consumer_id=self.consumer_id
-        )
+        claimed = 0
+        if self.claim_idle_time_ms is not None and self._xautoclaim_supported:
+            messages, claimed = self._get_pending_and_claim()
+        else:
+            messages = self.get_pending_items_of_consumer(
+                item_count=self.batch_size, consumer_id=self.consumer_id
+            )
         _return = len(messages)
+        if self.dead_letter:
+            _return -= self._move_poison_messages(messages)
+        _return += claimed
         self.logger.debug(f"Messages already assigned to this consumer: <= {_return}")
         return _return
 
+    def _xautoclaim_unsupported(self, exc: ResponseError) -> bool:
+        if "unknown" not in str(exc).lower():
+            return False
+        self.logger.info("XAUTOCLAIM is not supported, idle messages are not claimed")
+        self._xautoclaim_supported = False
+        return True
+
+    def _get_pending_and_claim(self) -> Tuple[List[Dict], int]:
+        """
+        :return: XPENDING entries of this consumer like
+                 get_pending_items_of_consumer and the number of claimed messages
+        """
+        try:
+            pending, claimed = self._pending_and_claim(  # type: ignore[misc]
+                keys=[self.stream],
+                args=[
+                    self.consumer_group,
+                    self.consumer_id,
+                    self.batch_size,
+                    self.claim_idle_time_ms,  # type: ignore[list-item]
+                ],
+            )
+        except ResponseError as exc:
+            if not self._xautoclaim_unsupported(exc):
+                raise
+            pending = self.get_pending_items_of_consumer(
+                item_count=self.batch_size, consumer_id=self.consumer_id
+            )
+            return pending, 0
+        if claimed:
+            self.logger.info(f"Claimed {len(claimed)} idle messages")
+            self.claimed_messages += len(claimed)
+        return [
+            {
+                "message_id": message_id,
+                "consumer": consumer,
+                "time_since_delivered": time_since_delivered,
+                "times_delivered": times_delivered,
+            }
+            for message_id, consumer, time_since_delivered, times_delivered in pending
+        ], len(claimed)
+
+    def _claim_idle_messages(self, count: int) -> List[RedisMsg]:
+        """
+        Claim up to count messages of the group idle for claim_idle_time_ms
+        """
+        if count <= 0 or not self._xautoclaim_supported:
+            return []
+        try:
+            resp = self.redis_conn.xautoclaim(
+                name=self.stream,
+                groupname=self.consumer_group,
+                consumername=self.consumer_id,  # type: ignore[arg-type]
+                min_idle_time=self.claim_idle_time_ms,  # type: ignore[arg-type]
+                start_id="0-0",
+                count=count,
+            )
+        except ResponseError as exc:
+            if not self._xautoclaim_unsupported(exc):
+                raise
+            return []
+        msgs = [
+            msg
+            for msg in self._transform_redis_resp_to_objects(
+                resp[1]  # type: ignore[index]
+            )
+            # the idle messages of this consumer are tracked already
+            if msg.msgid not in self._pending
+        ]
+        if msgs:
+            self.logger.info(f"Claimed {len(msgs)} idle messages")
+            self.claimed_messages += len(msgs)
+            if self.blob_store:
+                self._resolve_claim_checks(msgs)
+        return msgs
+
+    def _move_poison_messages(self, pending_entries: Optional[list] = None) -> int:
+        """
+        Move the poison messages of this consumer to the dead-letter stream
+        :param pending_entries: XPENDING entries of the consumer, read if not given
+        :return: number of moved messages
+        """
+        policy: DeadLetterPolicy = self.dead_letter  # type: ignore[assignment]
+        if pending_entries is None:
+            pending_entries = self.get_pending_items_of_consumer(
+                item_count=self.batch_size, consumer_id=self.consumer_id
+            )
+        moved = move_to_dead_letter(
+            self.redis_conn,
+            stream=self.stream,
+            group=self.consumer_group,
+            pending_entries=pending_entries,
+            policy=policy,
+        )
+        if moved:
+            self.logger.warning(f"Moved {len(moved)} messages to {policy.stream}")
+            self.dead_lettered_messages += len(moved)
+            self._forget_pending(moved)
+            for item_id in moved:
+                # the dead-letter stream keeps the reference
+                self._claim_checks.pop(item_id, None)
+        return len(moved)
+
     def _get_messages_from_stream(
         self,
         latest_or_new: str = MsgId.never_delivered.value,
         requested_messages=None,
         wait_time=None,
-    ) -> List[RedisMsg]:
+        as_batch: bool = False,
+        resolve_claim_checks: bool = True,
+    ):
         """
         The command to read data from a group is XREADGROUP.
         In our example, when App A starts processing data,
@@ -139,6 +843,9 @@ class Consumer(ConsumerAndMonitor):
         block: number of milliseconds to wait, if nothing already present.
         noack: do not add messages to the PEL
         latest_or_new: see MsgId
+        as_batch: return MessageBatch instead of list of messages
+        resolve_claim_checks: fetch the offloaded payloads, not needed if only the
+               messages are counted
         """
         if requested_messages is None:
             requested_messages = self.batch_size
@@ -152,30 +859,95 @@ class Consumer(ConsumerAndMonitor):
                 noack=False,
             )
             self.logger.debug(f"Got {items}")
-            return self._transform_redis_resp_to_objects(items)
+            if as_batch:
+                batch = MessageBatch.from_entries(
+                    self._unwrap_redis_resp(items),
+                    stream=self.stream,
+                    encoding=self.encoding,
+                )
+                if self.blob_store and resolve_claim_checks:
+                    self._resolve_batch_claim_checks(batch)
+                return batch
+            msgs = self._transform_redis_resp_to_objects(items)
+            if latest_or_new == MsgId.never_delivered.value:
+                self.new_messages_received += len(msgs)
+            if self.blob_store and resolve_claim_checks:
+                self._resolve_claim_checks(msgs)
+            return msgs
+        except RedisConnectionError:
+            # messages might have been claimed meanwhile
+            self._pending_synced = False
+            raise
         except ResponseError:
             self.logger.warning(
                 f"Failed to get messages from {self.stream} from "
                 f"{self.consumer_group} as {self.consumer_id}",
                 exc_info=True,
             )
-            return []
+            return MessageBatch(ids=[], columns={}) if as_batch else []
 
-    def _transform_redis_resp_to_objects(self, items):
-        msgs = []
-        if isinstance(items, list) and len(items):
-            try:
-                if items[0][0] == self.stream:
-                    items = items[0][1]
-            except IndexError:
-                self.logger.warning(
-                    "Failed to process messages. Did you set  "
-                    "of the Redis connection",
-                    exc_info=True,
-                )
-        for item in items:
-            msgs.append(RedisMsg(msgid=item[0], content=item[1]))
-        return msgs
+    def _fetch_blobs(self, item_ids: List[str], keys: List) -> List[Optional[bytes]]:
+        keys = [
+            key.decode(self.encoding) if isinstance(key, bytes) else key for key in keys
+        ]
+        blobs = self.blob_store.get_many(keys)  # type: ignore[union-attr]
+        for item_id, key, blob in zip(item_ids, keys, blobs):
+            self._claim_checks[item_id] = key
+            if blob is None:
+                self.logger.warning(f"Offloaded payload of {item_id} is missing: {key}")
+        return blobs
+
+    def _resolve_claim_checks(self, msgs: List[RedisMsg]):
+        """
+        Add the offloaded payloads to the messages referring to them, fetched with
+        a single request to the blob store
+        """
+        referring = []
+        for msg in msgs:
+            fields = msg.raw if isinstance(msg, RawRedisMsg) else msg.content
+            key = fields.get(REFERENCE_FIELD, fields.get(REFERENCE_FIELD.encode()))
+            if key is not None:
+                referring.append((msg, fields, key))
+        if not referring:
+            return
+        blobs = self._fetch_blobs(
+            [msg.msgid for msg, _, _ in referring], [key for _, _, key in referring]
+        )
+        for (msg, fields, _), blob in zip(referring, blobs):
+            if blob is None:
+                continue
+            if isinstance(msg, RawRedisMsg):
+                fields[PAYLOAD_FIELD.encode(self.encoding)] = blob
+            else:
+                fields[PAYLOAD_FIELD] = blob
+
+    def _resolve_batch_claim_checks(self, batch: MessageBatch):
+        keys = batch.columns.get(REFERENCE_FIELD)
+        if not keys:
+            return
+        indexes = [index for index, key in enumerate(keys) if key is not None]
+        blobs = self._fetch_blobs(
+            [batch.ids[index] for index in indexes], [keys[index] for index in indexes]
+        )
+        payloads = batch.columns.setdefault(PAYLOAD_FIELD, [None] * len(batch))
+        for index, blob in zip(indexes, blobs):
+            payloads[index] = blob
+
+    def _delete_blobs(self, item_ids: List[str]):
+        keys = [
+            self._claim_checks.pop(item_id)
+            for item_id in item_ids
+            if item_id in self._claim_checks
+        ]
+        if not keys or not self.delete_blobs_on_ack:
+            return
+        try:
+            self.blob_store.delete_many(keys)  # type: ignore[union-attr]
+        except (RedisError, OSError):
+            # they expire anyway, if the store supports it
+            self.logger.warning(
+                f"Failed to delete {len(keys)} offloaded payloads", exc_info=True
+            )
 
     def remove_item_from_consumer_group(self, item_id: str):
         """
@@ -188,7 +960,76 @@ class Consumer(ConsumerAndMonitor):
 
         :param item_id: id to acknowledge
         """
-        self.redis_conn.xack(self.stream, self.consumer_group, item_id)
+        if self.ack_coalescer:
+            self.ack_coalescer.add(item_id)
+        else:
+            self.redis_conn.xack(self.stream, self.consumer_group, item_id)
+            self._delete_blobs([item_id])
+        self._forget_pending([item_id])
+
+    def ack_many(self, item_ids: Iterable[str], delete: bool = False) -> int:
+        """
+        Acknowledge several messages with a single XACK. Messages which are not
+        pending any more, e.g. claimed and acknowledged by another consumer, are
+        not counted.
+
+        :param item_ids: ids to acknowledge
+        :param delete: also delete the messages from the stream with XDEL, sent in
+                       the same pipeline
+        :return: number of acknowledged messages
+        """
+        item_ids = list(item_ids)
+        if not item_ids:
+            return 0
+        acknowledged = self._ack(item_ids, delete=delete)
+        self._forget_pending(item_ids)
+        return acknowledged
+
+    def _ack(self, item_ids: List[str], delete: bool = False) -> int:
+        if delete:
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.xack(self.stream, self.consumer_group, *item_ids)
+            pipe.xdel(self.stream, *item_ids)
+            acknowledged, _ = pipe.execute()
+        else:
+            acknowledged = self.redis_conn.xack(
+                self.stream, self.consumer_group, *item_ids
+            )
+        if acknowledged < len(item_ids):
+            self.logger.warning(
+                f"Only {acknowledged} of {len(item_ids)} messages were pending in "
+                f"{self.consumer_group}"
+            )
+        self._delete_blobs(item_ids)
+        return acknowledged
+
+    def ack_batch(
+        self, messages: Union[Iterable[RedisMsg], MessageBatch], delete: bool = False
+    ) -> int:
+        """
+        Acknowledge the messages returned by get_items or get_batch, see ack_many
+        """
+        if isinstance(messages, MessageBatch):
+            return self.ack_many(messages.ids, delete=delete)
+        return self.ack_many([message.msgid for message in messages], delete=delete)
+
+    def retry_later(self, message: Union[RedisMsg, RawRedisMsg]) -> Optional[int]:
+        """
+        Retry a failed message after a backoff instead of getting it again with
+        the next batch: it is acknowledged and added to the stream again as a new
+        message once it is due, see RetryScheduler.schedule
+        :return: the delay in milliseconds, None if the message ran out of retries
+                 and stays pending
+        """
+        if self.retry_scheduler is None:
+            raise ValueError("No retry scheduler is set")
+        fields = message.raw if isinstance(message, RawRedisMsg) else message.content
+        delay_ms = self.retry_scheduler.schedule(message.msgid, fields)
+        if delay_ms is not None:
+            self._forget_pending([message.msgid])
+            # the retried message refers to the offloaded payload
+            self._claim_checks.pop(message.msgid, None)
+        return delay_ms
 
     def remove_item_from_stream(self, item_id: str):
         """
@@ -206,6 +1047,247 @@ class Consumer(ConsumerAndMonitor):
         )
         self.remove_item_from_consumer_group(item_id)
 
+    def close(self):
+        """
+        Flush the queued acknowledgements, see ack_flush_size
+        """
+        if self.ack_coalescer:
+            self.ack_coalescer.close()
+            self.ack_coalescer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class PrefetchingConsumer(Consumer):
+    def __init__(
+        self,
+        redis_conn: Redis,
+        stream: str,
+        consumer_group: str,
+        consumer_id: Union[str, int] = f"{os.getpid()}{threading.get_ident()}",
+        batch_size: int = 2,
+        max_wait_time_ms: int = 10000,
+        poll_time_ms: int = 1000,
+        cleanup_on_exit=True,
+        ack_flush_size: int = 0,
+        ack_flush_interval_ms: int = 100,
+        prefetch_batches: int = 1,
+        blob_store: Optional[BlobStore] = None,
+        delete_blobs_on_ack: bool = True,
+        dead_letter: Optional[DeadLetterPolicy] = None,
+        retry_scheduler: Optional[RetryScheduler] = None,
+    ):
+        """
+        Consumer which collects the next batches in a background thread while the
+        caller processes the current one, so get_items usually returns without
+        waiting. Messages not acknowledged are returned again with the next batch,
+        like in case of Consumer with track_pending_locally.
+        At most prefetch_batches batches are queued ahead and new messages are only
+        read while the consumer holds less than (prefetch_batches + 1) * batch_size
+        prefetched and returned, not yet acknowledged messages, so the pending
+        entries list of the consumer doesn't grow beyond that even if the caller
+        leaves messages unacknowledged. The batch_size of the Monitor should be set
+        accordingly, otherwise it considers the consumer unhealthy and claims the
+        prefetched messages.
+        Redis errors of the background thread are logged and the pending entries
+        list is read again, other errors are raised by the next get_items /
+        iter_items call.
+        Call resync_pending() after messages were claimed by or from this consumer
+        and close() to stop the background thread.
+        :param prefetch_batches: number of batches collected ahead
+        See Consumer for the rest of the parameters
+        """
+        super().__init__(
+            redis_conn=redis_conn,
+            stream=stream,
+            consumer_group=consumer_group,
+            consumer_id=consumer_id,
+            batch_size=batch_size,
+            max_wait_time_ms=max_wait_time_ms,
+            poll_time_ms=poll_time_ms,
+            cleanup_on_exit=cleanup_on_exit,
+            track_pending_locally=True,
+            ack_flush_size=ack_flush_size,
+            ack_flush_interval_ms=ack_flush_interval_ms,
+            blob_store=blob_store,
+            delete_blobs_on_ack=delete_blobs_on_ack,
+            dead_letter=dead_letter,
+            retry_scheduler=retry_scheduler,
+        )
+        if prefetch_batches < 1:
+            raise ValueError("At least one batch has to be prefetched")
+        self.prefetch_batches = prefetch_batches
+        self._batches: queue.Queue = queue.Queue(maxsize=prefetch_batches)
+        # ids of the prefetched and returned, not yet acknowledged messages
+        self._known_ids: set = set()
+        # guards _known_ids and _pending, the background thread forgets the
+        # dead-lettered messages
+        self._lock = threading.Lock()
+        self.max_unacked = (prefetch_batches + 1) * batch_size
+        self._stop = threading.Event()
+        self._resync = threading.Event()
+        # set when messages are acknowledged, there may be room for new ones
+        self._forgotten = threading.Event()
+        # the pending entries list is read at startup
+        self._resync.set()
+        self._thread = threading.Thread(
+            target=self._prefetch, name=self.__class__.__name__, daemon=True
+        )
+        self._thread.start()
+
+    def _prefetch(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self._resync.is_set():
+                    self._resync.clear()
+                    self._prefetch_pending()
+                batch = self._collect_new_batch()
+            except RedisError:
+                self.logger.warning("Failed to prefetch messages", exc_info=True)
+                self._resync.set()
+                self._stop.wait(self.poll_time_ms / 1000)
+                continue
+            except Exception as exc:
+                # raised by get_items, the messages are read again after it
+                self._resync.set()
+                self._put(exc)
+                continue
+            if batch:
+                self._put_batch(batch)
+
+    def _prefetch_pending(self) -> None:
+        """
+        Page through the pending entries list of the consumer, batch_size messages
+        per page, skipping the messages already known
+        """
+        last_id = MsgId.already_delivered.value
+        while not self._stop.is_set():
+            items = self._get_messages_from_stream(latest_or_new=last_id)
+            if not items:
+                return
+            last_id = items[-1].msgid
+            deliveries = self._read_deliveries(items)
+            with self._lock:
+                batch = [msg for msg in items if msg.msgid not in self._known_ids]
+                for msg in batch:
+                    if msg.msgid in deliveries:
+                        self._deliveries[msg.msgid] = deliveries[msg.msgid]
+            if batch:
+                self._put_batch(batch)
+            if len(items) < self.batch_size:
+                return
+
+    def _room(self) -> int:
+        with self._lock:
+            return min(self.batch_size, self.max_unacked - len(self._known_ids))
+
+    def _collect_new_batch(self) -> List[RedisMsg]:
+        self._forgotten.clear()
+        if self._room() <= 0:
+            # wait for acknowledgements
+            self._forgotten.wait(self.poll_time_ms / 1000)
+            return []
+        batch: List[RedisMsg] = []
+        stop_time = time.monotonic() + self.max_wait_time_ms / 1000
+        while (
+            len(batch) < self._room()
+            and time.monotonic() <= stop_time
+            and not self._stop.is_set()
+        ):
+            batch += self._get_messages_from_stream(
+                latest_or_new=MsgId.never_delivered.value,
+                requested_messages=self._room() - len(batch),
+            )
+        return batch
+
+    def _put(self, item: Union[List[RedisMsg], Exception]) -> None:
+        while not self._stop.is_set():
+            try:
+                self._batches.put(item, timeout=self.poll_time_ms / 1000)
+                return
+            except queue.Full:
+                continue
+
+    def _put_batch(self, batch: List[RedisMsg]) -> None:
+        with self._lock:
+            self._known_ids.update(msg.msgid for msg in batch)
+        self._put(batch)
+
+    def _get_batch(self, timeout_ms: int) -> List[RedisMsg]:
+        batch = self._batches.get(timeout=timeout_ms / 1000)
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def get_items(self) -> List[RedisMsg]:
+        if self.ack_coalescer:
+            self.ack_coalescer.flush()
+        try:
+            batch = self._get_batch(self.max_wait_time_ms)
+        except queue.Empty:
+            batch = []
+        with self._lock:
+            for msg in batch:
+                self._pending[msg.msgid] = msg
+            item_ids = list(self._pending)
+        if self.dead_letter:
+            self._move_poison_pending(item_ids)
+        with self._lock:
+            self._count_deliveries(self._pending)
+            self.assigned_messages = len(self._pending)
+            return list(self._pending.values())
+
+    def get_batch(self) -> MessageBatch:
+        return MessageBatch.from_messages(self.get_items())
+
+    def iter_items(self, auto_ack: bool = False) -> Iterator[RedisMsg]:
+        """
+        Yield the messages of the prefetched batches one by one, see
+        Consumer.iter_items
+        """
+        while True:
+            try:
+                batch = self._get_batch(self.poll_time_ms)
+            except queue.Empty:
+                continue
+            with self._lock:
+                for msg in batch:
+                    self._pending[msg.msgid] = msg
+            if self.dead_letter:
+                self._move_poison_pending([msg.msgid for msg in batch])
+                with self._lock:
+                    batch = [msg for msg in batch if msg.msgid in self._pending]
+            yield from self._yield_and_ack(batch, auto_ack=auto_ack)
+
+    def _forget_pending(self, item_ids: List[str]):
+        with self._lock:
+            super()._forget_pending(item_ids)
+            self._known_ids.difference_update(item_ids)
+        self._forgotten.set()
+
+    def resync_pending(self):
+        """
+        Forget the returned, not acknowledged messages and read the pending entries
+        list of the consumer again in the background
+        """
+        with self._lock:
+            item_ids = list(self._pending)
+        self._forget_pending(item_ids)
+        self._resync.set()
+
+    def close(self):
+        """
+        Stop the background thread and flush the queued acknowledgements. The
+        prefetched messages stay in the pending entries list of the consumer
+        """
+        self._stop.set()
+        self._thread.join()
+        super().close()
+
     def __repr__(self):
         return (
             f"{self.__class__.__name__}("
@@ -215,5 +1297,6 @@ class Consumer(ConsumerAndMonitor):
             f"consumer_id={self.consumer_id},"
             f"batch_size={self.batch_size},"
             f"max_wait_time_ms={self.max_wait_time_ms},"
-            f"poll_time_ms={self.poll_time_ms})"
+            f"poll_time_ms={self.poll_time_ms},"
+            f"prefetch_batches={self.prefetch_batches})"
         )
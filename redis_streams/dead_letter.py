@@ -0,0 +1,120 @@
+"""
+Dead-letter stream for poison messages.
+
+A message which is delivered again and again without being acknowledged, e.g.
+because its processing always fails, takes a batch slot of a consumer each time
+and bounces between the consumers when the Monitor reassigns it. With a
+:class:`DeadLetterPolicy` the Consumer and the Monitor move the messages
+delivered more than ``max_deliveries`` times to the dead-letter stream: the
+original fields are added to it together with the ``_dlq_*`` metadata fields and
+the message is acknowledged in the source group, in a single MULTI/EXEC
+transaction.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+from redis import Redis
+
+SOURCE_STREAM_FIELD = "_dlq_stream"
+SOURCE_GROUP_FIELD = "_dlq_group"
+SOURCE_ID_FIELD = "_dlq_id"
+CONSUMER_FIELD = "_dlq_consumer"
+DELIVERIES_FIELD = "_dlq_deliveries"
+MOVED_AT_FIELD = "_dlq_moved_at_ms"
+
+
+class DeadLetterPolicy:
+    def __init__(
+        self,
+        stream: str,
+        max_deliveries: int = 5,
+        maxlen: Optional[int] = None,
+        delete_from_source: bool = False,
+    ):
+        """
+        :param stream: name of the dead-letter stream, can be shared by many
+                    source streams
+        :param max_deliveries: messages delivered more times are moved
+        :param maxlen: approximate maximum length of the dead-letter stream, None
+                    means no trimming
+        :param delete_from_source: also delete the moved messages from the source
+                    stream, don't set it if other consumer groups read the stream
+        """
+        if max_deliveries < 1:
+            raise ValueError("max_deliveries must be at least 1")
+        self.stream = stream
+        self.max_deliveries = max_deliveries
+        self.maxlen = maxlen
+        self.delete_from_source = delete_from_source
+
+    def is_poison(self, pending_entry: Dict[str, Any]) -> bool:
+        """
+        :param pending_entry: XPENDING entry of the message
+        """
+        return pending_entry.get("times_delivered", 0) > self.max_deliveries
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"stream={self.stream},"
+            f"max_deliveries={self.max_deliveries},"
+            f"maxlen={self.maxlen},"
+            f"delete_from_source={self.delete_from_source})"
+        )
+
+
+def _name(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def move_to_dead_letter(
+    redis_conn: Redis,
+    stream: str,
+    group: str,
+    pending_entries: List[Dict[str, Any]],
+    policy: DeadLetterPolicy,
+) -> List[str]:
+    """
+    Move the poison messages among the pending entries to the dead-letter stream.
+    The fields of the messages are read by one pipeline first, then the XADD of
+    each message and a single XACK (and XDEL) are executed as one transaction, so
+    a message is either moved and acknowledged or left pending. A message
+    deleted from the source stream meanwhile is dead-lettered with the metadata
+    only.
+    :param pending_entries: XPENDING entries, e.g. of get_pending_items_of_consumer
+    :return: ids of the moved messages
+    """
+    poison = [entry for entry in pending_entries if policy.is_poison(entry)]
+    if not poison:
+        return []
+    msg_ids = [_name(entry.get("message_id")) for entry in poison]
+    pipe = redis_conn.pipeline(transaction=False)
+    for msg_id in msg_ids:
+        pipe.xrange(name=stream, min=msg_id, max=msg_id, count=1)
+    contents = pipe.execute()
+    moved_at_ms = int(time.time() * 1000)
+    pipe = redis_conn.pipeline(transaction=True)
+    for msg_id, entry, content in zip(msg_ids, poison, contents):
+        fields = dict(content[0][1]) if content else {}
+        fields.update(
+            {
+                SOURCE_STREAM_FIELD: stream,
+                SOURCE_GROUP_FIELD: group,
+                SOURCE_ID_FIELD: msg_id,
+                CONSUMER_FIELD: _name(entry.get("consumer")),
+                DELIVERIES_FIELD: entry.get("times_delivered", 0),
+                MOVED_AT_FIELD: moved_at_ms,
+            }
+        )
+        pipe.xadd(
+            name=policy.stream,
+            fields=fields,
+            maxlen=policy.maxlen,
+            approximate=True,
+        )
+    pipe.xack(stream, group, *msg_ids)
+    if policy.delete_from_source:
+        pipe.xdel(stream, *msg_ids)
+    pipe.execute()
+    return msg_ids
@@ -1,13 +1,24 @@
+import heapq
 import json
 import sys
 from collections import defaultdict
 from enum import Enum
-from typing import Any, Awaitable, Union
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Union
 
 from redis import Redis
+from redis.exceptions import ResponseError
 from tabulate import tabulate
 
 from redis_streams.common import ConsumerAndMonitor
+from redis_streams.dead_letter import DeadLetterPolicy, move_to_dead_letter
+from redis_streams.snapshot import StreamSnapshot, collect_snapshots
+
+# redis-py drops the cursor of XAUTOCLAIM with JUSTID, the script returns it
+XAUTOCLAIM_JUSTID_SCRIPT = """
+return redis.call(
+    'XAUTOCLAIM', KEYS[1], ARGV[1], ARGV[2], ARGV[3], ARGV[4],
+    'COUNT', ARGV[5], 'JUSTID')
+"""
 
 
 class Status(Enum):
@@ -44,7 +55,130 @@ class ConsumerMetrics:
         )
 
 
-class Monitor(ConsumerAndMonitor):
+class MonitorBase:
+    """
+    Health check of the consumers and spreading of the messages across them, the
+    part of the Monitor not talking to Redis. Shared by redis_streams.aio.monitor
+    """
+
+    consumer_group: str
+    batch_size: int
+    idle_time_ms_warning_threshold: int
+    collected_consumers_data: List[ConsumerMetrics]
+    consumer_to_assign: str
+    unhealthy_consumers: Dict[str, Dict[str, int]]
+    # group -> consumer id -> metrics of the healthy consumers, the pending items
+    # are updated as messages are assigned to them
+    healthy_consumers: Dict[str, Dict[str, ConsumerMetrics]]
+
+    def _reset_consumers(self) -> None:
+        self.collected_consumers_data = []
+        self.consumer_to_assign = ""
+        self.unhealthy_consumers = defaultdict(dict)
+        self.healthy_consumers = defaultdict(dict)
+
+    def _get_status_by_metrics(self, pending: int, idle: int) -> str:
+        status = Status.OK.value
+        if pending > self.batch_size:
+            status = Status.PENDING.value
+        elif idle > self.idle_time_ms_warning_threshold:
+            status = Status.IDLE.value
+        return status
+
+    def _add_consumer(self, group: str, consumer: Dict[str, Any]) -> None:
+        """
+        :param consumer: XINFO CONSUMERS entry
+        """
+        consumer_id = consumer["name"]
+        pending_items = consumer.get("pending", 0)
+        idle = consumer.get("idle", 0)
+        status = self._get_status_by_metrics(pending=pending_items, idle=idle)
+        if status != Status.OK.value:
+            self.unhealthy_consumers[group][consumer_id] = pending_items
+        else:
+            self.healthy_consumers[group][consumer_id] = ConsumerMetrics(
+                consumer_id=consumer_id,
+                idle_time=idle,
+                pending_items=pending_items,
+                status=status,
+            )
+        self.collected_consumers_data.append(
+            ConsumerMetrics(
+                consumer_id=consumer_id,
+                idle_time=idle,
+                pending_items=pending_items,
+                status=status,
+            )
+        )
+
+    def _select_consumer_to_assign(self) -> None:
+        own_group = self.healthy_consumers.get(self.consumer_group)
+        if own_group:
+            # the least loaded healthy consumer of the monitored group
+            self.consumer_to_assign = min(
+                own_group.values(), key=self._load
+            ).consumer_id
+
+    def _load(self, metrics: ConsumerMetrics) -> float:
+        """
+        Pending items weighted by the idle time: a consumer idle for the warning
+        threshold counts as twice as loaded as one which just fetched messages
+        """
+        idle = min(metrics.idle_time or 0, self.idle_time_ms_warning_threshold)
+        liveness = 1 - idle / (2 * self.idle_time_ms_warning_threshold or 1)
+        return (metrics.pending_items + 1) / liveness
+
+    def _distribute(
+        self, items: list, candidates: Dict[str, ConsumerMetrics]
+    ) -> Dict[str, list]:
+        """
+        Split the items among the candidates, each item goes to the one with the
+        lowest load (see _load), so the loads get as even as possible. The pending
+        items of the candidates are increased by their share.
+        """
+        heap = [(self._load(metrics), cid) for cid, metrics in candidates.items()]
+        heapq.heapify(heap)
+        shares: Dict[str, list] = defaultdict(list)
+        for item in items:
+            _, consumer_id = heap[0]
+            shares[consumer_id].append(item)
+            metrics = candidates[consumer_id]
+            metrics.pending_items += 1
+            heapq.heapreplace(heap, (self._load(metrics), consumer_id))
+        return shares
+
+    def _candidates(self, group: str) -> Dict[str, ConsumerMetrics]:
+        candidates = self.healthy_consumers.get(group)
+        if not candidates and self.consumer_to_assign and group == self.consumer_group:
+            # cleanup without collect_monitoring_data
+            candidates = {
+                self.consumer_to_assign: ConsumerMetrics(
+                    consumer_id=self.consumer_to_assign,
+                    pending_items=0,
+                    idle_time=0,
+                    status=Status.OK.value,
+                )
+            }
+        return candidates or {}
+
+    def _generate_table(self):
+        rows = []
+        for row in self.collected_consumers_data:
+            rows.append([row.consumer_id, row.idle_time, row.pending_items, row.status])
+        return tabulate(
+            rows,
+            headers=["Consumer id", "Idle time", "Pending items", "Status"],
+            tablefmt="grid",
+        )
+
+    def print_monitoring_data(self, output_stream=sys.stdout):
+        if hasattr(output_stream, "write"):
+            output_stream.write(self._generate_table())
+        else:
+            print(self._generate_table())
+
+
+class Monitor(ConsumerAndMonitor, MonitorBase):
     def __init__(
         self,
         redis_conn: Redis,
@@ -53,6 +187,10 @@ class Monitor(ConsumerAndMonitor):
         batch_size: int = 2,
         min_wait_time_ms: int = 1000,
         idle_time_ms_warning_threshold: int = 30000,
+        claim_page_size: int = 1000,
+        reclaim_idle_time_ms: Optional[int] = None,
+        dead_letter: Optional[DeadLetterPolicy] = None,
+        poison_pages_per_cycle: Optional[int] = 1,
     ):
         """
         Periodically check the activity of the consumers warns if they are idle  - not
@@ -71,6 +209,26 @@ class Monitor(ConsumerAndMonitor):
                           Should be bigger to max_wait_time_ms parameter of consumer as
                           consumer need to collect messgages from the stream plus should
                           process them
+        :param claim_page_size: maximum number of messages read from the pending
+                          entries list and claimed by a single pipeline, so
+                          cleaning up a consumer with a huge backlog doesn't need
+                          huge responses or block Redis for long. The messages of a
+                          page are spread across the healthy consumers of the
+                          group, see _distribute
+        :param reclaim_idle_time_ms: if set, the cleanup also claims every message
+                          of the group pending for longer than this to the consumer
+                          to assign, see reclaim_stale_messages
+        :param dead_letter: the cleanup moves the messages delivered more times
+                          than the policy allows to its dead-letter stream
+                          instead of assigning them to another consumer. The
+                          automatic cleanup also pages through the pending
+                          entries list of the group for them, see
+                          move_poison_messages
+        :param poison_pages_per_cycle: pages of claim_page_size entries checked for
+                          poison messages by a collect_monitoring_data call, the
+                          next call continues after them, so a huge pending
+                          entries list is covered over several cycles. None checks
+                          the whole list in every cycle
         """
         super().__init__(
             redis_conn=redis_conn, stream=stream, consumer_group=consumer_group
@@ -78,51 +236,180 @@ class Monitor(ConsumerAndMonitor):
         self.batch_size = batch_size
         self.min_wait_time_ms = min_wait_time_ms
         self.idle_time_ms_warning_threshold = idle_time_ms_warning_threshold
-        self.collected_consumers_data: list = []
-        self.consumer_to_assign = ""
-        self.unhealthy_consumers: dict = defaultdict(lambda: {})
+        self.claim_page_size = claim_page_size
+        self.reclaim_idle_time_ms = reclaim_idle_time_ms
+        self.dead_letter = dead_letter
+        self.dead_lettered_messages = 0
+        self.poison_pages_per_cycle = poison_pages_per_cycle
+        # group -> first id of the next poison check, see move_poison_messages
+        self._poison_cursors: Dict[str, str] = {}
+        self._xautoclaim_supported = True
+        self._xautoclaim_justid = redis_conn.register_script(XAUTOCLAIM_JUSTID_SCRIPT)
+        self._reset_consumers()
 
-    def _get_status_by_metrics(self, pending: int, idle: int) -> str:
-        status = Status.OK.value
-        if pending > self.batch_size:
-            status = Status.PENDING.value
-        elif idle > self.idle_time_ms_warning_threshold:
-            status = Status.IDLE.value
-        return status
+    @staticmethod
+    def _next_id(msg_id: Union[str, bytes]) -> str:
+        """
+        The smallest stream ID after msg_id, to continue paging after it
+        """
+        if isinstance(msg_id, bytes):
+            msg_id = msg_id.decode()
+        timestamp, sequence = msg_id.split("-")
+        return f"{timestamp}-{int(sequence) + 1}"
+
+    def _pending_pages(
+        self,
+        consumer_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        group: Optional[str] = None,
+        start: str = "-",
+    ) -> Iterator[list]:
+        """
+        Page through the pending entries list of the group, or of a consumer if
+        consumer_id is given, claim_page_size XPENDING entries per page
+        :param limit: maximum number of ids in total
+        :param group: defaults to the consumer group of the monitor
+        :param start: smallest id of the first page
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            count = self.claim_page_size
+            if remaining is not None:
+                count = min(count, remaining)
+                remaining -= count
+            page: list = self.redis_conn.xpending_range(  # type: ignore[assignment]
+                name=self.stream,
+                groupname=group or self.consumer_group,
+                min=start,
+                max="+",
+                count=count,
+                consumername=consumer_id,  # type: ignore[arg-type]
+            )
+            if not page:
+                return
+            yield page
+            if len(page) < count:
+                return
+            start = self._next_id(page[-1].get("message_id"))
+
+    def _dead_letter_page(self, page: list, group: Optional[str] = None) -> list:
+        """
+        Move the poison messages of a page of pending entries
+        :return: ids of the rest of the messages
+        """
+        ids = [message.get("message_id") for message in page]
+        if not self.dead_letter:
+            return ids
+        moved = move_to_dead_letter(
+            self.redis_conn,
+            stream=self.stream,
+            group=group or self.consumer_group,
+            pending_entries=page,
+            policy=self.dead_letter,
+        )
+        if not moved:
+            return ids
+        self.logger.warning(f"Moved {len(moved)} messages to {self.dead_letter.stream}")
+        self.dead_lettered_messages += len(moved)
+        moved_ids = set(moved)
+        return [
+            msg_id
+            for msg_id in ids
+            if (msg_id.decode() if isinstance(msg_id, bytes) else msg_id)
+            not in moved_ids
+        ]
+
+    def move_poison_messages(
+        self,
+        group: Optional[str] = None,
+        max_pages: Optional[int] = None,
+        resume: bool = False,
+    ) -> int:
+        """
+        Page through the pending entries list of the group and move the poison
+        messages to the dead-letter stream, whichever consumer they belong to
+        :param group: defaults to the consumer group of the monitor
+        :param max_pages: stop after this many pages of claim_page_size entries
+        :param resume: continue after the last page of the previous call stopped
+                       by max_pages instead of the beginning, the end of the list
+                       wraps around to the beginning
+        :return: number of moved messages
+        """
+        if not self.dead_letter:
+            raise ValueError("No dead-letter policy is set")
+        group = group or self.consumer_group
+        start = self._poison_cursors.get(group, "-") if resume else "-"
+        limit = None if max_pages is None else max_pages * self.claim_page_size
+        before = self.dead_lettered_messages
+        read = 0
+        last_page: list = []
+        for page in self._pending_pages(limit=limit, group=group, start=start):
+            self._dead_letter_page(page, group=group)
+            read += len(page)
+            last_page = page
+        if resume:
+            if limit is None or read < limit:
+                # the end of the list, start over at the next call
+                self._poison_cursors.pop(group, None)
+            elif last_page:
+                self._poison_cursors[group] = self._next_id(
+                    last_page[-1].get("message_id")
+                )
+        return self.dead_lettered_messages - before
 
     def cleanup_unhealthy_consumer(
-        self, pending_count: int, consumer_to_delete: str
+        self, pending_count: int, consumer_to_delete: str, group: Optional[str] = None
     ) -> None:
         """
         1. query the pending items of consumer
-        2. assign items to an active consumer
+        2. assign items to the healthy consumers of its group
         3. remove consumer
 
-        TODO: 2 and 3 can be done by XAUTOCLAIM if Redis supports
+        1 and 2 are done in pages of claim_page_size messages, the messages of a
+        page are spread across the healthy consumers and claimed by one XCLAIM
+        JUSTID per consumer sent in a single pipeline, the bodies are not
+        transferred. XAUTOCLAIM can't filter by consumer,
+        see reclaim_stale_messages for the group wide recovery. With a dead-letter
+        policy the poison messages of a page are moved instead of claimed.
+        :param group: consumer group of the consumer, defaults to the one of the
+                      monitor
         """
-        # 1
-        messages_to_cleanup = []
-        for message in self.get_pending_items_of_consumer(
-            item_count=pending_count, consumer_id=consumer_to_delete
-        ):
-            messages_to_cleanup.append(message.get("message_id"))
-        if len(messages_to_cleanup):
-            self.logger.debug(
-                f"Moving {len(messages_to_cleanup)} items from "
-                f"{consumer_to_delete} to {self.consumer_to_assign}"
+        group = group or self.consumer_group
+        candidates = self._candidates(group)
+        if not candidates:
+            self.logger.warning(
+                f"No healthy consumer in {group} to take over the messages of "
+                f"{consumer_to_delete}, keep it"
             )
-            # 2
-            self.assign_items_to_active_consumer(
-                items=messages_to_cleanup,
-                consumer_to_assign=self.consumer_to_assign,
-                group=self.consumer_group,
+            return
+        moved: Dict[str, int] = defaultdict(int)
+        for page in self._pending_pages(
+            consumer_id=consumer_to_delete, limit=pending_count, group=group
+        ):
+            shares = self._distribute(
+                self._dead_letter_page(page, group=group), candidates
             )
+            pipe = self.redis_conn.pipeline(transaction=False)
+            for consumer_id, items in shares.items():
+                pipe.xclaim(
+                    name=self.stream,
+                    groupname=group,
+                    consumername=consumer_id,
+                    message_ids=items,
+                    min_idle_time=self.min_wait_time_ms,
+                    justid=True,
+                )
+            for (consumer_id, items), claimed in zip(shares.items(), pipe.execute()):
+                # too fresh messages are not claimed
+                candidates[consumer_id].pending_items -= len(items) - len(claimed)
+                moved[consumer_id] += len(claimed)
+        if moved:
             self.logger.debug(
-                f"Moved {len(messages_to_cleanup)} items from "
-                f"{consumer_to_delete} to {self.consumer_to_assign}"
+                f"Moved {sum(moved.values())} items from "
+                f"{consumer_to_delete} to {dict(moved)}"
             )
         # 3
-        resp = self.remove_consumer(consumer_to_delete=consumer_to_delete)
+        resp = self.remove_consumer(consumer_to_delete=consumer_to_delete, group=group)
         if resp > 0:
             self.logger.error(f"{resp} messages lost")
 
@@ -137,46 +424,139 @@ class Monitor(ConsumerAndMonitor):
             min_idle_time=self.min_wait_time_ms,
         )
 
-    def collect_monitoring_data(self, auto_cleanup=True) -> None:
-        self.collected_consumers_data = []
-        self.unhealthy_consumers = defaultdict(lambda: {})
-        self.consumer_to_assign = ""
-        consumer_to_assign_pending_items = 0
-
-        for group in self.redis_conn.xinfo_groups(self.stream):
-            group_name = group.get("name")
-            if group.get("consumers") > 0:
-                for consumer in self.redis_conn.xinfo_consumers(
-                    name=self.stream, groupname=group_name
-                ):
-                    consumer_id = consumer.get("name")
-                    pending_items = consumer.get("pending", 0)
-                    idle = consumer.get("idle")
-                    status = self._get_status_by_metrics(
-                        pending=pending_items, idle=idle
-                    )
-                    if status != Status.OK.value:
-                        self.unhealthy_consumers[group_name][
-                            consumer_id
-                        ] = pending_items
-                    else:
-                        if not consumer_to_assign_pending_items:
-                            pending_items = consumer_to_assign_pending_items
-                        if pending_items <= consumer_to_assign_pending_items:
-                            self.consumer_to_assign = consumer_id
-                            consumer_to_assign_pending_items = pending_items
-                    self.collected_consumers_data.append(
-                        ConsumerMetrics(
-                            consumer_id=consumer_id,
-                            idle_time=consumer.get("idle"),
-                            pending_items=consumer.get("pending"),
-                            status=status,
-                        )
-                    )
+    def reclaim_stale_messages(
+        self,
+        consumer_to_assign: Optional[str] = None,
+        min_idle_time_ms: Optional[int] = None,
+        max_pages: Optional[int] = None,
+    ) -> int:
+        """
+        Claim the messages of the group pending for at least min_idle_time_ms,
+        whichever consumer they belong to. Uses cursor paged XAUTOCLAIM, each call
+        claims at most claim_page_size messages. Servers older than 6.2 don't
+        support it, then the pending entries list is paged with XPENDING and each
+        page is claimed by XCLAIM. Both are sent with JUSTID, only the ids are
+        returned. A page is claimed by a single consumer, so the stale messages
+        are spread across the healthy consumers page by page, set claim_page_size
+        accordingly.
+        :param consumer_to_assign: the consumer getting every message, by default
+                                   each page goes to the least loaded healthy
+                                   consumer of the group (see _load), collected by
+                                   collect_monitoring_data
+        :param min_idle_time_ms: defaults to reclaim_idle_time_ms or if it isn't set
+                                 to idle_time_ms_warning_threshold
+        :param max_pages: stop after this many pages, e.g. to bound the time spent,
+                          the next call starts from the beginning again
+        :return: number of claimed messages
+        """
+        if min_idle_time_ms is None:
+            min_idle_time_ms = (
+                self.reclaim_idle_time_ms or self.idle_time_ms_warning_threshold
+            )
+        if consumer_to_assign is None:
+            candidates = self._candidates(self.consumer_group)
+            if not candidates:
+                self.logger.warning(
+                    f"No healthy consumer in {self.consumer_group} to reclaim to"
+                )
+                return 0
+        else:
+            candidates = {
+                consumer_to_assign: ConsumerMetrics(
+                    consumer_id=consumer_to_assign,
+                    pending_items=0,
+                    idle_time=0,
+                    status=Status.OK.value,
+                )
+            }
+        if self._xautoclaim_supported:
+            try:
+                return self._xautoclaim(candidates, min_idle_time_ms, max_pages)
+            except ResponseError as exc:
+                # "unknown command", from the script "Unknown Redis command"
+                if "unknown" not in str(exc).lower():
+                    raise
+                self.logger.info("XAUTOCLAIM is not supported, fall back to XCLAIM")
+                self._xautoclaim_supported = False
+        claimed = 0
+        for page_no, page in enumerate(self._pending_pages()):
+            if max_pages is not None and page_no >= max_pages:
+                break
+            message_ids = self._dead_letter_page(page)
+            if not message_ids:
+                # the whole page was dead-lettered
+                continue
+            metrics = min(candidates.values(), key=self._load)
+            claimed_ids = self.redis_conn.xclaim(
+                name=self.stream,
+                groupname=self.consumer_group,
+                consumername=metrics.consumer_id,
+                message_ids=message_ids,
+                min_idle_time=min_idle_time_ms,
+                justid=True,
+            )
+            metrics.pending_items += len(claimed_ids)
+            claimed += len(claimed_ids)
+        return claimed
+
+    def _xautoclaim(
+        self,
+        candidates: Dict[str, ConsumerMetrics],
+        min_idle_time_ms: int,
+        max_pages: Optional[int],
+    ) -> int:
+        cursor: Union[str, bytes] = "0-0"
+        moved: Dict[str, int] = defaultdict(int)
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            metrics = min(candidates.values(), key=self._load)
+            resp = self._xautoclaim_justid(
+                keys=[self.stream],
+                args=[
+                    self.consumer_group,
+                    metrics.consumer_id,
+                    min_idle_time_ms,
+                    cursor,
+                    self.claim_page_size,
+                ],
+            )
+            cursor, messages = resp[0], resp[1]
+            metrics.pending_items += len(messages)
+            moved[metrics.consumer_id] += len(messages)
+            pages += 1
+            if cursor in ("0-0", b"0-0"):
+                break
+        claimed = sum(moved.values())
+        if claimed:
+            self.logger.debug(f"Reclaimed {claimed} stale items to {dict(moved)}")
+        return claimed
+
+    def collect_monitoring_data(
+        self, auto_cleanup=True, snapshot: Optional[StreamSnapshot] = None
+    ) -> None:
+        """
+        :param snapshot: use this instead of querying Redis, e.g. collected for many
+                         streams at once by redis_streams.snapshot.collect_snapshots
+        """
+        if snapshot is None:
+            snapshot = collect_snapshots(self.redis_conn, [self.stream])[self.stream]
+        self._reset_consumers()
+        for group_name in snapshot.groups:
+            for consumer in snapshot.consumers.get(group_name, []):
+                self._add_consumer(group_name, consumer)
+        self._select_consumer_to_assign()
         if auto_cleanup:
-            if self.consumer_to_assign and len(self.unhealthy_consumers):
+            if self.dead_letter:
+                self.move_poison_messages(
+                    max_pages=self.poison_pages_per_cycle, resume=True
+                )
+            if self.consumer_to_assign and self.reclaim_idle_time_ms is not None:
+                self.reclaim_stale_messages()
+            if any(
+                self.healthy_consumers.get(group) for group in self.unhealthy_consumers
+            ):
                 self.cleanup()
-            elif self.consumer_to_assign:
+            elif not len(self.unhealthy_consumers):
                 self.logger.debug("No cleanup, as no unhealthy consumers")
             else:
                 self.logger.debug("No cleanup, as no healthy consumer to assign")
@@ -190,20 +570,5 @@ class Monitor(ConsumerAndMonitor):
                 self.cleanup_unhealthy_consumer(
                     consumer_to_delete=consumer_id,
                     pending_count=pending_items,
+                    group=group,
                 )
-
-    def _generate_table(self):
-        rows = []
-        for row in self.collected_consumers_data:
-            rows.append([row.consumer_id, row.idle_time, row.pending_items, row.status])
-        return tabulate(
-            rows,
-            headers=["Consumer id", "Idle time", "Pending items", "Status"],
-            tablefmt="grid",
-        )
-
-    def print_monitoring_data(self, output_stream=sys.stdout):
-        if hasattr(output_stream, "write"):
-            output_stream.write(self._generate_table())
-        else:
-            print(self._generate_table())
@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from redis import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import ResponseError
+
+from redis_streams import PACKAGE
+from redis_streams.common import BaseRedisClass
+from redis_streams.consumer import MsgId, RedisMsg
+
+
+class MultiStreamConsumer:
+    def __init__(
+        self,
+        redis_conn: Redis,
+        streams: Union[List[str], Dict[str, str]],
+        consumer_group: Optional[str] = None,
+        consumer_id: Union[str, int] = f"{os.getpid()}{threading.get_ident()}",
+        batch_size: int = 2,
+        max_wait_time_ms: int = 10000,
+        poll_time_ms: int = 1000,
+    ):
+        """
+        Consumer collecting a batch from several streams. The streams of the same
+        consumer group are read by a single XREADGROUP, the reads of different
+        groups are sent in one pipeline. The returned messages have a stream
+        attribute with the name of their source stream.
+        The batch is split evenly among the streams: each read requests
+        batch_size / number of streams messages from every stream, so a busy stream
+        can't starve the others. As the share is at least 1, a batch can have
+        number of streams - 1 messages more than batch_size.
+        Not acknowledged messages are kept in memory and returned with the next
+        batch, the pending entries lists are read at startup, after a connection
+        error or after resync_pending().
+        :param streams: list of stream names read with consumer_group, or a
+                    stream name -> consumer group mapping
+        :param consumer_group: consumer group of the streams given as a list
+        See Consumer for the rest of the parameters
+        """
+        if not isinstance(streams, dict):
+            if consumer_group is None:
+                raise ValueError("Consumer group is needed for a list of streams")
+            streams = {stream: consumer_group for stream in streams}
+        if not streams:
+            raise ValueError("At least one stream is needed")
+        self.redis_conn = redis_conn
+        self.streams = streams
+        self.consumer_id = consumer_id
+        self.batch_size = batch_size
+        self.max_wait_time_ms = max_wait_time_ms
+        self.poll_time_ms = poll_time_ms
+        self.logger = logging.getLogger(f"{PACKAGE}_{self.__class__.__name__}")
+        self.streams_of_group: Dict[str, List[str]] = defaultdict(list)
+        for stream, group in streams.items():
+            self.streams_of_group[group].append(stream)
+        self._pending: Dict[Tuple[str, str], RedisMsg] = {}
+        self._pending_synced = False
+        self.prepare_redis()
+
+    def prepare_redis(self) -> None:
+        for stream, group in self.streams.items():
+            BaseRedisClass(
+                redis_conn=self.redis_conn, stream=stream, consumer_group=group
+            )
+
+    def _share_per_stream(self, requested_messages: int) -> int:
+        return max(1, requested_messages // len(self.streams))
+
+    def _read(self, latest_or_new: str, count: int, block: bool) -> List[RedisMsg]:
+        """
+        One XREADGROUP per consumer group in a single pipeline. The poll time is
+        split among the groups so a poll takes at most poll_time_ms
+        """
+        block_ms = None
+        if block:
+            block_ms = max(1, self.poll_time_ms // len(self.streams_of_group))
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for group, streams in self.streams_of_group.items():
+            pipe.xreadgroup(
+                groupname=group,
+                consumername=self.consumer_id,  # type: ignore[arg-type]
+                count=count,
+                streams={stream: latest_or_new for stream in streams},
+                block=block_ms,
+                noack=False,
+            )
+        try:
+            responses = pipe.execute(raise_on_error=False)
+        except RedisConnectionError:
+            # messages might have been claimed meanwhile
+            self._pending_synced = False
+            raise
+        msgs = []
+        for group, resp in zip(self.streams_of_group, responses):
+            if isinstance(resp, ResponseError):
+                self.logger.warning(
+                    f"Failed to get messages from {self.streams_of_group[group]} "
+                    f"from {group} as {self.consumer_id}: {resp}"
+                )
+                continue
+            msgs += self._transform_redis_resp_to_objects(resp)
+        self.logger.debug(f"Got {len(msgs)} messages")
+        return msgs
+
+    @staticmethod
+    def _transform_redis_resp_to_objects(items) -> List[RedisMsg]:
+        msgs = []
+        for stream, entries in items or []:
+            if isinstance(stream, bytes):
+                stream = stream.decode()
+            for msgid, content in entries:
+                msgs.append(RedisMsg(msgid=msgid, content=content, stream=stream))
+        return msgs
+
+    def _sync_pending(self) -> None:
+        items = self._read(
+            latest_or_new=MsgId.already_delivered.value,
+            count=self.batch_size,
+            block=False,
+        )
+        for msg in items:
+            self._pending.setdefault((msg.stream, msg.msgid), msg)
+        per_stream: Dict[str, int] = defaultdict(int)
+        for msg in items:
+            per_stream[msg.stream] += 1
+        # a full page means there can be more in the PEL, read it again next time
+        self._pending_synced = all(
+            count < self.batch_size for count in per_stream.values()
+        )
+
+    def get_items(self) -> List[RedisMsg]:
+        if not self._pending_synced:
+            self._sync_pending()
+        stop_time = time.monotonic() + self.max_wait_time_ms / 1000
+        while len(self._pending) < self.batch_size and time.monotonic() <= stop_time:
+            for msg in self._read(
+                latest_or_new=MsgId.never_delivered.value,
+                count=self._share_per_stream(self.batch_size - len(self._pending)),
+                block=True,
+            ):
+                self._pending[(msg.stream, msg.msgid)] = msg
+        return list(self._pending.values())
+
+    def resync_pending(self) -> None:
+        """
+        Read the pending entries lists at the next get_items call, needed if
+        messages were claimed by or from this consumer
+        """
+        self._pending = {}
+        self._pending_synced = False
+
+    def remove_item_from_consumer_group(self, item_id: str, stream: str) -> None:
+        """
+        Acknowledge a message of the given stream
+        """
+        self.redis_conn.xack(stream, self.streams[stream], item_id)
+        self._pending.pop((stream, item_id), None)
+
+    def ack_batch(self, messages: Iterable[RedisMsg]) -> int:
+        """
+        Acknowledge messages of any of the streams, one XACK per stream sent in a
+        single pipeline
+        :return: number of acknowledged messages
+        """
+        ids_of_stream: Dict[str, List[str]] = defaultdict(list)
+        for message in messages:
+            ids_of_stream[message.stream].append(message.msgid)
+        if not ids_of_stream:
+            return 0
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for stream, item_ids in ids_of_stream.items():
+            pipe.xack(stream, self.streams[stream], *item_ids)
+        acknowledged = sum(pipe.execute())
+        for stream, item_ids in ids_of_stream.items():
+            for item_id in item_ids:
+                self._pending.pop((stream, item_id), None)
+        return acknowledged
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"redis_conn={self.redis_conn},"
+            f"streams={self.streams},"
+            f"consumer_id={self.consumer_id},"
+            f"batch_size={self.batch_size},"
+            f"max_wait_time_ms={self.max_wait_time_ms},"
+            f"poll_time_ms={self.poll_time_ms})"
+        )
@@ -2,18 +2,114 @@
 Redis-stream producer.
 
 Provides a thin wrapper around ``XADD`` with optional ``maxlen`` trimming
-and consistent logging.
+and consistent logging, plus a buffered variant which publishes in the
+background.
 """
 
 import logging
-from typing import Dict, Optional, Union
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from enum import Enum
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
 
 from redis import Redis
+from redis.exceptions import RedisError
 
 from redis_streams import PACKAGE
+from redis_streams.claim_check import REFERENCE_FIELD, BlobStore
+from redis_streams.codecs import PAYLOAD_FIELD, Codec, encode_fields, get_codec
+from redis_streams.compression import CompressionStats, Compressor, get_compressor
 
+MsgData = Dict[str, Union[str, int, float, bytes]]
 
-class Producer:
+
+class PartialPublishError(Exception):
+    """
+    Raised by :meth:`Producer.add_many` when some of the messages could not be
+    published. The successfully published messages are not rolled back.
+
+    :param msg_ids: IDs in the order of the input, ``None`` where publishing failed
+    :param failures: input index -> exception of the failed messages
+    """
+
+    def __init__(self, msg_ids: List[Optional[str]], failures: Dict[int, Exception]):
+        super().__init__(
+            f"Failed to publish {len(failures)} of {len(msg_ids)} messages"
+        )
+        self.msg_ids = msg_ids
+        self.failures = failures
+
+
+class BufferFullError(Exception):
+    """
+    The buffer of a :class:`BufferedProducer` is full and the backpressure
+    strategy is :attr:`Backpressure.RAISE` or :attr:`Backpressure.DROP`
+    """
+
+
+class Backpressure(Enum):
+    """
+    What :meth:`BufferedProducer.submit` does when the buffer is full
+    'block' wait until the background thread makes room
+    'drop' do not buffer the message, its future fails with BufferFullError
+    'raise' raise BufferFullError
+    """
+
+    BLOCK = "block"
+    DROP = "drop"
+    RAISE = "raise"
+
+
+class ProducerBase:
+    """
+    Encoding of the messages and their XADD command, shared by
+    redis_streams.aio.producer
+    """
+
+    stream: str
+    maxlen: Optional[int]
+    codec: Optional[Codec]
+    compressor: Optional[Compressor]
+    compression_threshold: int
+    compression_stats: CompressionStats
+
+    def _encode(self, data: Any) -> MsgData:
+        if self.codec is None:
+            return data
+        return encode_fields(  # type: ignore[return-value]
+            data,
+            self.codec,
+            compressor=self.compressor,
+            compression_threshold=self.compression_threshold,
+            compression_stats=self.compression_stats,
+        )
+
+    def _encode_each(self, messages: List[Any]) -> List[Union[MsgData, Exception]]:
+        """
+        Encode the messages one by one, the exception in place of a message the
+        codec couldn't encode, so it doesn't fail the others
+        """
+        encoded: List[Union[MsgData, Exception]] = []
+        for data in messages:
+            try:
+                encoded.append(self._encode(data))
+            except Exception as exc:  # pylint: disable=broad-except
+                encoded.append(exc)
+        return encoded
+
+    def _xadd(self, conn, fields: MsgData):
+        return conn.xadd(
+            name=self.stream,
+            fields=fields,  # type: ignore[arg-type]
+            maxlen=self.maxlen,
+            approximate=self.maxlen is not None,
+        )
+
+
+class Producer(ProducerBase):
     """
     Publishes messages to a Redis Stream.
 
@@ -21,6 +117,20 @@ class Producer:
     :param stream: Name of the target stream.
     :param maxlen: If set, the stream will be trimmed to approximately this
         length after each ``add`` call (uses Redis ``MAXLEN ~`` trimming).
+    :param codec: If set, ``add`` accepts any object the codec can encode and
+        stores it in a single binary field, see :mod:`redis_streams.codecs`.
+        Codec instance or name of a registered codec, e.g. ``"json"``.
+    :param compression: Compress the encoded payloads reaching
+        ``compression_threshold`` bytes, requires a codec, see
+        :mod:`redis_streams.compression`. Compressor instance or name of a
+        registered one, e.g. ``"zlib"``. ``compression_stats`` collects the sizes
+        and the time spent on compression.
+    :param compression_threshold: Minimum payload size to compress in bytes.
+    :param blob_store: Store the encoded (and compressed) payloads reaching
+        ``offload_threshold`` bytes in this store and only their key in the
+        stream, requires a codec, see :mod:`redis_streams.claim_check`. The
+        consumers need the same store to resolve them.
+    :param offload_threshold: Minimum payload size to offload in bytes.
     """
 
     def __init__(
@@ -28,32 +138,406 @@ class Producer:
         redis_conn: Redis,
         stream: str,
         maxlen: Optional[int] = None,
+        codec: Optional[Union[str, Codec]] = None,
+        compression: Optional[Union[str, Compressor]] = None,
+        compression_threshold: int = 1024,
+        blob_store: Optional[BlobStore] = None,
+        offload_threshold: int = 64 * 1024,
     ):
+        if compression is not None and codec is None:
+            raise ValueError("Compression requires a codec")
+        if blob_store is not None and codec is None:
+            raise ValueError("Offloading payloads requires a codec")
         self.redis_conn = redis_conn
         self.stream = stream
         self.maxlen = maxlen
+        self.codec = get_codec(codec) if codec is not None else None
+        self.compressor = (
+            get_compressor(compression) if compression is not None else None
+        )
+        self.compression_threshold = compression_threshold
+        self.compression_stats = CompressionStats()
+        self.blob_store = blob_store
+        self.offload_threshold = offload_threshold
         self.logger = logging.getLogger(PACKAGE)
 
-    def add(self, data: Dict[str, Union[str, int, float, bytes]]) -> str:
+    def _offload(self, encoded: List[MsgData]) -> None:
+        """
+        Move the large payloads of the encoded messages to the blob store, all of
+        them are written before the stream entries referring to them
+        """
+        if self.blob_store is None:
+            return
+        blobs = {}
+        for fields in encoded:
+            payload = fields[PAYLOAD_FIELD]
+            if len(payload) >= self.offload_threshold:  # type: ignore[arg-type]
+                key = self.blob_store.new_key()
+                blobs[key] = payload
+                del fields[PAYLOAD_FIELD]
+                fields[REFERENCE_FIELD] = key
+        if blobs:
+            self.blob_store.put_many(blobs)  # type: ignore[arg-type]
+            self.logger.debug("Offloaded %s payloads", len(blobs))
+
+    def add(self, data: MsgData) -> str:
         """
         Publish a single message to the stream.
 
-        :param data: Field/value mapping to insert.
+        :param data: Field/value mapping to insert, or any object the codec can
+            encode if the producer has one.
         :returns: The message ID assigned by Redis.
         """
-        msg_id: str = self.redis_conn.xadd(  # type: ignore[assignment]
-            name=self.stream,
-            fields=data,  # type: ignore[arg-type]
-            maxlen=self.maxlen,
-            approximate=self.maxlen is not None,
-        )
+        fields = self._encode(data)
+        self._offload([fields])
+        msg_id: str = self._xadd(self.redis_conn, fields)
         self.logger.debug("Published message %s to %s", msg_id, self.stream)
         return msg_id
 
+    @staticmethod
+    def _chunks(messages: Iterable[MsgData], chunk_size: int) -> Iterator[list]:
+        iterator = iter(messages)
+        while chunk := list(islice(iterator, chunk_size)):
+            yield chunk
+
+    def _send_chunk(self, chunk: List[MsgData]) -> List[Union[str, Exception]]:
+        """
+        Send the XADD commands of a chunk in one pipeline (one round trip).
+        Returns the message ID or the exception for each message of the chunk.
+        """
+        return self._send_encoded(self._encode_each(chunk))
+
+    def _send_encoded(
+        self, encoded: List[Union[MsgData, Exception]]
+    ) -> List[Union[str, Exception]]:
+        """
+        Send the XADD commands of the encoded messages in one pipeline, the
+        messages which failed to be encoded are skipped and keep their exception
+        """
+        valid = [fields for fields in encoded if not isinstance(fields, Exception)]
+        responses: List[Union[str, Exception]]
+        try:
+            self._offload(valid)  # type: ignore[arg-type]
+            pipe = self.redis_conn.pipeline(transaction=False)
+            for fields in valid:
+                self._xadd(pipe, fields)  # type: ignore[arg-type]
+            responses = pipe.execute(raise_on_error=False) if valid else []
+        except (RedisError, OSError) as exc:
+            # the payloads couldn't be offloaded or the whole round trip failed,
+            # e.g. connection error
+            responses = [exc] * len(valid)
+        sent = iter(responses)
+        return [
+            fields if isinstance(fields, Exception) else next(sent)
+            for fields in encoded
+        ]
+
+    def add_many(
+        self, messages: Iterable[MsgData], chunk_size: int = 500
+    ) -> List[Optional[str]]:
+        """
+        Publish many messages with pipelined XADD commands, one round trip per
+        ``chunk_size`` messages. Trimming works the same way as for :meth:`add`.
+
+        :param messages: Field/value mappings to insert.
+        :param chunk_size: Number of XADD commands sent in one pipeline.
+        :returns: The message IDs assigned by Redis, in the order of ``messages``.
+        :raises PartialPublishError: if any message failed to be published. It is
+            raised after all the chunks were sent and carries the IDs of the
+            successful ones.
+        """
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be at least 1")
+        msg_ids: List[Optional[str]] = []
+        failures: Dict[int, Exception] = {}
+        for chunk_no, chunk in enumerate(self._chunks(messages, chunk_size)):
+            chunk_failures = 0
+            for resp in self._send_chunk(chunk):
+                if isinstance(resp, Exception):
+                    failures[len(msg_ids)] = resp
+                    msg_ids.append(None)
+                    chunk_failures += 1
+                else:
+                    msg_ids.append(resp)
+            if chunk_failures:
+                self.logger.warning(
+                    "Failed to publish %s of %s messages of chunk %s to %s",
+                    chunk_failures,
+                    len(chunk),
+                    chunk_no,
+                    self.stream,
+                )
+        self.logger.debug("Published %s messages to %s", len(msg_ids), self.stream)
+        if failures:
+            raise PartialPublishError(msg_ids=msg_ids, failures=failures)
+        return msg_ids
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"redis_conn={self.redis_conn},"
+            f"stream={self.stream},"
+            f"maxlen={self.maxlen},"
+            f"codec={self.codec},"
+            f"compression={self.compressor},"
+            f"blob_store={self.blob_store})"
+        )
+
+
+class BufferedProducer(Producer):
+    """
+    Producer which collects the messages in a bounded local buffer and
+    publishes them from a background thread in a single pipeline once
+    ``batch_size`` messages are buffered or the oldest one waited ``linger_ms``,
+    whichever comes first. Similar to ``batch.size`` / ``linger.ms`` of Kafka.
+
+    :param redis_conn: A ``redis.Redis`` connection instance.
+    :param stream: Name of the target stream.
+    :param maxlen: Approximate maximum length of the stream, see :class:`Producer`.
+    :param batch_size: Number of buffered messages which triggers a flush.
+    :param linger_ms: Maximum time a message waits in the buffer.
+    :param buffer_size: Maximum number of messages in the buffer, including the
+        ones being published.
+    :param backpressure: What to do when the buffer is full, see
+        :class:`Backpressure`.
+    :param codec: Payload codec, see :class:`Producer`.
+    :param compression: Payload compression, see :class:`Producer`.
+    :param compression_threshold: Minimum payload size to compress in bytes.
+    :param blob_store: Store of the large payloads, see :class:`Producer`.
+    :param offload_threshold: Minimum payload size to offload in bytes.
+    """
+
+    def __init__(
+        self,
+        redis_conn: Redis,
+        stream: str,
+        maxlen: Optional[int] = None,
+        batch_size: int = 100,
+        linger_ms: int = 5,
+        buffer_size: int = 10000,
+        backpressure: Backpressure = Backpressure.BLOCK,
+        codec: Optional[Union[str, Codec]] = None,
+        compression: Optional[Union[str, Compressor]] = None,
+        compression_threshold: int = 1024,
+        blob_store: Optional[BlobStore] = None,
+        offload_threshold: int = 64 * 1024,
+    ):
+        super().__init__(
+            redis_conn=redis_conn,
+            stream=stream,
+            maxlen=maxlen,
+            codec=codec,
+            compression=compression,
+            compression_threshold=compression_threshold,
+            blob_store=blob_store,
+            offload_threshold=offload_threshold,
+        )
+        if batch_size < 1 or buffer_size < batch_size:
+            raise ValueError("Batch size must be within 1 and buffer size")
+        self.batch_size = batch_size
+        self.linger_ms = linger_ms
+        self.buffer_size = buffer_size
+        self.backpressure = backpressure
+        self._buffer: deque = deque()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        # sequence numbers of added / published messages, used by flush()
+        self._added = 0
+        self._done = 0
+        self._flush_target = 0
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"{self.__class__.__name__}-{stream}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, data: MsgData) -> "Future[str]":
+        """
+        Buffer a message to be published by the background thread. It is
+        encoded on the calling thread, so a message the codec can't encode
+        raises here instead of failing the batch it would be published in.
+
+        :param data: Field/value mapping to insert.
+        :returns: Future of the message ID assigned by Redis.
+        :raises BufferFullError: if the buffer is full and backpressure is
+            :attr:`Backpressure.RAISE`
+        """
+        return self._submit_encoded(self._encode(data))
+
+    def _submit_encoded(self, fields: MsgData) -> "Future[str]":
+        future: "Future[str]" = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.__class__.__name__} is closed")
+            while len(self._buffer) + self._in_flight >= self.buffer_size:
+                if self.backpressure == Backpressure.RAISE:
+                    raise BufferFullError(f"Buffer of {self.stream} is full")
+                if self.backpressure == Backpressure.DROP:
+                    self.logger.warning("Buffer of %s is full, drop", self.stream)
+                    future.set_exception(
+                        BufferFullError(f"Buffer of {self.stream} is full")
+                    )
+                    return future
+                self._cond.wait()
+                if self._closed:
+                    raise RuntimeError(f"{self.__class__.__name__} is closed")
+            self._buffer.append((fields, future, time.monotonic()))
+            self._added += 1
+            if len(self._buffer) in (1, self.batch_size):
+                # start the linger timer or flush a full batch
+                self._cond.notify_all()
+        return future
+
+    def add(self, data: MsgData) -> str:
+        """
+        Publish a single message through the buffer and wait for it, so it
+        returns after at most ``linger_ms`` plus the round trip. Use
+        :meth:`submit` to not wait.
+
+        :param data: Field/value mapping to insert.
+        :returns: The message ID assigned by Redis.
+        :raises BufferFullError: if the buffer is full and backpressure is
+            :attr:`Backpressure.RAISE` or :attr:`Backpressure.DROP`
+        """
+        return self.submit(data).result()
+
+    def add_many(
+        self, messages: Iterable[MsgData], chunk_size: int = 500
+    ) -> List[Optional[str]]:
+        """
+        Publish many messages through the buffer, see :meth:`Producer.add_many`.
+        The messages are buffered one by one, then flushed and waited for. They
+        are sent in pipelines of ``batch_size`` messages, ``chunk_size`` is only
+        validated.
+
+        :raises PartialPublishError: if any message failed to be published,
+            including the ones the full buffer didn't accept.
+        """
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be at least 1")
+        futures: List[Union["Future[str]", Exception]] = []
+        for fields in self._encode_each(list(messages)):
+            if isinstance(fields, Exception):
+                # the codec couldn't encode it
+                futures.append(fields)
+                continue
+            try:
+                futures.append(self._submit_encoded(fields))
+            except BufferFullError as exc:
+                futures.append(exc)
+        self.flush()
+        msg_ids: List[Optional[str]] = []
+        failures: Dict[int, Exception] = {}
+        for index, future in enumerate(futures):
+            error = future if isinstance(future, Exception) else future.exception()
+            if error is None:
+                msg_ids.append(future.result())  # type: ignore[union-attr]
+            else:
+                failures[index] = error
+                msg_ids.append(None)
+        if failures:
+            raise PartialPublishError(msg_ids=msg_ids, failures=failures)
+        return msg_ids
+
+    def _ready_to_publish(self) -> bool:
+        if not self._buffer:
+            return False
+        return (
+            self._closed
+            or len(self._buffer) >= self.batch_size
+            or self._added - len(self._buffer) < self._flush_target
+            or time.monotonic() - self._buffer[0][2] >= self.linger_ms / 1000
+        )
+
+    def _take_batch(self) -> list:
+        batch: list = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        self._in_flight = len(batch)
+        return batch
+
+    def _publish(self, batch: list) -> None:
+        try:
+            responses = self._send_encoded([fields for fields, _, _ in batch])
+        except Exception as exc:  # pylint: disable=broad-except
+            responses = [exc] * len(batch)
+        failed = 0
+        for (_, future, _), resp in zip(batch, responses):
+            if isinstance(resp, Exception):
+                future.set_exception(resp)
+                failed += 1
+            else:
+                future.set_result(resp)
+        if failed:
+            self.logger.warning(
+                "Failed to publish %s of %s messages to %s",
+                failed,
+                len(batch),
+                self.stream,
+            )
+        else:
+            self.logger.debug("Published %s messages to %s", len(batch), self.stream)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready_to_publish():
+                    if self._closed and not self._buffer:
+                        return
+                    timeout = None
+                    if self._buffer:
+                        timeout = max(
+                            0.0,
+                            self._buffer[0][2]
+                            + self.linger_ms / 1000
+                            - time.monotonic(),
+                        )
+                    self._cond.wait(timeout=timeout)
+                batch = self._take_batch()
+            self._publish(batch)
+            with self._cond:
+                self._in_flight = 0
+                self._done += len(batch)
+                self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Publish every message added before this call and wait until they are
+        done (their futures are resolved).
+
+        :param timeout: maximum seconds to wait, ``None`` waits until done
+        :returns: False if the timeout expired before all messages were done
+        """
+        with self._cond:
+            target = self._added
+            self._flush_target = max(self._flush_target, target)
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._done >= target, timeout=timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop accepting messages, publish the buffered ones and stop the
+        background thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
+
+    def __enter__(self) -> "BufferedProducer":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
     def __repr__(self) -> str:
         return (
             f"{self.__class__.__name__}("
             f"redis_conn={self.redis_conn},"
             f"stream={self.stream},"
-            f"maxlen={self.maxlen})"
+            f"maxlen={self.maxlen},"
+            f"batch_size={self.batch_size},"
+            f"linger_ms={self.linger_ms},"
+            f"buffer_size={self.buffer_size},"
+            f"backpressure={self.backpressure.value})"
         )
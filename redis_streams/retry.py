@@ -0,0 +1,275 @@
+"""
+Delayed retry of failed messages with exponential backoff.
+
+A message which is not acknowledged is returned again by the next get_items
+call right away, so a failing handler retries it in a hot loop. Instead, a
+:class:`RetryScheduler` moves the failed message to a sorted set scored by the
+time it is due and acknowledges it in the same transaction. The pump, called
+periodically or run in a background thread, adds the due messages to the stream
+again as new entries in batches. The number of the attempt and the id of the
+original message are kept in the ``_retry_attempt`` and ``_retry_of`` fields.
+
+The new entries are delivered to every consumer group of the stream, so the
+scheduler can only be used with a stream read by a single group: scheduling and
+pumping raise ValueError if the stream has other groups, the failed messages
+stay pending and the scheduled ones stay in the sorted set then.
+"""
+
+import base64
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+from redis_streams.claim_check import REFERENCE_FIELD
+from redis_streams.codecs import PAYLOAD_FIELD
+from redis_streams.common import BaseRedisClass
+
+RETRY_ATTEMPT_FIELD = "_retry_attempt"
+RETRY_ORIGIN_FIELD = "_retry_of"
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        base_delay_ms: int = 1000,
+        max_delay_ms: int = 300000,
+        multiplier: float = 2.0,
+        jitter: float = 0.2,
+        max_retries: Optional[int] = 10,
+    ):
+        """
+        :param base_delay_ms: delay of the first retry
+        :param max_delay_ms: upper limit of the delay
+        :param multiplier: each retry waits this many times longer than the previous
+        :param jitter: the delay is reduced randomly by up to this fraction, so the
+                    messages failed together are not retried together
+        :param max_retries: the messages failing more are not scheduled, they stay
+                    pending, e.g. for the dead-letter policy of the consumer.
+                    None means no limit
+        """
+        if base_delay_ms < 0 or max_delay_ms < base_delay_ms:
+            raise ValueError("0 <= base_delay_ms <= max_delay_ms is expected")
+        if multiplier < 1:
+            raise ValueError("multiplier must be at least 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+        self.base_delay_ms = base_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_retries = max_retries
+
+    def delay_ms(self, attempt: int) -> int:
+        """
+        :param attempt: number of the retry, starting from 1
+        """
+        delay = min(
+            self.max_delay_ms, self.base_delay_ms * self.multiplier ** (attempt - 1)
+        )
+        return int(delay * (1 - self.jitter * random.random()))  # nosec B311
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"base_delay_ms={self.base_delay_ms},"
+            f"max_delay_ms={self.max_delay_ms},"
+            f"multiplier={self.multiplier},"
+            f"jitter={self.jitter},"
+            f"max_retries={self.max_retries})"
+        )
+
+
+def _dump(fields: Dict[str, Any]) -> str:
+    """
+    Sorted set member of the fields, binary values are base64 encoded
+    """
+    binary = sorted(key for key, value in fields.items() if isinstance(value, bytes))
+    return json.dumps(
+        {
+            "fields": {
+                key: base64.b64encode(value).decode() if key in binary else value
+                for key, value in fields.items()
+            },
+            "binary": binary,
+        },
+        sort_keys=True,
+    )
+
+
+def _load(member: Any) -> Dict[str, Any]:
+    data = json.loads(member)
+    fields = data["fields"]
+    for key in data["binary"]:
+        fields[key] = base64.b64decode(fields[key])
+    return fields
+
+
+class RetryScheduler(BaseRedisClass):
+    def __init__(
+        self,
+        redis_conn: Redis,
+        stream: str,
+        consumer_group: str,
+        policy: Optional[RetryPolicy] = None,
+        key: Optional[str] = None,
+        pump_batch_size: int = 100,
+        pump_interval_ms: int = 1000,
+        encoding: str = "utf-8",
+    ):
+        """
+        The stream must not be read by other consumer groups, they would receive
+        the retried messages too
+        :param policy: backoff of the retries, see RetryPolicy
+        :param key: the sorted set of the scheduled messages, defaults to
+                    <stream>:retry
+        :param pump_batch_size: maximum number of messages added to the stream by
+                    one pump transaction
+        :param pump_interval_ms: sleep of the background pump if there were no more
+                    due messages, see start
+        :param encoding: of the field names read by a connection without
+                    decode_responses
+        """
+        super().__init__(
+            redis_conn=redis_conn, stream=stream, consumer_group=consumer_group
+        )
+        self.policy = policy or RetryPolicy()
+        self.key = key or f"{stream}:retry"
+        self.pump_batch_size = pump_batch_size
+        self.pump_interval_ms = pump_interval_ms
+        self.encoding = encoding
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _check_single_group(self, redis_conn) -> None:
+        groups = redis_conn.xinfo_groups(name=self.stream)
+        if len(groups) > 1:
+            raise ValueError(
+                f"{self.stream} is read by {len(groups)} consumer groups, the retried "
+                "messages would be delivered to each of them"
+            )
+
+    def schedule(self, item_id: str, fields: Mapping[Any, Any]) -> Optional[int]:
+        """
+        Schedule the retry of a failed message and acknowledge it, in a single
+        transaction
+        :param item_id: id of the message
+        :param fields: fields of the message, str or bytes names
+        :return: the delay in milliseconds, None if the message ran out of retries
+                 and it was left pending
+        :raises ValueError: the stream is read by other consumer groups too, the
+                 message is left pending
+        """
+        fields = {
+            key.decode(self.encoding) if isinstance(key, bytes) else key: value
+            for key, value in fields.items()
+        }
+        if REFERENCE_FIELD in fields:
+            # resolved by the consumer, the blob store still has it
+            fields.pop(PAYLOAD_FIELD, None)
+        attempt = int(fields.get(RETRY_ATTEMPT_FIELD, 0)) + 1
+        if self.policy.max_retries is not None and attempt > self.policy.max_retries:
+            self.logger.warning(f"{item_id} failed {attempt} times, not retried")
+            return None
+        fields[RETRY_ATTEMPT_FIELD] = attempt
+        fields.setdefault(RETRY_ORIGIN_FIELD, item_id)
+        self._check_single_group(self.redis_conn)
+        delay_ms = self.policy.delay_ms(attempt)
+        pipe = self.redis_conn.pipeline(transaction=True)
+        pipe.zadd(self.key, {_dump(fields): int(time.time() * 1000) + delay_ms})
+        pipe.xack(self.stream, self.consumer_group, item_id)
+        pipe.execute()
+        self.logger.debug(f"Retry {attempt} of {item_id} in {delay_ms} ms")
+        return delay_ms
+
+    def _pump(self, pipe) -> List[Any]:
+        due = pipe.zrangebyscore(
+            self.key,
+            "-inf",
+            int(time.time() * 1000),
+            start=0,
+            num=self.pump_batch_size,
+        )
+        if due:
+            self._check_single_group(pipe)
+            pipe.multi()
+            pipe.zrem(self.key, *due)
+            for member in due:
+                pipe.xadd(name=self.stream, fields=_load(member))
+        return due
+
+    def pump(self) -> int:
+        """
+        Add up to pump_batch_size due messages to the stream again. The sorted set
+        is watched, the messages are removed from it and added to the stream in a
+        single transaction, so pumps of several processes don't add a message
+        twice.
+        :return: number of the re-injected messages
+        :raises ValueError: the stream is read by other consumer groups too, the
+                 messages are left in the sorted set
+        """
+        due = self.redis_conn.transaction(
+            self._pump, self.key, value_from_callable=True  # type: ignore[arg-type]
+        )
+        if due:
+            self.logger.debug(f"Added {len(due)} messages to {self.stream} again")
+        return len(due)  # type: ignore[arg-type]
+
+    def scheduled(self) -> int:
+        """
+        Number of the messages waiting for retry
+        """
+        return self.redis_conn.zcard(self.key)  # type: ignore[return-value]
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.pump() == self.pump_batch_size:
+                    # there can be more due messages
+                    continue
+            except RedisError:
+                self.logger.warning("Failed to pump retries", exc_info=True)
+            except ValueError as exc:
+                self.logger.error(f"Not pumping retries: {exc}")
+            self._stop.wait(self.pump_interval_ms / 1000)
+
+    def start(self) -> "RetryScheduler":
+        """
+        Pump in a background thread until close()
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=self.__class__.__name__, daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def close(self) -> None:
+        """
+        Stop the background pump
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"redis_conn={self.redis_conn},"
+            f"stream={self.stream},"
+            f"consumer_group={self.consumer_group},"
+            f"key={self.key},"
+            f"policy={self.policy})"
+        )
@@ -0,0 +1,219 @@
+"""
+Runs a handler function over the batches of a consumer on a thread or process
+pool and acknowledges each message once its handler succeeded.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from redis_streams import PACKAGE
+from redis_streams.consumer import Consumer, RedisMsg
+
+
+def _timed_call(
+    handler: Callable[[RedisMsg], Any], message: RedisMsg, starts: Any, task_no: int
+) -> Any:
+    """
+    Run the handler in the worker and record when it started, the wall clock is
+    used as it is shared by the processes
+    """
+    starts[task_no] = time.time()
+    return handler(message)
+
+
+class BatchRunner:
+    """
+    Processes each batch returned by ``consumer.get_items`` concurrently.
+    Messages are acknowledged one by one as their handler returns, failed or
+    timed out messages stay in the pending entries list and are returned again
+    by the next batch.
+
+    :param consumer: Consumer providing the batches.
+    :param handler: Called with each ``RedisMsg``, an exception means failure.
+        Has to be picklable when ``use_processes`` is set.
+    :param concurrency: Number of workers of the pool.
+    :param use_processes: Use a ``ProcessPoolExecutor`` for CPU-bound handlers
+        instead of a ``ThreadPoolExecutor``.
+    :param handler_timeout_s: A handler running longer than this is considered
+        failed, the time spent in the queue of the pool doesn't count. It can't
+        be interrupted, it keeps its worker and counts toward ``max_in_flight``
+        until it returns, also during the next batches.
+    :param max_in_flight: Maximum number of messages submitted to the pool at
+        once, defaults to ``concurrency``.
+    :param executor: Use this executor instead of creating one, it is not shut
+        down by :meth:`close`.
+    """
+
+    def __init__(
+        self,
+        consumer: Consumer,
+        handler: Callable[[RedisMsg], Any],
+        concurrency: int = 4,
+        use_processes: bool = False,
+        handler_timeout_s: Optional[float] = None,
+        max_in_flight: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ):
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1")
+        self.consumer = consumer
+        self.handler = handler
+        self.concurrency = concurrency
+        self.handler_timeout_s = handler_timeout_s
+        self.max_in_flight = max_in_flight or concurrency
+        self.logger = logging.getLogger(f"{PACKAGE}_{self.__class__.__name__}")
+        self._own_executor = executor is None
+        if executor is None:
+            if use_processes:
+                executor = ProcessPoolExecutor(max_workers=concurrency)
+            else:
+                executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.executor = executor
+        self._manager = None
+        # task number -> start time of the handlers, written by the workers
+        self._starts: Any = {}
+        if handler_timeout_s is not None and isinstance(executor, ProcessPoolExecutor):
+            self._manager = multiprocessing.Manager()
+            self._starts = self._manager.dict()
+        self._task_no = 0
+        # timed out handlers which are still running
+        self._timed_out: Set[Future] = set()
+
+    def _submit(self, message: RedisMsg) -> Tuple[Future, int]:
+        self._task_no += 1
+        if self.handler_timeout_s is None:
+            return self.executor.submit(self.handler, message), self._task_no
+        future = self.executor.submit(
+            _timed_call, self.handler, message, self._starts, self._task_no
+        )
+        return future, self._task_no
+
+    def _expired(self, started: Dict[Future, Tuple[RedisMsg, int]]) -> list:
+        if self.handler_timeout_s is None:
+            return []
+        starts = self._starts.copy()
+        now = time.time()
+        return [
+            future
+            for future, (_, task_no) in started.items()
+            if task_no in starts and now - starts[task_no] >= self.handler_timeout_s
+        ]
+
+    def _next_timeout(self, started: Dict[Future, Tuple[RedisMsg, int]]):
+        if self.handler_timeout_s is None or not started:
+            return None
+        starts = self._starts.copy()
+        now = time.time()
+        # the handlers still queued are checked regularly to notice their start
+        return max(
+            0.0,
+            min(
+                (
+                    starts[task_no] + self.handler_timeout_s - now
+                    if task_no in starts
+                    else self.handler_timeout_s / 10
+                )
+                for _, task_no in started.values()
+            ),
+        )
+
+    def run_once(self) -> Tuple[int, int]:
+        """
+        Fetch one batch and process it.
+
+        :returns: number of succeeded and failed messages
+        """
+        messages = list(self.consumer.get_items())
+        succeeded = failed = 0
+        started: Dict[Future, Tuple[RedisMsg, int]] = {}
+        while messages or started:
+            self._timed_out = {
+                future for future in self._timed_out if not future.done()
+            }
+            while messages and len(started) + len(self._timed_out) < self.max_in_flight:
+                message = messages.pop(0)
+                future, task_no = self._submit(message)
+                started[future] = (message, task_no)
+            done, _ = wait(
+                set(started) | self._timed_out,
+                timeout=self._next_timeout(started),
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future not in started:
+                    # a timed out handler returned
+                    continue
+                message, task_no = started.pop(future)
+                self._starts.pop(task_no, None)
+                exc = future.exception()
+                if exc is None:
+                    self.consumer.remove_item_from_consumer_group(item_id=message.msgid)
+                    succeeded += 1
+                else:
+                    self.logger.warning(
+                        f"Failed to process {message.msgid}", exc_info=exc
+                    )
+                    failed += 1
+            for future in self._expired(started):
+                message, task_no = started.pop(future)
+                self._starts.pop(task_no, None)
+                self._timed_out.add(future)
+                self.logger.warning(
+                    f"Processing of {message.msgid} timed out after "
+                    f"{self.handler_timeout_s}s"
+                )
+                failed += 1
+        self.logger.debug(f"Batch done, succeeded: {succeeded}, failed: {failed}")
+        return succeeded, failed
+
+    def run(
+        self,
+        stop_event: Optional[threading.Event] = None,
+        max_batches: Optional[int] = None,
+    ) -> None:
+        """
+        Process batches until ``stop_event`` is set or ``max_batches`` batches are
+        processed, forever if neither is given.
+        """
+        batches = 0
+        while not (stop_event and stop_event.is_set()):
+            if max_batches is not None and batches >= max_batches:
+                break
+            self.run_once()
+            batches += 1
+
+    def close(self) -> None:
+        """
+        Shut down the pool (unless it was given) and close the consumer
+        """
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+        self.consumer.close()
+
+    def __enter__(self) -> "BatchRunner":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"consumer={self.consumer},"
+            f"concurrency={self.concurrency},"
+            f"handler_timeout_s={self.handler_timeout_s},"
+            f"max_in_flight={self.max_in_flight})"
+        )
@@ -1,9 +1,18 @@
+import math
+import time
 from enum import Enum
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
 from redis import Redis
 
 from redis_streams.common import BaseRedisClass
+from redis_streams.snapshot import (
+    StreamSnapshot,
+    collect_snapshots,
+    count_entries,
+    group_lag,
+    group_lags,
+)
 
 
 class Scale(Enum):
@@ -18,12 +27,16 @@ class Scaler(BaseRedisClass):
         redis_conn: Redis,
         stream: str,
         consumer_group: str,
+        max_lag_scan: int = 1000,
     ):
         """
         By checking the number of messages waiting to be assigned and the number of
         pending items, utilization ratio can be calculated. Once this rate crosses a
         lower (scale in) or higher (scale out) the code will give a suggestion of
         scale in / out.
+        :param max_lag_scan: maximum number of entries read to count the messages
+                    waiting to be assigned if Redis doesn't provide it (before 7.0),
+                    above it the number is estimated, see snapshot.group_lag
         """
         super().__init__(
             redis_conn=redis_conn, stream=stream, consumer_group=consumer_group
@@ -32,34 +45,30 @@ class Scaler(BaseRedisClass):
         self.stream_pending = 0
         self.lenght_pending_rate = 0
         self.consumers_of_group = 0
+        self.max_lag_scan = max_lag_scan
 
-    def collect_metrics(self) -> Tuple[int, int]:
-        last_delivered = None
-        group_info = self.redis_conn.xinfo_groups(name=self.stream)
-        for group in group_info:
-            if group.get("name") == self.consumer_group:
-                self.stream_pending = group.get("pending", 0)
-                self.consumers_of_group = group.get("consumers", 0)
-                last_delivered = group.get("last-delivered-id")
-                break
+    def collect_metrics(
+        self, snapshot: Optional[StreamSnapshot] = None
+    ) -> Tuple[int, int]:
+        """
+        :param snapshot: use this instead of querying the stream and group info,
+                         e.g. collected for many streams at once by
+                         redis_streams.snapshot.collect_snapshots
+        :return: stream length, pending items
+        """
+        if snapshot is None:
+            snapshot = collect_snapshots(
+                self.redis_conn, [self.stream], consumers=False
+            )[self.stream]
+        group = snapshot.groups.get(self.consumer_group)
+        if group:
+            self.stream_pending = group.get("pending", 0)
+            self.consumers_of_group = group.get("consumers", 0)
         # XLEN provides the size of the stream, but doesn't consider messages processed
         # by our consumer group
-        stream_info = self.redis_conn.xinfo_stream(name=self.stream)
-        last_generated = stream_info.get("last-generated-id")
-        if not last_delivered:
-            self.stream_lenght = self.redis_conn.xlen(name=self.stream)
-        elif last_generated == last_delivered:
-            self.stream_lenght = 0
-        else:
-            # xrange output, the len of the messages should be decreased by one as it
-            # includes the last delivered
-            _messages = self.redis_conn.xrange(
-                name=self.stream, min=last_delivered, max=last_generated
-            )
-            self.stream_lenght = max(
-                0,
-                len(_messages) - 1,  # type: ignore[arg-type]
-            )
+        self.stream_lenght = group_lag(
+            self.redis_conn, snapshot, self.consumer_group, max_scan=self.max_lag_scan
+        )
         return self.stream_lenght, self.stream_pending
 
     @staticmethod
@@ -71,31 +80,47 @@ class Scaler(BaseRedisClass):
         if scale_out_rate < 0 or scale_out_rate > 100:
             raise ValueError("Scale in rate must be within 0 and 100")
 
-    def _calculate_rate(self):
-        if not all([self.stream_pending, self.stream_lenght]):
-            self.collect_metrics()
-        if self.stream_pending:
-            self.lenght_pending_rate = round(
-                max(min(self.stream_lenght / self.stream_pending * 100, 100), 1), 4
-            )
-        else:
-            # if no pending item, no scale
-            self.lenght_pending_rate = 0
-
-    def _calculate_scale(self, scale_in_rate: int, scale_out_rate: int) -> str:
+    @staticmethod
+    def _rate(stream_lenght: int, stream_pending: int):
+        if stream_pending:
+            return round(max(min(stream_lenght / stream_pending * 100, 100), 1), 4)
+        # if no pending item, no scale
+        return 0
 
-        if self.lenght_pending_rate == 0 and self.stream_lenght == 0:
+    @staticmethod
+    def _scale(
+        rate,
+        stream_lenght: int,
+        consumers: int,
+        scale_in_rate: int,
+        scale_out_rate: int,
+    ) -> str:
+        if rate == 0 and stream_lenght == 0:
             scale = Scale.NOSCALE.value
-        elif self.lenght_pending_rate == 0 and self.stream_lenght >= 1:
+        elif rate == 0 and stream_lenght >= 1:
             scale = Scale.OUT.value
-        elif self.lenght_pending_rate < scale_in_rate and self.consumers_of_group > 1:
+        elif rate < scale_in_rate and consumers > 1:
             scale = Scale.IN.value
-        elif self.lenght_pending_rate >= scale_out_rate:
+        elif rate >= scale_out_rate:
             scale = Scale.OUT.value
         else:
             scale = Scale.NOSCALE.value
         return scale
 
+    def _calculate_rate(self):
+        if not all([self.stream_pending, self.stream_lenght]):
+            self.collect_metrics()
+        self.lenght_pending_rate = self._rate(self.stream_lenght, self.stream_pending)
+
+    def _calculate_scale(self, scale_in_rate: int, scale_out_rate: int) -> str:
+        return self._scale(
+            self.lenght_pending_rate,
+            self.stream_lenght,
+            self.consumers_of_group,
+            scale_in_rate=scale_in_rate,
+            scale_out_rate=scale_out_rate,
+        )
+
     def get_scale_decision(
         self,
         scale_out_rate: int = 50,
@@ -115,3 +140,292 @@ class Scaler(BaseRedisClass):
         return self.lenght_pending_rate, self._calculate_scale(
             scale_in_rate=scale_in_rate, scale_out_rate=scale_out_rate
         )
+
+
+class PredictiveScaler(Scaler):
+    def __init__(
+        self,
+        redis_conn: Redis,
+        stream: str,
+        consumer_group: str,
+        target_latency_s: float = 10.0,
+        target_utilization: float = 0.8,
+        min_consumers: int = 1,
+        max_consumers: int = 100,
+        smoothing: float = 0.3,
+        scale_in_margin: float = 0.2,
+        scale_out_cooldown_s: float = 30,
+        scale_in_cooldown_s: float = 300,
+        max_lag_scan: int = 1000,
+    ):
+        """
+        Recommends a number of consumers instead of a direction. Each
+        get_target_consumers call samples the stream, the arrival rate (new
+        entries / second) and the completion rate (acknowledged messages / second)
+        are measured between the samples and smoothed by exponentially weighted
+        moving average. The throughput of a consumer is the completion rate / number
+        of consumers, measured only while the consumers had messages waiting, as
+        idle consumers would underestimate it.
+        The backlog (waiting + pending messages) should be processed within
+        target_latency_s while keeping up with the arrivals (Little's law), so the
+        needed throughput is arrival rate + backlog / target_latency_s, the number
+        of consumers is that / (throughput of a consumer * target_utilization).
+        Call it periodically, e.g. every few seconds, the first call only takes the
+        first sample.
+        :param target_latency_s: time within the backlog should be processed
+        :param target_utilization: planned utilization of the consumers, keeps
+                    headroom for bursts
+        :param min_consumers: lower bound of the recommendation
+        :param max_consumers: upper bound of the recommendation
+        :param smoothing: weight of the latest observation, within 0 and 1
+        :param scale_in_margin: hysteresis, scale in only if the recommendation is
+                    lower by at least this fraction of the current consumers
+        :param scale_out_cooldown_s: minimum time between a scaling and a scale out
+        :param scale_in_cooldown_s: minimum time between a scaling and a scale in
+        :param max_lag_scan: see Scaler, also used to count the arrivals if Redis
+                    doesn't provide the number of added entries (before 7.0)
+        """
+        super().__init__(
+            redis_conn=redis_conn,
+            stream=stream,
+            consumer_group=consumer_group,
+            max_lag_scan=max_lag_scan,
+        )
+        if not 0 <= min_consumers <= max_consumers:
+            raise ValueError("Consumer bounds must be 0 <= min <= max")
+        if not 0 < smoothing <= 1:
+            raise ValueError("Smoothing must be within 0 and 1")
+        if not 0 < target_utilization <= 1:
+            raise ValueError("Target utilization must be within 0 and 1")
+        self.target_latency_s = target_latency_s
+        self.target_utilization = target_utilization
+        self.min_consumers = min_consumers
+        self.max_consumers = max_consumers
+        self.smoothing = smoothing
+        self.scale_in_margin = scale_in_margin
+        self.scale_out_cooldown_s = scale_out_cooldown_s
+        self.scale_in_cooldown_s = scale_in_cooldown_s
+        # messages / second
+        self.arrival_rate: Optional[float] = None
+        self.completion_rate: Optional[float] = None
+        self.consumer_throughput: Optional[float] = None
+        self.backlog = 0
+        self.target_consumers = 0
+        self._last_sample: Optional[StreamSnapshot] = None
+        self._last_backlog = 0
+        self._last_scaled_at: Optional[float] = None
+
+    def _smooth(self, current: Optional[float], observed: float) -> float:
+        if current is None:
+            return observed
+        return self.smoothing * observed + (1 - self.smoothing) * current
+
+    def _arrivals(self, previous: StreamSnapshot, snapshot: StreamSnapshot) -> int:
+        added = snapshot.info.get("entries-added") if snapshot.info else None
+        added_before = previous.info.get("entries-added") if previous.info else None
+        if added is not None and added_before is not None:
+            return added - added_before
+        if not previous.last_generated_id or not snapshot.last_generated_id:
+            return snapshot.length
+        if previous.last_generated_id == snapshot.last_generated_id:
+            return 0
+        return count_entries(
+            self.redis_conn,
+            self.stream,
+            previous.last_generated_id,
+            snapshot.last_generated_id,
+            self.max_lag_scan,
+        )
+
+    def collect_metrics(
+        self, snapshot: Optional[StreamSnapshot] = None
+    ) -> Tuple[int, int]:
+        """
+        Sample the stream and update the rates, see Scaler.collect_metrics
+        """
+        if snapshot is None:
+            snapshot = collect_snapshots(
+                self.redis_conn, [self.stream], consumers=False
+            )[self.stream]
+        super().collect_metrics(snapshot=snapshot)
+        self.backlog = self.stream_lenght + self.stream_pending
+        previous = self._last_sample
+        if previous is not None and snapshot.collected_at > previous.collected_at:
+            elapsed = snapshot.collected_at - previous.collected_at
+            arrivals = self._arrivals(previous, snapshot)
+            completions = max(0, arrivals - (self.backlog - self._last_backlog))
+            self.arrival_rate = self._smooth(self.arrival_rate, arrivals / elapsed)
+            self.completion_rate = self._smooth(
+                self.completion_rate, completions / elapsed
+            )
+            if self._last_backlog and self.backlog and self.consumers_of_group:
+                # the consumers had work during the whole interval
+                self.consumer_throughput = self._smooth(
+                    self.consumer_throughput,
+                    completions / elapsed / self.consumers_of_group,
+                )
+        self._last_sample = snapshot
+        self._last_backlog = self.backlog
+        return self.stream_lenght, self.stream_pending
+
+    def _needed_consumers(self) -> int:
+        if not self.consumer_throughput:
+            # not measured yet, start one if there is anything to do
+            if not self.consumers_of_group and (self.backlog or self.arrival_rate):
+                return 1
+            return self.consumers_of_group
+        needed_throughput = (self.arrival_rate or 0) + (
+            self.backlog / self.target_latency_s
+        )
+        return math.ceil(
+            needed_throughput / (self.consumer_throughput * self.target_utilization)
+        )
+
+    def get_target_consumers(
+        self, snapshot: Optional[StreamSnapshot] = None
+    ) -> Tuple[int, str]:
+        """
+        Sample the stream and recommend the number of consumers
+        :param snapshot: see Scaler.collect_metrics
+        :return: number of consumers, suggestion compared to the current number
+        """
+        self.collect_metrics(snapshot=snapshot)
+        current = self.consumers_of_group
+        target = min(
+            max(self._needed_consumers(), self.min_consumers), self.max_consumers
+        )
+        now = time.monotonic()
+        since_scaled = (
+            math.inf if self._last_scaled_at is None else now - self._last_scaled_at
+        )
+        if target > current and since_scaled < self.scale_out_cooldown_s:
+            target = current
+        elif target < current and (
+            since_scaled < self.scale_in_cooldown_s
+            or current - target < max(1.0, current * self.scale_in_margin)
+        ):
+            target = current
+        if target > current:
+            scale = Scale.OUT.value
+        elif target < current:
+            scale = Scale.IN.value
+        else:
+            scale = Scale.NOSCALE.value
+        if target != current:
+            self._last_scaled_at = now
+        self.target_consumers = target
+        self.logger.debug(
+            f"Arrival rate: {self.arrival_rate}/s, completion rate: "
+            f"{self.completion_rate}/s, consumer throughput: "
+            f"{self.consumer_throughput}/s, backlog: {self.backlog}, "
+            f"consumers: {current} -> {target}"
+        )
+        return target, scale
+
+
+class MultiScaler:
+    def __init__(
+        self,
+        redis_conn: Redis,
+        streams: Union[List[Tuple[str, str]], Dict[str, Union[str, List[str]]]],
+        max_lag_scan: int = 1000,
+    ):
+        """
+        Scale decisions of many (stream, consumer group) pairs in one pass. The
+        stream and group info of all the streams is read by a single pipeline, the
+        lags Redis doesn't provide (before 7.0) are counted by a second one, see
+        snapshot.group_lags. Besides the decision of each pair, an aggregate
+        decision is made from the summed waiting and pending messages for a pool
+        of consumers serving all the streams, its size is the most consumers of a
+        group.
+        :param streams: (stream, consumer group) pairs, or a stream name ->
+                    consumer group(s) mapping
+        :param max_lag_scan: see Scaler
+        """
+        if isinstance(streams, dict):
+            pairs = []
+            for stream, groups in streams.items():
+                for group in [groups] if isinstance(groups, str) else groups:
+                    pairs.append((stream, group))
+        else:
+            pairs = list(streams)
+        if not pairs:
+            raise ValueError("At least one stream is needed")
+        self.redis_conn = redis_conn
+        self.pairs = pairs
+        self.max_lag_scan = max_lag_scan
+        # (stream, group) -> stream length, pending items, consumers
+        self.metrics: Dict[Tuple[str, str], Tuple[int, int, int]] = {}
+        self.prepare_redis()
+
+    def prepare_redis(self) -> None:
+        for stream, group in self.pairs:
+            BaseRedisClass(
+                redis_conn=self.redis_conn, stream=stream, consumer_group=group
+            )
+
+    def collect_metrics(
+        self, snapshots: Optional[Dict[str, StreamSnapshot]] = None
+    ) -> Dict[Tuple[str, str], Tuple[int, int, int]]:
+        """
+        :param snapshots: stream name -> snapshot, collected if not given
+        :return: (stream, group) -> stream length, pending items, consumers
+        """
+        if snapshots is None:
+            snapshots = collect_snapshots(
+                self.redis_conn,
+                dict.fromkeys(stream for stream, _ in self.pairs),
+                consumers=False,
+            )
+        lags = group_lags(
+            self.redis_conn,
+            [(snapshots[stream], group) for stream, group in self.pairs],
+            max_scan=self.max_lag_scan,
+        )
+        self.metrics = {}
+        for (stream, group), lag in zip(self.pairs, lags):
+            info = snapshots[stream].groups.get(group) or {}
+            self.metrics[(stream, group)] = (
+                lag,
+                info.get("pending", 0),
+                info.get("consumers", 0),
+            )
+        return self.metrics
+
+    def get_scale_decisions(
+        self,
+        scale_out_rate: int = 50,
+        scale_in_rate: int = 10,
+        snapshots: Optional[Dict[str, StreamSnapshot]] = None,
+    ) -> Tuple[Dict[Tuple[str, str], Tuple[int, str]], Tuple[int, str]]:
+        """
+        Collect the metrics and decide, see Scaler.get_scale_decision
+        :return: (stream, group) -> rate, suggestion and the aggregate rate,
+                 suggestion
+        """
+        Scaler._validate_scaling_params(
+            scale_in_rate=scale_in_rate, scale_out_rate=scale_out_rate
+        )
+        self.collect_metrics(snapshots=snapshots)
+        decisions = {}
+        for pair, (lenght, pending, consumers) in self.metrics.items():
+            rate = Scaler._rate(lenght, pending)
+            decisions[pair] = rate, Scaler._scale(
+                rate, lenght, consumers, scale_in_rate, scale_out_rate
+            )
+        total_lenght = sum(lenght for lenght, _, _ in self.metrics.values())
+        total_pending = sum(pending for _, pending, _ in self.metrics.values())
+        pool_size = max(consumers for _, _, consumers in self.metrics.values())
+        rate = Scaler._rate(total_lenght, total_pending)
+        aggregate = rate, Scaler._scale(
+            rate, total_lenght, pool_size, scale_in_rate, scale_out_rate
+        )
+        return decisions, aggregate
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"redis_conn={self.redis_conn},"
+            f"pairs={self.pairs},"
+            f"max_lag_scan={self.max_lag_scan})"
+        )
@@ -0,0 +1,268 @@
+"""
+Point-in-time view of streams for monitoring and scaling.
+
+:func:`collect_snapshots` reads the stream and consumer group info of any number
+of streams in two pipelined round trips: XINFO STREAM and XINFO GROUPS of every
+stream first, then XINFO CONSUMERS of every group having consumers. Monitor and
+Scaler accept a snapshot instead of querying Redis themselves, so a process
+watching many streams collects them once per cycle.
+
+:func:`snapshot_from_info`, :func:`lag_from_info`, :func:`lag_scan_args` and
+:func:`lag_from_scan` don't talk to Redis, they build the snapshot and count the
+lag from responses read by the caller, e.g. by an asyncio connection.
+"""
+
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from redis import Redis
+from redis.exceptions import ResponseError
+
+
+class StreamSnapshot:
+    """
+    :param stream: name of the stream
+    :param info: XINFO STREAM response, None if the stream doesn't exist
+    :param groups: group name -> XINFO GROUPS entry of the group
+    :param consumers: group name -> XINFO CONSUMERS response of the group, only
+                      for the groups having consumers
+    :param collected_at: time.time() of the collection
+    """
+
+    def __init__(
+        self,
+        stream: str,
+        info: Optional[Dict[str, Any]],
+        groups: Dict[str, Dict[str, Any]],
+        consumers: Dict[str, List[Dict[str, Any]]],
+        collected_at: float,
+    ):
+        self.stream = stream
+        self.info = info
+        self.groups = groups
+        self.consumers = consumers
+        self.collected_at = collected_at
+
+    @property
+    def exists(self) -> bool:
+        return self.info is not None
+
+    @property
+    def length(self) -> int:
+        return self.info.get("length", 0) if self.info else 0
+
+    @property
+    def last_generated_id(self) -> Any:
+        return self.info.get("last-generated-id") if self.info else None
+
+    @property
+    def first_entry_id(self) -> Any:
+        first_entry = self.info.get("first-entry") if self.info else None
+        return first_entry[0] if first_entry else None
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"stream={self.stream},"
+            f"length={self.length},"
+            f"groups={list(self.groups)})"
+        )
+
+
+def _name(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _parse_id(msg_id: Any) -> Tuple[int, int]:
+    timestamp, sequence = _name(msg_id).split("-")
+    return int(timestamp), int(sequence)
+
+
+def _after(msg_id: Any) -> str:
+    """
+    The smallest stream ID after msg_id, XRANGE with "(" needs Redis 6.2
+    """
+    timestamp, sequence = _parse_id(msg_id)
+    return f"{timestamp}-{sequence + 1}"
+
+
+def _extrapolate(entries: Any, after_id: Any, until_id: Any, max_scan: int) -> int:
+    scanned = len(entries)
+    if scanned <= max_scan:
+        return scanned
+    timestamp = _parse_id(after_id)[0]
+    scanned_ms = max(1, _parse_id(entries[-1][0])[0] - timestamp)
+    total_ms = _parse_id(until_id)[0] - timestamp
+    return max(scanned, round(scanned * total_ms / scanned_ms))
+
+
+def count_entries(
+    redis_conn: Redis, stream: str, after_id: Any, until_id: Any, max_scan: int = 1000
+) -> int:
+    """
+    Number of entries after after_id up to and including until_id. At most
+    max_scan + 1 entries are read by XRANGE, if there are more, the number is
+    extrapolated from the timestamps of the IDs: the rest of the range is assumed
+    to have the same rate of entries as the scanned part, so the cost doesn't
+    depend on the size of the range.
+    """
+    entries = redis_conn.xrange(
+        name=stream, min=_after(after_id), max=until_id, count=max_scan + 1
+    )
+    return _extrapolate(entries, after_id, until_id, max_scan)
+
+
+def lag_from_info(snapshot: StreamSnapshot, group: str) -> Optional[int]:
+    """
+    The lag of the group if it can be told without reading the stream, otherwise
+    None and the entries have to be counted, see lag_scan_args
+    """
+    info = snapshot.groups.get(group)
+    if info is None:
+        return snapshot.length
+    if not snapshot.length:
+        return 0
+    if info.get("lag") is not None:
+        return info["lag"]
+    last_delivered = _parse_id(info.get("last-delivered-id"))
+    if last_delivered >= _parse_id(snapshot.last_generated_id):
+        return 0
+    if last_delivered < _parse_id(snapshot.first_entry_id):
+        # nothing of the current entries was delivered
+        return snapshot.length
+    return None
+
+
+def lag_scan_args(
+    snapshot: StreamSnapshot, group: str, max_scan: int = 1000
+) -> Dict[str, Any]:
+    """
+    Keyword arguments of the XRANGE counting the lag of the group, its response
+    is passed to lag_from_scan
+    """
+    return {
+        "name": snapshot.stream,
+        "min": _after(snapshot.groups[group].get("last-delivered-id")),
+        "max": snapshot.last_generated_id,
+        "count": max_scan + 1,
+    }
+
+
+def lag_from_scan(
+    snapshot: StreamSnapshot, group: str, entries: Any, max_scan: int = 1000
+) -> int:
+    """
+    The lag of the group from the response of the XRANGE of lag_scan_args, see
+    count_entries
+    :param max_scan: the same as for lag_scan_args
+    """
+    lag = _extrapolate(
+        entries,
+        snapshot.groups[group].get("last-delivered-id"),
+        snapshot.last_generated_id,
+        max_scan,
+    )
+    return min(lag, snapshot.length)
+
+
+def group_lags(
+    redis_conn: Redis,
+    pairs: Iterable[Tuple[StreamSnapshot, str]],
+    max_scan: int = 1000,
+) -> List[int]:
+    """
+    Number of entries not yet delivered to each (stream snapshot, group) pair,
+    all of them if the group doesn't exist.
+    Redis 7 provides it as the lag field of XINFO GROUPS. Otherwise, or if Redis
+    can't tell it (e.g. after deletions in the middle of the stream), the entries
+    after the last delivered one are counted, see count_entries. The XRANGE
+    commands of all the pairs are sent in a single pipeline.
+    :param max_scan: maximum number of entries read to count a lag
+    """
+    pairs = list(pairs)
+    lags = [lag_from_info(snapshot, group) for snapshot, group in pairs]
+    to_scan = [index for index, lag in enumerate(lags) if lag is None]
+    if to_scan:
+        pipe = redis_conn.pipeline(transaction=False)
+        for index in to_scan:
+            pipe.xrange(**lag_scan_args(*pairs[index], max_scan=max_scan))
+        for index, entries in zip(to_scan, pipe.execute()):
+            lags[index] = lag_from_scan(*pairs[index], entries, max_scan=max_scan)
+    return lags  # type: ignore[return-value]
+
+
+def group_lag(
+    redis_conn: Redis, snapshot: StreamSnapshot, group: str, max_scan: int = 1000
+) -> int:
+    """
+    Number of entries not yet delivered to the group, see group_lags
+    """
+    return group_lags(redis_conn, [(snapshot, group)], max_scan=max_scan)[0]
+
+
+def snapshot_from_info(
+    stream: str, info: Any, groups: Any, collected_at: Optional[float] = None
+) -> StreamSnapshot:
+    """
+    Snapshot of a stream without its consumers from the responses of a pipeline
+    executed with raise_on_error=False
+    :param info: XINFO STREAM response or its error
+    :param groups: XINFO GROUPS response or its error
+    :param collected_at: defaults to now
+    """
+    if isinstance(info, ResponseError):
+        # the stream doesn't exist
+        info, groups = None, []
+    elif isinstance(groups, ResponseError):
+        raise groups
+    return StreamSnapshot(
+        stream=stream,
+        info=info,
+        groups={_name(group.get("name")): group for group in groups},
+        consumers={},
+        collected_at=time.time() if collected_at is None else collected_at,
+    )
+
+
+def collect_snapshots(
+    redis_conn: Redis, streams: Iterable[str], consumers: bool = True
+) -> Dict[str, StreamSnapshot]:
+    """
+    Snapshot of each stream, see the module documentation
+    :param consumers: also collect the consumers of the groups, needs a second
+                      round trip
+    :return: stream name -> snapshot
+    """
+    streams = list(streams)
+    pipe = redis_conn.pipeline(transaction=False)
+    for stream in streams:
+        pipe.xinfo_stream(name=stream)
+        pipe.xinfo_groups(name=stream)
+    responses = pipe.execute(raise_on_error=False)
+    collected_at = time.time()
+    snapshots = {
+        stream: snapshot_from_info(
+            stream, responses[2 * index], responses[2 * index + 1], collected_at
+        )
+        for index, stream in enumerate(streams)
+    }
+    if not consumers:
+        return snapshots
+    with_consumers = [
+        (snapshot, group_name)
+        for snapshot in snapshots.values()
+        for group_name, group in snapshot.groups.items()
+        if group.get("consumers")
+    ]
+    if with_consumers:
+        pipe = redis_conn.pipeline(transaction=False)
+        for snapshot, group_name in with_consumers:
+            pipe.xinfo_consumers(name=snapshot.stream, groupname=group_name)
+        for (snapshot, group_name), resp in zip(
+            with_consumers, pipe.execute(raise_on_error=False)
+        ):
+            if isinstance(resp, ResponseError):
+                # the group was destroyed meanwhile
+                continue
+            snapshot.consumers[group_name] = resp
+    return snapshots
@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+from redis.asyncio import Redis
+
+from redis_streams.aio.consumer import Consumer
+from redis_streams.aio.monitor import Monitor
+from redis_streams.aio.producer import Producer
+from redis_streams.aio.scaler import Scaler
+from redis_streams.producer import PartialPublishError
+from redis_streams.scaler import Scale
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+
+def run(coro_func, decode_responses=True):
+    async def _with_connection():
+        redis_conn = Redis(decode_responses=decode_responses)
+        try:
+            return await coro_func(redis_conn)
+        finally:
+            await redis_conn.aclose()
+
+    return asyncio.run(_with_connection())
+
+
+class TestAioE2E(TestBase):
+
+    def test_producer_add_and_add_many(self):
+        async def _test(redis_conn):
+            producer = Producer(redis_conn=redis_conn, stream=STREAM)
+            msg_id = await producer.add({"key": "value"})
+            ids = await producer.add_many([{"i": str(i)} for i in range(5)], 2)
+            return msg_id, ids
+
+        initial_len = self.redis_conn.xlen(STREAM)
+        msg_id, ids = run(_test)
+        assert "-" in msg_id
+        assert len(ids) == 5 and None not in ids
+        assert self.redis_conn.xlen(STREAM) == initial_len + 6
+
+    def test_producer_add_many_isolates_codec_errors(self):
+        async def _test(redis_conn):
+            producer = Producer(redis_conn=redis_conn, stream=STREAM, codec="json")
+            with pytest.raises(PartialPublishError) as exc_info:
+                await producer.add_many([{"a": 1}, {"not", "json"}, {"c": 3}])
+            return exc_info.value
+
+        initial_len = self.redis_conn.xlen(STREAM)
+        error = run(_test)
+        assert list(error.failures) == [1]
+        assert error.msg_ids[1] is None
+        assert self.redis_conn.xlen(STREAM) == initial_len + 2
+
+    def test_consumer_full_batch(self):
+        async def _test(redis_conn):
+            consumer = Consumer(
+                redis_conn=redis_conn,
+                stream=STREAM,
+                consumer_group=GROUP,
+                poll_time_ms=500,
+                batch_size=len(TEST_DATASET),
+                consumer_id=get_test_name(),
+            )
+            repr(consumer)
+            messages = await consumer.get_items()
+            for message in messages:
+                await consumer.remove_item_from_consumer_group(item_id=message.msgid)
+            return messages
+
+        messages = run(_test)
+        assert [message.content for message in messages] == TEST_DATASET
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+
+    def test_concurrent_consumers_share_the_loop(self):
+        async def _test(redis_conn):
+            consumers = [
+                Consumer(
+                    redis_conn=redis_conn,
+                    stream=STREAM,
+                    consumer_group=GROUP,
+                    batch_size=len(TEST_DATASET),
+                    max_wait_time_ms=200,
+                    poll_time_ms=50,
+                )
+                for _ in range(3)
+            ]
+            await consumers[0].prepare_redis()
+            return await asyncio.gather(*[c.get_items() for c in consumers])
+
+        batches = run(_test)
+        received = [message.content for batch in batches for message in batch]
+        assert sorted(received, key=str) == sorted(TEST_DATASET, key=str)
+
+    def test_monitor_and_scaler(self):
+        async def _test(redis_conn):
+            consumer = Consumer(
+                redis_conn=redis_conn,
+                stream=STREAM,
+                consumer_group=GROUP,
+                batch_size=2,
+                max_wait_time_ms=100,
+                consumer_id=get_test_name(),
+            )
+            await consumer.get_items()
+            monitor = Monitor(
+                redis_conn=redis_conn,
+                stream=STREAM,
+                consumer_group=GROUP,
+                batch_size=1,
+                idle_time_ms_warning_threshold=10,
+                min_wait_time_ms=1,
+            )
+            await monitor.collect_monitoring_data(auto_cleanup=False)
+            scaler = Scaler(redis_conn=redis_conn, stream=STREAM, consumer_group=GROUP)
+            metrics = await scaler.collect_metrics()
+            decision = await scaler.get_scale_decision(
+                scale_out_rate=60, scale_in_rate=20
+            )
+            with pytest.raises(ValueError):
+                await scaler.get_scale_decision(scale_in_rate=11, scale_out_rate=10)
+            return monitor, metrics, decision
+
+        monitor, metrics, decision = run(_test)
+        assert len(monitor.collected_consumers_data) == 1
+        assert monitor.unhealthy_consumers[GROUP] == {get_test_name(): 2}
+        assert metrics == (0, 2)
+        assert decision[1] == Scale.NOSCALE.value
+
+    def test_monitor_spreads_messages(self):
+        for no in range(2):
+            self.redis_conn.xadd(STREAM, {"test": f"more{no}"})
+        self.redis_conn.xgroup_create(STREAM, GROUP, id="0")
+        self.redis_conn.xreadgroup(GROUP, get_test_name(), {STREAM: ">"}, 4)
+        for suffix in ("2", "3"):
+            self.redis_conn.xgroup_createconsumer(STREAM, GROUP, get_test_name(suffix))
+        other_group = f"{GROUP}_other"
+        self.redis_conn.xgroup_create(STREAM, other_group, id="0")
+        self.redis_conn.xreadgroup(other_group, get_test_name(), {STREAM: ">"}, 4)
+
+        async def _test(redis_conn):
+            monitor = Monitor(
+                redis_conn=redis_conn,
+                stream=STREAM,
+                consumer_group=GROUP,
+                batch_size=2,
+                min_wait_time_ms=0,
+            )
+            await monitor.collect_monitoring_data()
+
+        run(_test)
+        pending = {
+            consumer["name"]: consumer["pending"]
+            for consumer in self.redis_conn.xinfo_consumers(STREAM, GROUP)
+        }
+        assert pending == {get_test_name("2"): 2, get_test_name("3"): 2}
+        # no healthy consumer in the other group, its consumer is kept
+        other = self.redis_conn.xinfo_consumers(STREAM, other_group)
+        assert other[0]["pending"] == 4
+
+    def test_scaler_lag(self):
+        for no in range(10):
+            self.redis_conn.xadd(STREAM, {"test": f"more{no}"})
+        self.redis_conn.xgroup_create(STREAM, GROUP, id="0")
+        self.redis_conn.xreadgroup(GROUP, get_test_name(), {STREAM: ">"}, 2)
+
+        async def _test(redis_conn):
+            scaler = Scaler(
+                redis_conn=redis_conn,
+                stream=STREAM,
+                consumer_group=GROUP,
+                max_lag_scan=20,
+            )
+            return await scaler.collect_metrics()
+
+        assert run(_test) == (10, 2)
+
+    def test_consumer_bytes_connection(self):
+        async def _test(redis_conn):
+            consumer = Consumer(
+                redis_conn=redis_conn,
+                stream=STREAM,
+                consumer_group=GROUP,
+                batch_size=len(TEST_DATASET),
+                max_wait_time_ms=100,
+                consumer_id=get_test_name(),
+            )
+            return await consumer.get_items()
+
+        messages = run(_test, decode_responses=False)
+        assert [message.content for message in messages] == TEST_DATASET
+        assert messages[0].get_bytes("test") == b"data1"
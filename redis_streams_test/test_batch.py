@@ -0,0 +1,64 @@
+from array import array
+
+import pytest
+from redis import Redis
+
+from redis_streams.batch import MessageBatch
+from redis_streams.consumer import Consumer, RedisMsg
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+
+class TestMessageBatch:
+
+    def test_columns(self):
+        batch = MessageBatch.from_entries(
+            [
+                ("1-0", {"price": "1.5", "qty": "2"}),
+                ("2-0", {"qty": "3"}),
+                (b"3-0", {b"price": b"2.5", b"note": b"x"}),
+            ],
+            stream=STREAM,
+        )
+        assert len(batch) == 3
+        assert batch.ids == ["1-0", "2-0", "3-0"]
+        assert batch.fields == ["price", "qty", "note"]
+        assert batch.column("qty") == ["2", "3", None]
+        assert batch.column("note") == [None, None, b"x"]
+        assert batch.column("price", typecode="d", default=0) == array(
+            "d", [1.5, 0, 2.5]
+        )
+        assert batch.column("missing") == [None, None, None]
+        assert list(batch)[1] == ("2-0", {"qty": "3"})
+        with pytest.raises(TypeError):
+            batch.column("qty", typecode="q")
+        repr(batch)
+
+    def test_from_messages(self):
+        batch = MessageBatch.from_messages(
+            [RedisMsg(msgid="1-0", content={"a": "1"}, stream=STREAM)]
+        )
+        assert batch.stream == STREAM
+        assert batch.columns == {"a": ["1"]}
+        assert len(MessageBatch.from_messages([])) == 0
+
+
+class TestConsumerGetBatch(TestBase):
+
+    def test_get_batch(self):
+        for redis_conn in (self.redis_conn, Redis(decode_responses=False)):
+            redis_consumer = Consumer(
+                redis_conn=redis_conn,
+                stream=STREAM,
+                consumer_group=GROUP,
+                poll_time_ms=50,
+                batch_size=len(TEST_DATASET),
+                consumer_id=get_test_name(),
+            )
+            batch = redis_consumer.get_batch()
+            assert len(batch) == len(TEST_DATASET)
+            assert batch.column("test") in (
+                ["data1", "data2"],
+                [b"data1", b"data2"],
+            )
+        assert redis_consumer.ack_batch(batch) == len(TEST_DATASET)
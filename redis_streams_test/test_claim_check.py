@@ -0,0 +1,142 @@
+import os
+
+import pytest
+from redis import Redis
+
+from redis_streams.claim_check import (
+    REFERENCE_FIELD,
+    BlobStore,
+    DirectoryBlobStore,
+    RedisBlobStore,
+)
+from redis_streams.codecs import decode_fields
+from redis_streams.consumer import Consumer
+from redis_streams.producer import Producer
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+LARGE_PAYLOAD = {"text": "x" * 2000}
+
+
+class TestClaimCheck:
+
+    def test_directory_blob_store(self, tmp_path):
+        store = DirectoryBlobStore(str(tmp_path))
+        key = store.new_key()
+        store.put_many({key: b"payload"})
+        assert store.get_many([key, store.new_key()]) == [b"payload", None]
+        store.delete_many([key])
+        assert store.get_many([key]) == [None]
+        with pytest.raises(ValueError):
+            store.get_many(["../outside"])
+
+    def test_blob_store_must_implement_the_operations(self):
+        class WriteOnly(BlobStore):
+            def put_many(self, blobs):
+                pass
+
+        with pytest.raises(TypeError):
+            WriteOnly()
+
+    def test_unresolved_reference(self):
+        with pytest.raises(ValueError):
+            decode_fields({"_codec": "json", REFERENCE_FIELD: "key"})
+
+    def test_requires_codec(self, tmp_path):
+        with pytest.raises(ValueError):
+            Producer(
+                redis_conn=None,
+                stream=STREAM,
+                blob_store=DirectoryBlobStore(str(tmp_path)),
+            )
+
+
+class TestClaimCheckE2E(TestBase):
+
+    def _consumer(self, redis_conn, blob_store):
+        return Consumer(
+            redis_conn=redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=50,
+            max_wait_time_ms=500,
+            batch_size=len(TEST_DATASET) + 2,
+            consumer_id=get_test_name(),
+            blob_store=blob_store,
+        )
+
+    def test_offload_to_redis(self):
+        redis_conn = Redis(decode_responses=False)
+        blob_store = RedisBlobStore(redis_conn=redis_conn, ttl_s=60)
+        producer = Producer(
+            redis_conn=redis_conn,
+            stream=STREAM,
+            codec="json",
+            blob_store=blob_store,
+            offload_threshold=1000,
+        )
+        producer.add_many([LARGE_PAYLOAD, {"small": 1}])
+        entries = redis_conn.xrange(STREAM, count=len(TEST_DATASET) + 2)
+        large_fields = entries[-2][1]
+        assert b"_payload" not in large_fields
+        key = large_fields[REFERENCE_FIELD.encode()].decode()
+        assert 0 < redis_conn.ttl(f"{blob_store.prefix}{key}") <= 60
+
+        consumer = self._consumer(redis_conn, blob_store)
+        large, small = consumer.get_items()[-2:]
+        assert large.payload == LARGE_PAYLOAD
+        assert small.payload == {"small": 1}
+        batch = consumer.get_batch()
+        assert decode_fields(dict(list(batch)[-2][1])) == LARGE_PAYLOAD
+        consumer.ack_batch([large, small])
+        assert blob_store.get_many([key]) == [None]
+
+    def test_offload_to_directory(self, tmp_path):
+        blob_store = DirectoryBlobStore(str(tmp_path))
+        producer = Producer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            codec="json",
+            blob_store=blob_store,
+            offload_threshold=1000,
+        )
+        producer.add(LARGE_PAYLOAD)
+        consumer = self._consumer(self.redis_conn, blob_store)
+        large = consumer.get_items()[-1]
+        assert large.payload == LARGE_PAYLOAD
+        consumer.remove_item_from_consumer_group(large.msgid)
+        assert not list(tmp_path.iterdir())
+
+    def test_binary_payload_round_trip(self):
+        redis_conn = Redis(decode_responses=False)
+        blob_store = RedisBlobStore(redis_conn=redis_conn, ttl_s=60)
+        producer = Producer(
+            redis_conn=redis_conn,
+            stream=STREAM,
+            codec="pickle",
+            compression="zlib",
+            compression_threshold=100,
+            blob_store=blob_store,
+            offload_threshold=1000,
+        )
+        # compressed and offloaded, compressed only, neither
+        payloads = [
+            {"random": os.urandom(3000), "text": "x" * 3000},
+            {"text": "y" * 5000},
+            {"small": b"\x00\xff"},
+        ]
+        redis_conn.xtrim(STREAM, maxlen=0)
+        producer.add_many(payloads)
+        offloaded, inline, _ = redis_conn.xrange(STREAM)
+        assert REFERENCE_FIELD.encode() in offloaded[1]
+        assert b"_compression" in inline[1]
+
+        consumer = self._consumer(redis_conn, blob_store)
+        messages = consumer.get_items()
+        assert [message.payload for message in messages] == payloads
+        for message in messages:
+            assert isinstance(message.content["_payload"], bytes)
+        batch = consumer.get_batch()
+        assert [decode_fields(fields) for _, fields in batch] == payloads
+        assert all(isinstance(payload, bytes) for payload in batch.column("_payload"))
+        consumer.ack_batch(messages)
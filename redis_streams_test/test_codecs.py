@@ -0,0 +1,86 @@
+import pytest
+from redis import Redis
+
+from redis_streams.codecs import (
+    CODEC_FIELD,
+    Codec,
+    JsonCodec,
+    decode_fields,
+    get_codec,
+    register_codec,
+)
+from redis_streams.consumer import Consumer
+from redis_streams.producer import Producer
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+PAYLOAD = {"nested": {"list": [1, 2.5, "three"], "flag": True}}
+
+
+class ReversedCodec(Codec):
+    name = "reversed"
+
+    def encode(self, obj):
+        return obj[::-1].encode()
+
+    def decode(self, data):
+        return data.decode()[::-1]
+
+
+class TestCodecs:
+
+    def test_get_codec(self):
+        assert isinstance(get_codec("json"), JsonCodec)
+        codec = ReversedCodec()
+        assert get_codec(codec) is codec
+        with pytest.raises(ValueError):
+            get_codec("unknown")
+
+    def test_codec_must_implement_encode_and_decode(self):
+        class EncodeOnly(Codec):
+            name = "encode_only"
+
+            def encode(self, obj):
+                return b""
+
+        with pytest.raises(TypeError):
+            EncodeOnly()
+
+    def test_decode_fields_without_codec(self):
+        with pytest.raises(ValueError):
+            decode_fields({"test": "data"})
+
+    def test_register_codec(self):
+        register_codec(ReversedCodec())
+        fields = {CODEC_FIELD: "reversed", "_payload": b"olleh"}
+        assert decode_fields(fields) == "hello"
+        nameless = ReversedCodec()
+        nameless.name = ""
+        with pytest.raises(ValueError):
+            register_codec(nameless)
+
+
+class TestCodecsE2E(TestBase):
+
+    def _consume(self, redis_conn):
+        consumer = Consumer(
+            redis_conn=redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=50,
+            batch_size=len(TEST_DATASET) + 1,
+            consumer_id=get_test_name(),
+        )
+        return consumer.get_items()[-1]
+
+    def test_json_round_trip(self):
+        producer = Producer(redis_conn=self.redis_conn, stream=STREAM, codec="json")
+        producer.add(PAYLOAD)
+        assert "json" in repr(producer)
+        assert self._consume(self.redis_conn).payload == PAYLOAD
+
+    def test_pickle_round_trip_on_bytes_connection(self):
+        redis_conn = Redis(decode_responses=False)
+        producer = Producer(redis_conn=redis_conn, stream=STREAM, codec="pickle")
+        producer.add_many([{"set": {1, 2}}])
+        assert self._consume(redis_conn).payload == {"set": {1, 2}}
@@ -0,0 +1,100 @@
+import pytest
+from redis import Redis
+
+from redis_streams.codecs import (
+    PAYLOAD_FIELD,
+    decode_fields,
+    encode_fields,
+    get_codec,
+)
+from redis_streams.compression import (
+    COMPRESSION_FIELD,
+    CompressionStats,
+    Compressor,
+    ZlibCompressor,
+    compress_payload,
+    get_compressor,
+)
+from redis_streams.consumer import Consumer
+from redis_streams.producer import Producer
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+LARGE_PAYLOAD = {"text": "compressible " * 200}
+
+
+class TestCompression:
+
+    def test_get_compressor(self):
+        assert isinstance(get_compressor("zlib"), ZlibCompressor)
+        with pytest.raises(ValueError):
+            get_compressor("unknown")
+
+    def test_compressor_must_implement_compress_and_decompress(self):
+        class CompressOnly(Compressor):
+            name = "compress_only"
+
+            def compress(self, data):
+                return data
+
+        with pytest.raises(TypeError):
+            CompressOnly()
+
+    def test_below_threshold(self):
+        stats = CompressionStats()
+        assert compress_payload(b"small", ZlibCompressor(), 1024, stats) is None
+        assert stats.payloads == 0
+
+    def test_incompressible(self):
+        stats = CompressionStats()
+        assert compress_payload(b"\x00", ZlibCompressor(), 0, stats) is None
+        assert stats.payloads == 1
+        assert stats.compressed_payloads == 0
+        assert stats.bytes_saved == 0
+
+    def test_fields_round_trip(self):
+        stats = CompressionStats()
+        fields = encode_fields(
+            LARGE_PAYLOAD,
+            get_codec("json"),
+            compressor=get_compressor("lzma"),
+            compression_threshold=100,
+            compression_stats=stats,
+        )
+        assert fields[COMPRESSION_FIELD] == "lzma"
+        assert len(fields[PAYLOAD_FIELD]) < stats.bytes_in
+        assert stats.ratio < 1
+        bytes_fields = {key.encode(): value for key, value in fields.items()}
+        assert decode_fields(bytes_fields) == LARGE_PAYLOAD
+
+    def test_requires_codec(self):
+        with pytest.raises(ValueError):
+            Producer(redis_conn=None, stream=STREAM, compression="zlib")
+
+
+class TestCompressionE2E(TestBase):
+
+    def test_round_trip_on_bytes_connection(self):
+        redis_conn = Redis(decode_responses=False)
+        producer = Producer(
+            redis_conn=redis_conn,
+            stream=STREAM,
+            codec="json",
+            compression="zlib",
+            compression_threshold=100,
+        )
+        producer.add_many([LARGE_PAYLOAD, {"small": 1}])
+        assert producer.compression_stats.compressed_payloads == 1
+        assert "zlib" in repr(producer)
+        consumer = Consumer(
+            redis_conn=redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=50,
+            batch_size=len(TEST_DATASET) + 2,
+            consumer_id=get_test_name(),
+        )
+        large, small = consumer.get_items()[-2:]
+        assert COMPRESSION_FIELD.encode() in large.raw
+        assert large.payload == LARGE_PAYLOAD
+        assert small.payload == {"small": 1}
@@ -1,7 +1,18 @@
 import datetime
+import time
 import warnings
 
-from redis_streams.consumer import Consumer
+import pytest
+
+from redis import Redis
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from redis_streams.consumer import (
+    AdaptiveBatching,
+    Consumer,
+    PrefetchingConsumer,
+    RawRedisMsg,
+)
 from redis_streams_test.base import TestBase
 from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
 
@@ -60,3 +71,464 @@ class TestConsumerE2E(TestBase):
         assert issubclass(caught[0].category, DeprecationWarning)
         assert "remove_item_from_consumer_group" in str(caught[0].message)
 
+    def test_track_pending_locally(self):
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=50,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+            track_pending_locally=True,
+        )
+        messages = redis_consumer.get_items()
+        assert [message.content for message in messages] == TEST_DATASET
+        # not acknowledged messages are part of the next batch without reading PEL
+        redis_consumer.remove_item_from_consumer_group(item_id=messages[0].msgid)
+        self.redis_conn.xadd(name=STREAM, fields={"test": "data3"})
+        messages = redis_consumer.get_items()
+        assert [message.content for message in messages] == [
+            TEST_DATASET[1],
+            {"test": "data3"},
+        ]
+
+    def test_track_pending_locally_reads_pel_on_startup(self):
+        Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+        ).get_items()
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=50,
+            poll_time_ms=10,
+            batch_size=1,
+            consumer_id=get_test_name(),
+            track_pending_locally=True,
+        )
+        for expected in TEST_DATASET:
+            messages = redis_consumer.get_items()
+            assert [message.content for message in messages] == [expected]
+            redis_consumer.remove_item_from_consumer_group(item_id=messages[0].msgid)
+        redis_consumer.resync_pending()
+        assert redis_consumer.get_items() == []
+
+    def test_ack_many(self):
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=50,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+        )
+        messages = redis_consumer.get_items()
+        assert redis_consumer.ack_batch(messages) == len(TEST_DATASET)
+        # already acknowledged messages are not counted
+        assert redis_consumer.ack_many([message.msgid for message in messages]) == 0
+        assert redis_consumer.ack_many([]) == 0
+        assert self.redis_conn.xlen(STREAM) == len(TEST_DATASET)
+
+    def test_ack_many_and_delete(self):
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=50,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+        )
+        messages = redis_consumer.get_items()
+        acknowledged = redis_consumer.ack_many(
+            [message.msgid for message in messages], delete=True
+        )
+        assert acknowledged == len(TEST_DATASET)
+        assert self.redis_conn.xlen(STREAM) == 0
+
+    def test_ack_coalescer_flushes_before_get_items(self):
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=50,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+            ack_flush_size=100,
+            ack_flush_interval_ms=60000,
+        )
+        with redis_consumer:
+            for message in redis_consumer.get_items():
+                redis_consumer.remove_item_from_consumer_group(item_id=message.msgid)
+            assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 2
+            assert redis_consumer.get_items() == []
+            assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+
+    def test_ack_coalescer_flushes_on_size_and_close(self):
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=50,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+            ack_flush_size=1,
+            ack_flush_interval_ms=60000,
+        )
+        messages = redis_consumer.get_items()
+        redis_consumer.remove_item_from_consumer_group(item_id=messages[0].msgid)
+        deadline = datetime.datetime.now() + datetime.timedelta(seconds=5)
+        while self.redis_conn.xpending(STREAM, GROUP)["pending"] != 1:
+            assert datetime.datetime.now() < deadline
+            time.sleep(0.01)
+        redis_consumer.ack_coalescer.flush_size = 100
+        redis_consumer.remove_item_from_consumer_group(item_id=messages[1].msgid)
+        redis_consumer.close()
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+
+    def test_iter_items(self):
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+        )
+        # one message pending from an earlier batch
+        redis_consumer._get_messages_from_stream(requested_messages=1)
+        items = redis_consumer.iter_items(auto_ack=True)
+        assert next(items).content == TEST_DATASET[0]
+        assert next(items).content == TEST_DATASET[1]
+        # the first one is acknowledged as the consumer advanced
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 1
+        self.redis_conn.xadd(name=STREAM, fields={"test": "data3"})
+        assert next(items).content == {"test": "data3"}
+        items.close()
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 1
+
+    def test_iter_without_auto_ack(self):
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=10,
+            batch_size=1,
+            consumer_id=get_test_name(),
+        )
+        received = []
+        for message in redis_consumer:
+            received.append(message.content)
+            if len(received) == len(TEST_DATASET):
+                break
+        assert received == TEST_DATASET
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 2
+
+    def test_adaptive_batching_grows_on_hot_stream(self):
+        adaptive = AdaptiveBatching(
+            target_latency_ms=1000, min_batch_size=1, max_batch_size=50
+        )
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=100,
+            poll_time_ms=10,
+            batch_size=1,
+            consumer_id=get_test_name(),
+            adaptive_batching=adaptive,
+        )
+        for i in range(100):
+            self.redis_conn.xadd(name=STREAM, fields={"extra": str(i)})
+        redis_consumer.ack_batch(redis_consumer.get_items())
+        assert adaptive.arrival_rate > 0
+        messages = redis_consumer.get_items()
+        assert redis_consumer.batch_size == 50
+        assert len(messages) == 50
+        repr(adaptive)
+
+    def test_bytes_connection_gives_raw_messages(self):
+        redis_consumer = Consumer(
+            redis_conn=Redis(decode_responses=False),
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=50,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+        )
+        messages = redis_consumer.get_items()
+        assert len(messages) == len(TEST_DATASET)
+        message = messages[0]
+        assert isinstance(message, RawRedisMsg)
+        assert isinstance(message.msgid, str)
+        assert message.raw == {b"test": b"data1"}
+        assert message.get("test") == "data1"
+        assert message.get("missing", "default") == "default"
+        assert bytes(message.get_view("test")) == b"data1"
+        assert message.content == TEST_DATASET[0]
+        assert not hasattr(message, "__dict__")
+        assert redis_consumer.ack_batch(messages) == len(TEST_DATASET)
+
+    def test_bytes_connection_binary_values(self):
+        binary = bytes(range(256))
+        self.redis_conn.xtrim(STREAM, maxlen=0)
+        self.redis_conn.xadd(STREAM, {"test": "data1", "blob": binary})
+        redis_consumer = Consumer(
+            redis_conn=Redis(decode_responses=False),
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=50,
+            max_wait_time_ms=50,
+            batch_size=1,
+            consumer_id=get_test_name(),
+            track_pending_locally=True,
+        )
+        message = redis_consumer.get_items()[0]
+        assert message.content == {"test": "data1", "blob": binary}
+        assert message.get("blob") == binary
+        batch = redis_consumer.get_batch()
+        assert batch.column("test") == [b"data1"]
+        assert batch.column("blob") == [binary]
+
+
+class TestAdaptiveBatching:
+
+    def test_calculate(self):
+        adaptive = AdaptiveBatching(
+            target_latency_ms=1000,
+            min_batch_size=1,
+            max_batch_size=100,
+            min_wait_time_ms=10,
+            max_wait_time_ms=5000,
+        )
+        # no measurement yet
+        assert adaptive.calculate() == (1, 1000)
+        # 1 message / 10 ms arrives, processing takes 10 ms / message
+        adaptive.arrival_rate = 100
+        adaptive.processing_time = 0.01
+        assert adaptive.calculate() == (50, 500)
+        # quiet stream
+        adaptive.arrival_rate = 0.5
+        assert adaptive.calculate() == (1, 990)
+        # slow processing does not fit in the target
+        adaptive.processing_time = 2
+        assert adaptive.calculate() == (1, 10)
+
+    def test_invalid_bounds(self):
+        with pytest.raises(ValueError):
+            AdaptiveBatching(min_batch_size=10, max_batch_size=1)
+        with pytest.raises(ValueError):
+            AdaptiveBatching(min_wait_time_ms=10, max_wait_time_ms=1)
+        with pytest.raises(ValueError):
+            AdaptiveBatching(smoothing=0)
+
+
+class TestPrefetchingConsumerE2E(TestBase):
+
+    def test_prefetch_is_bounded(self):
+        for i in range(10):
+            self.redis_conn.xadd(name=STREAM, fields={"extra": str(i)})
+        with PrefetchingConsumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=1000,
+            poll_time_ms=10,
+            batch_size=2,
+            consumer_id=get_test_name(),
+            prefetch_batches=2,
+        ) as redis_consumer:
+            repr(redis_consumer)
+            messages = redis_consumer.get_items()
+            assert [message.content for message in messages] == TEST_DATASET
+            deadline = datetime.datetime.now() + datetime.timedelta(seconds=5)
+            # one batch returned, two prefetched
+            bound = redis_consumer.max_unacked
+            assert bound == 6
+            while self.redis_conn.xpending(STREAM, GROUP)["pending"] < bound:
+                assert datetime.datetime.now() < deadline
+                time.sleep(0.01)
+            time.sleep(0.05)
+            assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == bound
+            assert redis_consumer.ack_batch(messages) == 2
+            received = []
+            while len(received) < 10:
+                messages = redis_consumer.get_items()
+                assert messages
+                received += [message.content for message in messages]
+                redis_consumer.ack_batch(messages)
+            assert received == [{"extra": str(i)} for i in range(10)]
+
+    def test_prefetch_bounded_without_acks(self):
+        for i in range(10):
+            self.redis_conn.xadd(name=STREAM, fields={"extra": str(i)})
+        with PrefetchingConsumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=100,
+            poll_time_ms=10,
+            batch_size=2,
+            consumer_id=get_test_name(),
+        ) as redis_consumer:
+            for _ in range(6):
+                assert len(redis_consumer.get_items()) <= redis_consumer.max_unacked
+                pending = self.redis_conn.xpending(STREAM, GROUP)["pending"]
+                assert pending <= redis_consumer.max_unacked
+            assert len(redis_consumer.get_items()) == redis_consumer.max_unacked
+
+    def test_prefetch_errors(self):
+        with PrefetchingConsumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=500,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+        ) as redis_consumer:
+            original = redis_consumer._get_messages_from_stream
+            errors = [RedisTimeoutError("timeout"), ValueError("broken")]
+
+            def failing(*args, **kwargs):
+                if errors:
+                    raise errors.pop(0)
+                return original(*args, **kwargs)
+
+            redis_consumer._get_messages_from_stream = failing
+            # the Redis error is logged, the other one is raised
+            with pytest.raises(ValueError):
+                redis_consumer.get_items()
+            messages = redis_consumer.get_items()
+            assert [message.content for message in messages] == TEST_DATASET
+
+    def test_prefetch_reads_pending_at_startup_and_returns_unacked(self):
+        Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+        ).get_items()
+        with PrefetchingConsumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=200,
+            poll_time_ms=10,
+            batch_size=1,
+            consumer_id=get_test_name(),
+        ) as redis_consumer:
+            first = redis_consumer.get_items()
+            assert [message.content for message in first] == TEST_DATASET[:1]
+            second = redis_consumer.get_items()
+            assert [message.content for message in second] == TEST_DATASET
+            redis_consumer.ack_batch(second)
+            assert redis_consumer.get_items() == []
+
+
+class TestClaimIdleMessages(TestBase):
+
+    def _crashed_consumer(self):
+        Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(suffix="_crashed"),
+        ).get_items()
+        time.sleep(0.02)
+
+    def test_claim_before_reading_new(self):
+        self._crashed_consumer()
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=100,
+            poll_time_ms=10,
+            batch_size=1,
+            consumer_id=get_test_name(),
+            claim_idle_time_ms=10,
+        )
+        # bounded by the room in the batch
+        messages = redis_consumer.get_items()
+        assert [message.content for message in messages] == TEST_DATASET[:1]
+        assert redis_consumer.claimed_messages == 1
+        redis_consumer.ack_batch(messages)
+        messages = redis_consumer.get_items()
+        assert [message.content for message in messages] == TEST_DATASET[1:]
+        assert redis_consumer.claimed_messages == 2
+
+    def test_not_idle_enough(self):
+        self._crashed_consumer()
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=50,
+            poll_time_ms=10,
+            consumer_id=get_test_name(),
+            claim_idle_time_ms=60000,
+        )
+        assert redis_consumer.get_items() == []
+        assert redis_consumer.claimed_messages == 0
+
+    def test_claim_tracked_locally(self):
+        self._crashed_consumer()
+        redis_consumer = Consumer(
+            redis_conn=Redis(),
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=50,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+            track_pending_locally=True,
+            claim_idle_time_ms=10,
+        )
+        messages = redis_consumer.get_items()
+        assert [message.get("test") for message in messages] == ["data1", "data2"]
+        assert redis_consumer.claimed_messages == 2
+
+    def _own_idle_messages(self, **kwargs):
+        redis_consumer = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=50,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET) + 1,
+            consumer_id=get_test_name(),
+            claim_idle_time_ms=10,
+            **kwargs,
+        )
+        assert len(redis_consumer.get_items()) == len(TEST_DATASET)
+        time.sleep(0.02)
+        self.redis_conn.xadd(name=STREAM, fields={"test": "data3"})
+        return redis_consumer
+
+    def test_own_idle_messages_not_counted_twice(self):
+        redis_consumer = self._own_idle_messages()
+        messages = redis_consumer.get_items()
+        assert [message.content["test"] for message in messages] == [
+            "data1",
+            "data2",
+            "data3",
+        ]
+        assert redis_consumer.claimed_messages == 0
+
+    def test_own_idle_messages_not_claimed_when_tracked(self):
+        redis_consumer = self._own_idle_messages(track_pending_locally=True)
+        messages = redis_consumer.get_items()
+        assert len(messages) == 3
+        assert redis_consumer.assigned_messages == 3
+        assert redis_consumer.claimed_messages == 0
@@ -0,0 +1,200 @@
+import time
+
+import pytest
+
+from redis_streams.consumer import Consumer, PrefetchingConsumer
+from redis_streams.dead_letter import (
+    CONSUMER_FIELD,
+    DELIVERIES_FIELD,
+    SOURCE_GROUP_FIELD,
+    SOURCE_ID_FIELD,
+    SOURCE_STREAM_FIELD,
+    DeadLetterPolicy,
+    move_to_dead_letter,
+)
+from redis_streams.monitor import Monitor
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+DLQ = f"{STREAM}_dlq"
+
+
+class TestDeadLetter(TestBase):
+
+    @pytest.fixture(autouse=True)
+    def dead_letter_stream(self):
+        self.redis_conn.delete(DLQ)
+        yield
+        self.redis_conn.delete(DLQ)
+
+    def _consumer(self, suffix="", **kwargs):
+        return Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=2,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(suffix=suffix),
+            **kwargs,
+        )
+
+    def test_policy(self):
+        with pytest.raises(ValueError):
+            DeadLetterPolicy(stream=DLQ, max_deliveries=0)
+        policy = DeadLetterPolicy(stream=DLQ, max_deliveries=2)
+        assert not policy.is_poison({"times_delivered": 2})
+        assert policy.is_poison({"times_delivered": 3})
+        assert move_to_dead_letter(self.redis_conn, STREAM, GROUP, [], policy) == []
+
+    def test_consumer_moves_poison_messages(self):
+        consumer = self._consumer(
+            dead_letter=DeadLetterPolicy(stream=DLQ, max_deliveries=2)
+        )
+        # read as new, then delivered again with the pending ones
+        assert len(consumer.get_items()) == 2
+        assert len(consumer.get_items()) == 2
+        assert consumer.get_items() == []
+        assert consumer.dead_lettered_messages == 2
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+        entries = self.redis_conn.xrange(DLQ)
+        assert [{"test": fields["test"]} for _, fields in entries] == TEST_DATASET
+        _, fields = entries[0]
+        assert fields[SOURCE_STREAM_FIELD] == STREAM
+        assert fields[SOURCE_GROUP_FIELD] == GROUP
+        assert fields[CONSUMER_FIELD] == get_test_name()
+        assert fields[DELIVERIES_FIELD] == "3"
+        # kept in the source stream
+        assert self.redis_conn.xlen(STREAM) == len(TEST_DATASET)
+
+    def test_consumer_counts_local_deliveries(self):
+        policy = DeadLetterPolicy(stream=DLQ, max_deliveries=2)
+        consumer = self._consumer(dead_letter=policy, track_pending_locally=True)
+        # returned again from memory, the PEL is not read
+        assert len(consumer.get_items()) == 2
+        assert len(consumer.get_items()) == 2
+        assert consumer.get_items() == []
+        assert consumer.dead_lettered_messages == 2
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+        assert [
+            fields[DELIVERIES_FIELD] for _, fields in self.redis_conn.xrange(DLQ)
+        ] == [
+            "3",
+            "3",
+        ]
+
+    def test_consumer_reads_deliveries_of_pending(self):
+        self._consumer().get_items()
+        self._consumer().get_items()
+        # delivered twice already, the third delivery is read from the PEL
+        consumer = self._consumer(
+            dead_letter=DeadLetterPolicy(stream=DLQ, max_deliveries=2),
+            track_pending_locally=True,
+        )
+        assert consumer.get_items() == []
+        assert self.redis_conn.xlen(DLQ) == len(TEST_DATASET)
+
+    def test_prefetching_consumer_counts_local_deliveries(self):
+        with PrefetchingConsumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=2,
+            max_wait_time_ms=100,
+            poll_time_ms=10,
+            consumer_id=get_test_name(),
+            dead_letter=DeadLetterPolicy(stream=DLQ, max_deliveries=2),
+        ) as consumer:
+            assert len(consumer.get_items()) == 2
+            assert len(consumer.get_items()) == 2
+            assert consumer.get_items() == []
+            assert consumer.dead_lettered_messages == 2
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+
+    def test_delete_from_source(self):
+        consumer = self._consumer(
+            dead_letter=DeadLetterPolicy(
+                stream=DLQ, max_deliveries=1, delete_from_source=True
+            )
+        )
+        consumer.get_items()
+        consumer.get_items()
+        assert self.redis_conn.xlen(DLQ) == len(TEST_DATASET)
+        assert self.redis_conn.xlen(STREAM) == 0
+
+    def test_monitor_moves_instead_of_claiming(self):
+        self._consumer().get_items()
+        healthy = self._consumer(suffix="2")
+        healthy.get_items()
+        monitor = Monitor(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=1,
+            idle_time_ms_warning_threshold=10,
+            min_wait_time_ms=1,
+            dead_letter=DeadLetterPolicy(stream=DLQ, max_deliveries=1),
+        )
+        time.sleep(0.02)
+        # the healthy consumer just fetched messages
+        self.redis_conn.xreadgroup(GROUP, get_test_name(suffix="2"), {STREAM: ">"})
+        monitor.collect_monitoring_data()
+        assert monitor.dead_lettered_messages == 2
+        assert [
+            fields[SOURCE_ID_FIELD] for _, fields in self.redis_conn.xrange(DLQ)
+        ] == [msg_id for msg_id, _ in self.redis_conn.xrange(STREAM)]
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+
+    def test_monitor_bounds_the_poison_check(self):
+        self._consumer().get_items()
+        monitor = Monitor(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            claim_page_size=1,
+            dead_letter=DeadLetterPolicy(stream=DLQ, max_deliveries=1),
+            poison_pages_per_cycle=1,
+        )
+        # one page per cycle, continued by the next one
+        monitor.collect_monitoring_data()
+        assert monitor.dead_lettered_messages == 1
+        monitor.collect_monitoring_data()
+        assert monitor.dead_lettered_messages == 2
+        assert [
+            fields[SOURCE_ID_FIELD] for _, fields in self.redis_conn.xrange(DLQ)
+        ] == [msg_id for msg_id, _ in self.redis_conn.xrange(STREAM)]
+        # the end of the pending entries list, the next cycle starts over
+        monitor.collect_monitoring_data()
+        assert monitor._poison_cursors == {}
+
+    def test_reclaim_skips_dead_lettered_pages(self):
+        self._consumer().get_items()
+        monitor = Monitor(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            claim_page_size=1,
+            dead_letter=DeadLetterPolicy(stream=DLQ, max_deliveries=1),
+        )
+        # servers without XAUTOCLAIM page with XPENDING
+        monitor._xautoclaim_supported = False
+        time.sleep(0.01)
+        assert monitor.reclaim_stale_messages(get_test_name("2"), 1) == 0
+        assert monitor.dead_lettered_messages == 2
+
+    def test_move_poison_messages(self):
+        monitor = Monitor(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            claim_page_size=1,
+            dead_letter=DeadLetterPolicy(stream=DLQ, max_deliveries=1),
+        )
+        consumer = self._consumer()
+        consumer.get_items()
+        assert monitor.move_poison_messages(max_pages=1) == 1
+        assert monitor.move_poison_messages() == 1
+        assert monitor.move_poison_messages() == 0
+        with pytest.raises(ValueError):
+            Monitor(
+                redis_conn=self.redis_conn, stream=STREAM, consumer_group=GROUP
+            ).move_poison_messages()
@@ -89,3 +89,130 @@ class TestMonitor(TestBase):
         monitor.collect_monitoring_data(auto_cleanup=False)
         assert len(monitor.collected_consumers_data), monitor.collected_consumers_data
         monitor.print_monitoring_data("NonStream")
+
+    def _pending_of(self, consumer_id):
+        return {
+            consumer["name"]: consumer["pending"]
+            for consumer in self.redis_conn.xinfo_consumers(STREAM, GROUP)
+        }.get(consumer_id, 0)
+
+    def test_monitor_cleanup_in_pages(self):
+        self.redis_conn.xadd(STREAM, {"test": "data3"})
+        redis_consumer1 = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=3,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(),
+        )
+        redis_consumer1.get_items()
+        self.redis_conn.xgroup_createconsumer(STREAM, GROUP, get_test_name("2"))
+        time.sleep(0.01)
+        monitor = Monitor(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=2,
+            min_wait_time_ms=1,
+            claim_page_size=2,
+        )
+        monitor.collect_monitoring_data()
+        assert self._pending_of(get_test_name("2")) == 3
+        assert self._pending_of(get_test_name()) == 0
+
+    def test_reclaim_stale_messages(self):
+        redis_consumer1 = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=2,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(),
+        )
+        redis_consumer1.get_items()
+        time.sleep(0.01)
+        monitor = Monitor(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            claim_page_size=1,
+        )
+        assert monitor.reclaim_stale_messages(get_test_name("2"), 10000) == 0
+        assert monitor.reclaim_stale_messages(get_test_name("2"), 1, max_pages=1) == 1
+        time.sleep(0.01)
+        # follows the cursor
+        assert monitor.reclaim_stale_messages(get_test_name("2"), 1) == 2
+        # servers without XAUTOCLAIM
+        monitor._xautoclaim_supported = False
+        time.sleep(0.01)
+        assert monitor.reclaim_stale_messages(get_test_name("3"), 1) == 2
+        assert self._pending_of(get_test_name("3")) == 2
+        # delivered by the consumer only, the claims are sent with JUSTID
+        assert [
+            entry["times_delivered"]
+            for entry in self.redis_conn.xpending_range(STREAM, GROUP, "-", "+", 10)
+        ] == [2, 2]
+
+    def test_monitor_spreads_messages(self):
+        for no in range(6):
+            self.redis_conn.xadd(STREAM, {"test": f"more{no}"})
+        redis_consumer1 = Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=8,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(),
+        )
+        redis_consumer1.get_items()
+        for suffix in ("2", "3"):
+            self.redis_conn.xgroup_createconsumer(STREAM, GROUP, get_test_name(suffix))
+        other_group = f"{GROUP}_other"
+        self.redis_conn.xgroup_create(STREAM, other_group, id="0")
+        self.redis_conn.xreadgroup(other_group, get_test_name(), {STREAM: ">"}, 8)
+        time.sleep(0.01)
+        monitor = Monitor(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=2,
+            min_wait_time_ms=1,
+            claim_page_size=3,
+        )
+        monitor.collect_monitoring_data()
+        assert self._pending_of(get_test_name("2")) == 4
+        assert self._pending_of(get_test_name("3")) == 4
+        # no healthy consumer in the other group, its consumer is kept
+        other = self.redis_conn.xinfo_consumers(STREAM, other_group)
+        assert other[0]["pending"] == 8
+
+    def test_reclaim_spreads_pages(self):
+        for no in range(2):
+            self.redis_conn.xadd(STREAM, {"test": f"more{no}"})
+        Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=4,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(),
+        ).get_items()
+        for suffix in ("2", "3"):
+            self.redis_conn.xgroup_createconsumer(STREAM, GROUP, get_test_name(suffix))
+        time.sleep(0.01)
+        monitor = Monitor(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=4,
+            min_wait_time_ms=1,
+            claim_page_size=2,
+            reclaim_idle_time_ms=1,
+        )
+        assert monitor.reclaim_stale_messages() == 0
+        monitor.collect_monitoring_data()
+        # the crashed consumer looked healthy, its messages were reclaimed
+        assert self._pending_of(get_test_name()) == 0
+        assert self._pending_of(get_test_name("2")) == 2
+        assert self._pending_of(get_test_name("3")) == 2
@@ -0,0 +1,56 @@
+from redis_streams.multi_consumer import MultiStreamConsumer
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+STREAM2 = f"{STREAM}_2"
+
+
+class TestMultiStreamConsumer(TestBase):
+
+    def teardown_method(self):
+        self.redis_conn.delete(STREAM2)
+
+    def test_same_group(self):
+        for i in range(4):
+            self.redis_conn.xadd(name=STREAM2, fields={"other": str(i)})
+        consumer = MultiStreamConsumer(
+            redis_conn=self.redis_conn,
+            streams=[STREAM, STREAM2],
+            consumer_group=GROUP,
+            batch_size=4,
+            max_wait_time_ms=100,
+            poll_time_ms=10,
+            consumer_id=get_test_name(),
+        )
+        repr(consumer)
+        messages = consumer.get_items()
+        # the batch is split evenly
+        assert [m.stream for m in messages] == [STREAM, STREAM, STREAM2, STREAM2]
+        assert [m.content for m in messages[:2]] == TEST_DATASET
+        consumer.remove_item_from_consumer_group(messages[0].msgid, STREAM)
+        assert consumer.ack_batch(messages[2:]) == 2
+        # not acknowledged message is returned again
+        messages = consumer.get_items()
+        assert [m.content for m in messages] == [
+            TEST_DATASET[1],
+            {"other": "2"},
+            {"other": "3"},
+        ]
+
+    def test_different_groups(self):
+        self.redis_conn.xadd(name=STREAM2, fields={"other": "0"})
+        consumer = MultiStreamConsumer(
+            redis_conn=self.redis_conn,
+            streams={STREAM: GROUP, STREAM2: f"{GROUP}_2"},
+            batch_size=len(TEST_DATASET) * 2,
+            max_wait_time_ms=100,
+            poll_time_ms=10,
+            consumer_id=get_test_name(),
+        )
+        messages = consumer.get_items()
+        assert len(messages) == 3
+        assert consumer.ack_batch(messages) == 3
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+        assert self.redis_conn.xpending(STREAM2, f"{GROUP}_2")["pending"] == 0
+        consumer.resync_pending()
+        assert consumer.get_items() == []
@@ -1,5 +1,15 @@
+from unittest.mock import patch
+
+import pytest
+
 from redis_streams.consumer import Consumer
-from redis_streams.producer import Producer
+from redis_streams.producer import (
+    Backpressure,
+    BufferedProducer,
+    BufferFullError,
+    PartialPublishError,
+    Producer,
+)
 from redis_streams_test.base import TestBase
 from redis_streams_test.test_utils import STREAM, GROUP, get_test_name, TEST_DATASET
 
@@ -62,3 +72,151 @@ class TestProducerE2E(TestBase):
         assert STREAM in r
         assert "100" in r
 
+    def test_add_many_returns_ids_in_order(self):
+        producer = Producer(redis_conn=self.redis_conn, stream=STREAM)
+        initial_len = self.redis_conn.xlen(STREAM)
+        payloads = [{"iteration": str(i)} for i in range(7)]
+        ids = producer.add_many(iter(payloads), chunk_size=3)
+        assert len(ids) == len(payloads)
+        assert self.redis_conn.xlen(STREAM) == initial_len + len(payloads)
+        stored = self.redis_conn.xrange(STREAM, min=ids[0], max=ids[-1])
+        assert [msg_id for msg_id, _ in stored] == ids
+        assert [content for _, content in stored] == payloads
+
+    def test_add_many_reports_failures(self):
+        not_a_stream = f"{STREAM}_not_a_stream"
+        self.redis_conn.set(not_a_stream, "value")
+        producer = Producer(redis_conn=self.redis_conn, stream=not_a_stream)
+        try:
+            with pytest.raises(PartialPublishError) as exc_info:
+                producer.add_many([{"a": "1"}, {"b": "2"}, {"c": "3"}], chunk_size=2)
+        finally:
+            self.redis_conn.delete(not_a_stream)
+        assert exc_info.value.msg_ids == [None, None, None]
+        assert sorted(exc_info.value.failures) == [0, 1, 2]
+
+    def test_add_many_isolates_codec_errors(self):
+        producer = Producer(redis_conn=self.redis_conn, stream=STREAM, codec="json")
+        initial_len = self.redis_conn.xlen(STREAM)
+        with pytest.raises(PartialPublishError) as exc_info:
+            producer.add_many([{"a": 1}, {"not", "json"}, {"c": 3}], chunk_size=3)
+        assert list(exc_info.value.failures) == [1]
+        assert isinstance(exc_info.value.failures[1], TypeError)
+        assert exc_info.value.msg_ids[1] is None
+        assert None not in (exc_info.value.msg_ids[0], exc_info.value.msg_ids[2])
+        assert self.redis_conn.xlen(STREAM) == initial_len + 2
+
+    def test_add_many_invalid_chunk_size(self):
+        producer = Producer(redis_conn=self.redis_conn, stream=STREAM)
+        with pytest.raises(ValueError):
+            producer.add_many([{"a": "1"}], chunk_size=0)
+
+
+class TestBufferedProducerE2E(TestBase):
+
+    def test_flush_publishes_buffered_messages(self):
+        producer = BufferedProducer(
+            redis_conn=self.redis_conn, stream=STREAM, batch_size=100, linger_ms=60000
+        )
+        initial_len = self.redis_conn.xlen(STREAM)
+        futures = [producer.submit({"iteration": str(i)}) for i in range(5)]
+        assert producer.flush(timeout=5)
+        ids = [future.result(timeout=0) for future in futures]
+        assert ids == sorted(ids)
+        assert self.redis_conn.xlen(STREAM) == initial_len + 5
+        producer.close()
+
+    def test_linger_publishes_without_flush(self):
+        with BufferedProducer(
+            redis_conn=self.redis_conn, stream=STREAM, batch_size=100, linger_ms=10
+        ) as producer:
+            msg_id = producer.submit({"hello": "world"}).result(timeout=5)
+            assert "-" in msg_id
+            repr(producer)
+
+    def test_close_drains_buffer(self):
+        initial_len = self.redis_conn.xlen(STREAM)
+        producer = BufferedProducer(
+            redis_conn=self.redis_conn, stream=STREAM, batch_size=3, linger_ms=60000
+        )
+        futures = [producer.submit({"iteration": str(i)}) for i in range(7)]
+        producer.close()
+        assert all(future.done() for future in futures)
+        assert self.redis_conn.xlen(STREAM) == initial_len + 7
+        with pytest.raises(RuntimeError):
+            producer.submit({"too": "late"})
+
+    def test_backpressure_raise_and_drop(self):
+        for backpressure in (Backpressure.RAISE, Backpressure.DROP):
+            producer = BufferedProducer(
+                redis_conn=self.redis_conn,
+                stream=STREAM,
+                batch_size=2,
+                buffer_size=2,
+                linger_ms=60000,
+                backpressure=backpressure,
+            )
+            # fill the buffer while the background thread is busy
+            with producer._cond:
+                producer._in_flight = 2
+                if backpressure == Backpressure.RAISE:
+                    with pytest.raises(BufferFullError):
+                        producer.submit({"a": "1"})
+                else:
+                    future = producer.submit({"a": "1"})
+                    assert isinstance(future.exception(timeout=0), BufferFullError)
+                producer._in_flight = 0
+            producer.close()
+
+    def test_add_and_add_many_use_the_buffer(self):
+        initial_len = self.redis_conn.xlen(STREAM)
+        with BufferedProducer(
+            redis_conn=self.redis_conn, stream=STREAM, batch_size=100, linger_ms=10
+        ) as producer:
+            msg_id = producer.add({"hello": "world"})
+            assert "-" in msg_id
+            with patch.object(
+                producer, "_send_encoded", wraps=producer._send_encoded
+            ) as send_encoded:
+                ids = producer.add_many({"iteration": str(i)} for i in range(5))
+            # a single pipeline of the background thread
+            assert send_encoded.call_count == 1
+            assert ids == sorted(ids)
+        assert self.redis_conn.xlen(STREAM) == initial_len + 6
+
+    def test_add_many_reports_rejected_messages(self):
+        producer = BufferedProducer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            batch_size=1,
+            buffer_size=1,
+            linger_ms=60000,
+            backpressure=Backpressure.DROP,
+        )
+        with producer._cond:
+            producer._in_flight = 1
+            with pytest.raises(PartialPublishError) as exc_info:
+                producer.add_many([{"a": "1"}], chunk_size=1)
+            producer._in_flight = 0
+        assert exc_info.value.msg_ids == [None]
+        assert isinstance(exc_info.value.failures[0], BufferFullError)
+        producer.close()
+
+    def test_codec_errors_raise_on_submit(self):
+        initial_len = self.redis_conn.xlen(STREAM)
+        with BufferedProducer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            batch_size=100,
+            linger_ms=60000,
+            codec="json",
+        ) as producer:
+            future = producer.submit({"a": 1})
+            with pytest.raises(TypeError):
+                producer.submit({"not", "json"})
+            with pytest.raises(PartialPublishError) as exc_info:
+                producer.add_many([{"b": 2}, {"not", "json"}])
+            assert list(exc_info.value.failures) == [1]
+            assert isinstance(exc_info.value.failures[1], TypeError)
+            assert "-" in future.result(timeout=0)
+        assert self.redis_conn.xlen(STREAM) == initial_len + 2
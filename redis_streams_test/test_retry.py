@@ -0,0 +1,135 @@
+import time
+
+import pytest
+from redis import Redis
+
+from redis_streams.consumer import Consumer
+from redis_streams.retry import (
+    RETRY_ATTEMPT_FIELD,
+    RETRY_ORIGIN_FIELD,
+    RetryPolicy,
+    RetryScheduler,
+    _dump,
+    _load,
+)
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+
+class TestRetryPolicy:
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay_ms=100, max_delay_ms=1000, jitter=0)
+        assert [policy.delay_ms(attempt) for attempt in range(1, 6)] == [
+            100,
+            200,
+            400,
+            800,
+            1000,
+        ]
+
+    def test_jitter(self):
+        policy = RetryPolicy(base_delay_ms=1000, jitter=0.5)
+        delays = {policy.delay_ms(1) for _ in range(20)}
+        assert all(500 <= delay <= 1000 for delay in delays)
+        assert len(delays) > 1
+
+    def test_invalid_params(self):
+        with pytest.raises(ValueError):
+            RetryPolicy(base_delay_ms=100, max_delay_ms=10)
+        with pytest.raises(ValueError):
+            RetryPolicy(multiplier=0.5)
+        with pytest.raises(ValueError):
+            RetryPolicy(jitter=2)
+
+    def test_binary_fields(self):
+        fields = {"_payload": b"\x00\xff", "text": "data", RETRY_ATTEMPT_FIELD: 1}
+        assert _load(_dump(fields)) == fields
+
+
+class TestRetryScheduler(TestBase):
+
+    @pytest.fixture(autouse=True)
+    def retry_key(self):
+        self.scheduler = RetryScheduler(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            policy=RetryPolicy(base_delay_ms=50, jitter=0, max_retries=2),
+            pump_interval_ms=10,
+        )
+        self.redis_conn.delete(self.scheduler.key)
+        yield
+        self.scheduler.close()
+        self.redis_conn.delete(self.scheduler.key)
+
+    def _consumer(self, redis_conn=None):
+        return Consumer(
+            redis_conn=redis_conn or self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=2,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(),
+            retry_scheduler=self.scheduler,
+        )
+
+    def test_retry_later(self):
+        consumer = self._consumer()
+        messages = consumer.get_items()
+        assert [consumer.retry_later(message) for message in messages] == [50, 50]
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 0
+        assert self.scheduler.scheduled() == 2
+        # not due yet
+        assert self.scheduler.pump() == 0
+        assert consumer.get_items() == []
+        time.sleep(0.06)
+        assert self.scheduler.pump() == 2
+        assert self.scheduler.scheduled() == 0
+        retried = consumer.get_items()
+        assert [{"test": msg.content["test"]} for msg in retried] == TEST_DATASET
+        assert [msg.content[RETRY_ORIGIN_FIELD] for msg in retried] == [
+            msg.msgid for msg in messages
+        ]
+        assert retried[0].content[RETRY_ATTEMPT_FIELD] == "1"
+        assert consumer.retry_later(retried[0]) == 100
+
+    def test_out_of_retries(self):
+        consumer = self._consumer()
+        message = consumer.get_items()[0]
+        message.content[RETRY_ATTEMPT_FIELD] = "2"
+        assert consumer.retry_later(message) is None
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 2
+        with pytest.raises(ValueError):
+            Consumer(
+                redis_conn=self.redis_conn, stream=STREAM, consumer_group=GROUP
+            ).retry_later(message)
+
+    def test_background_pump(self):
+        consumer = self._consumer(redis_conn=Redis())
+        for message in consumer.get_items():
+            consumer.retry_later(message)
+        with self.scheduler:
+            time.sleep(0.2)
+        assert self.scheduler.scheduled() == 0
+        retried = consumer.get_items()
+        assert [msg.get("test") for msg in retried] == ["data1", "data2"]
+
+    def test_refuses_multiple_groups(self):
+        other_group = f"{GROUP}_other"
+        consumer = self._consumer()
+        message = consumer.get_items()[0]
+        consumer.retry_later(consumer.get_items()[1])
+        self.redis_conn.xgroup_create(STREAM, other_group, id="$")
+        try:
+            with pytest.raises(ValueError):
+                consumer.retry_later(message)
+            assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 1
+            time.sleep(0.06)
+            with pytest.raises(ValueError):
+                self.scheduler.pump()
+            assert self.scheduler.scheduled() == 1
+            # the other group would receive the retried message
+            assert self.redis_conn.xreadgroup(other_group, "c", {STREAM: ">"}) == []
+        finally:
+            self.redis_conn.xgroup_destroy(STREAM, other_group)
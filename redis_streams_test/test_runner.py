@@ -0,0 +1,101 @@
+import time
+
+from redis_streams.consumer import Consumer
+from redis_streams.runner import BatchRunner
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+
+def fail_on_data2(message):
+    if message.content == {"test": "data2"}:
+        raise ValueError("poison")
+    return message.msgid
+
+
+def slow_on_data2(message):
+    if message.content == {"test": "data2"}:
+        time.sleep(0.5)
+
+
+def slow_on_data1(message):
+    if message.content == {"test": "data1"}:
+        time.sleep(0.3)
+    return time.monotonic()
+
+
+class TestBatchRunner(TestBase):
+
+    def _consumer(self):
+        return Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            max_wait_time_ms=100,
+            poll_time_ms=10,
+            batch_size=len(TEST_DATASET),
+            consumer_id=get_test_name(),
+        )
+
+    def test_failed_messages_stay_pending(self):
+        with BatchRunner(
+            consumer=self._consumer(), handler=fail_on_data2, concurrency=2
+        ) as runner:
+            repr(runner)
+            assert runner.run_once() == (1, 1)
+            pending = self.redis_conn.xpending_range(STREAM, GROUP, "-", "+", 10)
+            assert len(pending) == 1
+            # failed message is part of the next batch
+            assert runner.run_once() == (0, 1)
+
+    def test_handler_timeout(self):
+        with BatchRunner(
+            consumer=self._consumer(),
+            handler=slow_on_data2,
+            concurrency=2,
+            max_in_flight=1,
+            handler_timeout_s=0.1,
+        ) as runner:
+            assert runner.run_once() == (1, 1)
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 1
+
+    def test_handler_timeout_excludes_queueing(self):
+        self.redis_conn.xadd(STREAM, {"test": "data3"})
+        consumer = self._consumer()
+        consumer.batch_size = 3
+        with BatchRunner(
+            consumer=consumer,
+            handler=slow_on_data1,
+            concurrency=1,
+            max_in_flight=3,
+            handler_timeout_s=0.1,
+        ) as runner:
+            # the fast messages waited for the slow one in the queue
+            assert runner.run_once() == (2, 1)
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 1
+
+    def test_timed_out_handler_stays_in_flight(self):
+        self.redis_conn.xadd(STREAM, {"test": "data3"})
+        consumer = self._consumer()
+        consumer.batch_size = 3
+        with BatchRunner(
+            consumer=consumer,
+            handler=slow_on_data1,
+            concurrency=2,
+            max_in_flight=1,
+            handler_timeout_s=0.1,
+        ) as runner:
+            start = time.monotonic()
+            assert runner.run_once() == (2, 1)
+            # the next message was submitted once the slow handler returned
+            assert time.monotonic() - start >= 0.3
+            assert all(future.done() for future in runner._timed_out)
+
+    def test_process_pool(self):
+        with BatchRunner(
+            consumer=self._consumer(),
+            handler=fail_on_data2,
+            concurrency=2,
+            use_processes=True,
+        ) as runner:
+            runner.run(max_batches=1)
+        assert self.redis_conn.xpending(STREAM, GROUP)["pending"] == 1
@@ -1,7 +1,8 @@
 import pytest
 
 from redis_streams.consumer import Consumer
-from redis_streams.scaler import Scale, Scaler
+from redis_streams.scaler import MultiScaler, PredictiveScaler, Scale, Scaler
+from redis_streams.snapshot import StreamSnapshot, collect_snapshots
 from redis_streams_test.base import TestBase
 from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
 
@@ -122,8 +123,7 @@ class TestMonitor(TestBase):
     def test_scaler_no_consumers(self):
         scaler = Scaler(redis_conn=self.redis_conn, stream=STREAM, consumer_group=GROUP)
         stream_lenght, stream_pending = scaler.collect_metrics()
-        # due to the implementation lenght is always lower than actual TODO: Fix
-        assert stream_lenght == len(TEST_DATASET) - 1
+        assert stream_lenght == len(TEST_DATASET)
         assert stream_pending == 0
 
     def test_scaler_invalid_scaling_threshold(self):
@@ -142,3 +142,129 @@ class TestMonitor(TestBase):
         stream_lenght, stream_pending = scaler.collect_metrics()
         assert stream_lenght == 0, stream_lenght
         assert stream_pending == 0, stream_pending
+
+
+def _snapshot(collected_at, added, lag, pending, consumers=2):
+    return StreamSnapshot(
+        stream=STREAM,
+        info={"length": added, "entries-added": added, "last-generated-id": "1-0"},
+        groups={GROUP: {"lag": lag, "pending": pending, "consumers": consumers}},
+        consumers={},
+        collected_at=collected_at,
+    )
+
+
+class TestPredictiveScaler(TestBase):
+
+    def test_target_consumers(self):
+        scaler = PredictiveScaler(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            target_latency_s=10,
+            target_utilization=0.8,
+            scale_out_cooldown_s=60,
+        )
+        assert scaler.get_target_consumers(_snapshot(0, 0, 0, 0)) == (
+            2,
+            Scale.NOSCALE.value,
+        )
+        # 100 arrivals / s, consumers were idle before, throughput is unknown
+        assert scaler.get_target_consumers(_snapshot(10, 1000, 500, 20)) == (
+            2,
+            Scale.NOSCALE.value,
+        )
+        assert scaler.arrival_rate == 100
+        # 60 completions / s by 2 busy consumers: 30 / s each
+        # (100 / s + 920 / 10 s) / (30 / s * 0.8) = 8
+        target, suggestion = scaler.get_target_consumers(_snapshot(20, 2000, 900, 20))
+        assert scaler.consumer_throughput == 30
+        assert (target, suggestion) == (8, Scale.OUT.value)
+        # cooldown
+        assert scaler.get_target_consumers(_snapshot(30, 3000, 1800, 20)) == (
+            2,
+            Scale.NOSCALE.value,
+        )
+
+    def test_scale_in_hysteresis(self):
+        scaler = PredictiveScaler(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            scale_in_margin=0.5,
+            scale_in_cooldown_s=0,
+        )
+        scaler.consumer_throughput = 10
+        scaler.arrival_rate = 50
+        # 50 / s needs 7 consumers of 10 / s at 80%, less than half of 10 to remove
+        assert scaler.get_target_consumers(_snapshot(0, 0, 0, 0, consumers=10))[0] == 10
+        # no arrivals, the rate is smoothed to 0.7 * 30 / s = 21 / s
+        scaler.arrival_rate = 30
+        assert scaler.get_target_consumers(_snapshot(1, 0, 0, 0, consumers=10)) == (
+            3,
+            Scale.IN.value,
+        )
+
+    def test_arrivals_without_entries_added(self):
+        scaler = PredictiveScaler(
+            redis_conn=self.redis_conn, stream=STREAM, consumer_group=GROUP
+        )
+        snapshot = collect_snapshots(self.redis_conn, [STREAM])[STREAM]
+        snapshot.info.pop("entries-added", None)
+        scaler.collect_metrics(snapshot)
+        for no in range(5):
+            self.redis_conn.xadd(STREAM, {"test": f"more{no}"})
+        snapshot = collect_snapshots(self.redis_conn, [STREAM])[STREAM]
+        snapshot.info.pop("entries-added", None)
+        snapshot.collected_at = scaler._last_sample.collected_at + 1
+        assert scaler.get_target_consumers(snapshot) == (1, Scale.OUT.value)
+        assert scaler.arrival_rate == 5
+
+
+class TestMultiScaler(TestBase):
+    stream = f"{STREAM}_multi"
+
+    @pytest.fixture(autouse=True)
+    def other_stream(self):
+        self.redis_conn.delete(self.stream)
+        yield
+        self.redis_conn.delete(self.stream)
+
+    def test_multi_scaler(self):
+        scaler = MultiScaler(
+            redis_conn=self.redis_conn, streams={STREAM: GROUP, self.stream: [GROUP]}
+        )
+        for no in range(3):
+            self.redis_conn.xadd(self.stream, {"test": f"other{no}"})
+        Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=2,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(),
+        ).get_items()
+        decisions, aggregate = scaler.get_scale_decisions(
+            scale_out_rate=60, scale_in_rate=20
+        )
+        assert len(TEST_DATASET) == 2
+        assert scaler.metrics == {
+            (STREAM, GROUP): (0, 2, 1),
+            (self.stream, GROUP): (3, 0, 0),
+        }
+        # nothing is pending, but there are messages to consume
+        assert decisions[(self.stream, GROUP)] == (0, Scale.OUT.value)
+        # everything is read, the rate is the minimal 1%
+        assert decisions[(STREAM, GROUP)] == (1, Scale.NOSCALE.value)
+        # 3 waiting / 2 pending of the pool
+        assert aggregate == (100, Scale.OUT.value)
+
+    def test_multi_scaler_no_scale(self):
+        scaler = MultiScaler(redis_conn=self.redis_conn, streams=[(self.stream, GROUP)])
+        decisions, aggregate = scaler.get_scale_decisions()
+        assert decisions == {(self.stream, GROUP): (0, Scale.NOSCALE.value)}
+        assert aggregate == (0, Scale.NOSCALE.value)
+        with pytest.raises(ValueError):
+            MultiScaler(redis_conn=self.redis_conn, streams=[])
+        with pytest.raises(ValueError):
+            scaler.get_scale_decisions(scale_in_rate=11, scale_out_rate=10)
@@ -0,0 +1,89 @@
+from redis_streams.consumer import Consumer
+from redis_streams.monitor import Monitor
+from redis_streams.scaler import Scaler
+from redis_streams.snapshot import (
+    collect_snapshots,
+    group_lag,
+    lag_from_info,
+    lag_from_scan,
+    lag_scan_args,
+    snapshot_from_info,
+)
+from redis_streams_test.base import TestBase
+from redis_streams_test.test_utils import GROUP, STREAM, TEST_DATASET, get_test_name
+
+
+class TestSnapshot(TestBase):
+
+    def test_collect_snapshots(self):
+        Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=1,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(),
+        ).get_items()
+        self.redis_conn.xgroup_create(STREAM, f"{GROUP}_idle", id="0")
+        missing = f"{STREAM}_missing"
+        snapshots = collect_snapshots(self.redis_conn, [STREAM, missing])
+        snapshot = snapshots[STREAM]
+        assert snapshot.length == len(TEST_DATASET)
+        assert set(snapshot.groups) == {GROUP, f"{GROUP}_idle"}
+        assert snapshot.groups[GROUP]["pending"] == 1
+        # consumers are collected only for groups having them
+        assert list(snapshot.consumers) == [GROUP]
+        assert snapshot.consumers[GROUP][0]["name"] == get_test_name()
+        assert not snapshots[missing].exists
+        assert snapshots[missing].length == 0
+        assert not collect_snapshots(self.redis_conn, [STREAM], consumers=False)[
+            STREAM
+        ].consumers
+
+    def test_monitor_and_scaler_with_snapshot(self):
+        Consumer(
+            redis_conn=self.redis_conn,
+            stream=STREAM,
+            consumer_group=GROUP,
+            batch_size=2,
+            max_wait_time_ms=100,
+            consumer_id=get_test_name(),
+        ).get_items()
+        monitor = Monitor(
+            redis_conn=self.redis_conn, stream=STREAM, consumer_group=GROUP
+        )
+        scaler = Scaler(redis_conn=self.redis_conn, stream=STREAM, consumer_group=GROUP)
+        snapshot = collect_snapshots(self.redis_conn, [STREAM])[STREAM]
+        monitor.collect_monitoring_data(auto_cleanup=False, snapshot=snapshot)
+        assert monitor.collected_consumers_data[0].pending_items == 2
+        assert scaler.collect_metrics(snapshot=snapshot) == (0, 2)
+
+    def test_group_lag(self):
+        self.redis_conn.xgroup_create(STREAM, GROUP, id="0")
+        snapshot = collect_snapshots(self.redis_conn, [STREAM])[STREAM]
+        # nothing delivered yet
+        assert group_lag(self.redis_conn, snapshot, GROUP) == len(TEST_DATASET)
+        assert group_lag(self.redis_conn, snapshot, "missing") == len(TEST_DATASET)
+        for no in range(10):
+            self.redis_conn.xadd(STREAM, {"test": f"more{no}"})
+        self.redis_conn.xreadgroup(GROUP, get_test_name(), {STREAM: ">"}, count=1)
+        snapshot = collect_snapshots(self.redis_conn, [STREAM])[STREAM]
+        lag = len(TEST_DATASET) + 9
+        assert group_lag(self.redis_conn, snapshot, GROUP) == lag
+        # more than max_scan: estimated from the ID timestamps
+        assert 4 <= group_lag(self.redis_conn, snapshot, GROUP, max_scan=3) <= lag + 1
+        snapshot.groups[GROUP]["lag"] = 42
+        assert group_lag(self.redis_conn, snapshot, GROUP) == 42
+
+    def test_lag_from_responses(self):
+        self.redis_conn.xgroup_create(STREAM, GROUP, id="0")
+        self.redis_conn.xreadgroup(GROUP, get_test_name(), {STREAM: ">"}, count=1)
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.xinfo_stream(name=STREAM)
+        pipe.xinfo_groups(name=STREAM)
+        snapshot = snapshot_from_info(STREAM, *pipe.execute(raise_on_error=False))
+        assert snapshot.groups[GROUP]["pending"] == 1
+        assert lag_from_info(snapshot, "missing") == len(TEST_DATASET)
+        entries = self.redis_conn.xrange(**lag_scan_args(snapshot, GROUP))
+        assert lag_from_scan(snapshot, GROUP, entries) == 1
+        assert lag_from_info(snapshot, GROUP) in (None, 1)
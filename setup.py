@@ -67,7 +67,9 @@ setup_options = dict(
             "vulture",
             "types-tabulate",
             "types-requests",
-        ]
+        ],
+        "numpy": ["numpy"],
+        "msgpack": ["msgpack"],
     },
     license="GNU General Public License v3.0",
     classifiers=[  # https://pypi.org/classifiers/